@@ -1,16 +1,34 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 import uvicorn
+import asyncio
+import os
 import time
+import hmac
 import logging
-from main_optimized import find_matching_segments, initialize_services
+import main_optimized
+from main_optimized import (
+    hybrid_search,
+    start_background_initialization,
+    start_background_reload,
+    active_index_version,
+    vector_backend_metrics,
+    readiness,
+)
+from embedding_cache import get_embedding_cache
+from service_readiness import RETRY_AFTER_SECONDS
+from backend_resilience import BackendUnavailable, prometheus_text
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Required in X-Admin-Token for /admin/reload, which answers 403 while it is unset
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
 # Initialize FastAPI app
 app = FastAPI(
     title="SPARK AI Audience Segment Search API",
@@ -31,12 +49,18 @@ app.add_middleware(
 class SearchRequest(BaseModel):
     query: str
     top_k: Optional[int] = 5
+    category: Optional[str] = None
+    sub_category: Optional[str] = None
+    # Reciprocal rank fusion weights (defaults: HYBRID_VECTOR_WEIGHT / HYBRID_LEXICAL_WEIGHT)
+    vector_weight: Optional[float] = None
+    lexical_weight: Optional[float] = None
 
 class SearchResult(BaseModel):
     topic: str
     topic_id: str
     score: float
     segment_id: str
+    description: Optional[str] = None
 
 class SearchResponse(BaseModel):
     results: List[SearchResult]
@@ -44,13 +68,19 @@ class SearchResponse(BaseModel):
     total_time: float
     embedding_time: float
     query_time: float
+    # Catalog snapshot that served the request; clients caching results should key on it
+    index_version: Optional[str] = None
+
+class ReloadRequest(BaseModel):
+    # Activate an existing snapshot; omitted = build one from the current catalog
+    version: Optional[str] = None
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize services on startup."""
+    """Start loading services in the background so the server accepts traffic right away."""
     logger.info("🚀 Starting SPARK AI Audience Segment Search API...")
-    initialize_services()
-    logger.info("✅ API ready to serve requests!")
+    start_background_initialization()
+    logger.info("✅ API accepting requests (model loading in background, see /ready)")
 
 @app.get("/")
 async def root():
@@ -75,8 +105,19 @@ async def search_segments(request: SearchRequest):
     try:
         start_time = time.time()
         
-        # Perform the search
-        results = find_matching_segments(request.query, request.top_k)
+        loop = asyncio.get_event_loop()
+        # Perform the search in the thread pool so concurrent requests can share an encode batch.
+        # While the encoder loads, only BM25 and cached embeddings can answer.
+        results = await loop.run_in_executor(
+            None, hybrid_search, request.query, request.top_k, request.vector_weight,
+            request.lexical_weight, request.category, request.sub_category
+        )
+        if results is None:
+            raise HTTPException(
+                status_code=503,
+                detail="Model is still loading, retry shortly",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+            )
         
         total_time = time.time() - start_time
         
@@ -86,7 +127,8 @@ async def search_segments(request: SearchRequest):
                 topic=result['topic'],
                 topic_id=result['topic_id'],
                 score=result['score'],
-                segment_id=result['segment_id']
+                segment_id=result['segment_id'],
+                description=result.get('description')
             )
             for result in results
         ]
@@ -96,9 +138,19 @@ async def search_segments(request: SearchRequest):
             query=request.query,
             total_time=total_time,
             embedding_time=total_time * 0.7,  # Approximate
-            query_time=total_time * 0.3       # Approximate
+            query_time=total_time * 0.3,      # Approximate
+            index_version=active_index_version()
         )
         
+    except HTTPException:
+        raise
+    except BackendUnavailable as e:
+        # Circuit open, no fallback tier and nothing from BM25
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": str(max(int(e.retry_after + 0.999), 1))})
+    except TimeoutError as e:
+        logger.error(f"Search timeout: {str(e)}")
+        raise HTTPException(status_code=504, detail="Vector index timed out")
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
@@ -109,9 +161,45 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": time.time(),
-        "service": "SPARK AI Audience Segment Search"
+        "service": "SPARK AI Audience Segment Search",
+        "index_version": active_index_version()
     }
 
+@app.post("/admin/reload", status_code=202)
+async def reload_index(request: ReloadRequest = ReloadRequest(), x_admin_token: Optional[str] = Header(None)):
+    """Build or activate a catalog snapshot in the background and hot-swap it in."""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_API_TOKEN to enable them")
+    if not hmac.compare_digest(x_admin_token or "", ADMIN_API_TOKEN):
+        raise HTTPException(status_code=401, detail="Missing or invalid X-Admin-Token")
+    if not start_background_reload(request.version):
+        raise HTTPException(status_code=409, detail="A reload is already in progress")
+    return {"active_version": active_index_version(), "requested_version": request.version, "reloading": True}
+
+@app.get("/ready")
+async def ready_check():
+    """Readiness check: 200 once the model is loaded, 503 with loading progress until then."""
+    status = readiness.status()
+    if status["ready"]:
+        return status
+    return JSONResponse(status_code=503, content=status, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+@app.get("/stats")
+async def get_stats():
+    """Get embedding scheduler and cache statistics."""
+    scheduler = main_optimized._scheduler
+    return {
+        "model": main_optimized.MODEL_NAME,
+        "embedding_scheduler": scheduler.stats() if scheduler else None,
+        "embedding_cache": get_embedding_cache().stats(),
+        "vector_backend": main_optimized._backend.stats() if main_optimized._backend else None
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Vector backend breaker state, hedge rate and latency in Prometheus text format."""
+    return prometheus_text(vector_backend_metrics())
+
 if __name__ == "__main__":
     # Run the server
     uvicorn.run(
@@ -3,11 +3,15 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 import uvicorn
+import asyncio
 import time
 import logging
-import os
-from dotenv import load_dotenv
-import pinecone
+import numpy as np
+from lexical_index import load_lexical_index, load_descriptions
+from phrase_matcher import load_phrase_matcher
+from metadata_store import load_metadata_store
+from vector_backends import SEARCH_BACKEND
+from backend_resilience import BackendUnavailable, load_resilient_backend
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -30,29 +34,12 @@ app.add_middleware(
 )
 
 # Global variables
-_pinecone_client = None
-_index = None
+_backend = None  # VectorBackend picked by SEARCH_BACKEND; Pinecone queries use the pooled async client
+_lexical_index = None
+_phrase_matcher = None
+_metadata_store = None  # Segment ID -> topic/description, so Pinecone can skip include_metadata
 _initialized = False
 
-# Pre-defined common queries for instant results
-COMMON_QUERIES = {
-    'digital marketing': ['Digital Marketing', 'Marketing Skills', 'Digital Agency'],
-    'business': ['Business', 'Entrepreneurship', 'Startup'],
-    'weight loss': ['Weight Loss', 'Fitness', 'Health'],
-    'productivity': ['Productivity', 'Time Management', 'Work'],
-    'sleep': ['Sleep', 'Health', 'Wellness'],
-    'coding': ['Programming', 'Technology', 'Software'],
-    'investment': ['Investment', 'Finance', 'Stocks'],
-    'vacation': ['Travel', 'Vacation', 'Leisure'],
-    'house': ['Real Estate', 'Home Buying', 'Property'],
-    'podcast': ['Podcasting', 'Content Creation', 'Media'],
-    'marketing': ['Marketing', 'Digital Marketing', 'Advertising'],
-    'fitness': ['Fitness', 'Health', 'Exercise'],
-    'technology': ['Technology', 'Software', 'Programming'],
-    'finance': ['Finance', 'Investment', 'Money'],
-    'education': ['Education', 'Learning', 'Training']
-}
-
 # Pydantic models
 class SearchRequest(BaseModel):
     query: str
@@ -72,77 +59,58 @@ class SearchResponse(BaseModel):
     method: str
 
 def initialize_services():
-    """Initialize Pinecone connection."""
-    global _pinecone_client, _index, _initialized
+    """Initialize the BM25 catalog index and the vector backend (Pinecone by default)."""
+    global _backend, _lexical_index, _phrase_matcher, _metadata_store, _initialized
     
     if _initialized:
         return
     
-    load_dotenv()
-    api_key = os.getenv("PINECONE_API_KEY")
-    environment = os.getenv("PINECONE_ENV")
-    
-    if not api_key or not environment:
-        raise ValueError("Missing Pinecone credentials")
+    # Keyword matches come from a BM25 index over the real segment catalog
+    descriptions = load_descriptions()
+    _lexical_index = load_lexical_index(descriptions=descriptions)
+    catalog = _lexical_index.segments if _lexical_index else None
+    _phrase_matcher = load_phrase_matcher(catalog)
+    _metadata_store = load_metadata_store(catalog, descriptions)
     
-    _pinecone_client = pinecone.Pinecone(api_key=api_key)
-    _index = _pinecone_client.Index("audiencelab-embeddings-1024")
+    _backend = load_resilient_backend(SEARCH_BACKEND, metadata_store=_metadata_store, async_client=True)
     _initialized = True
     logger.info("✅ Services initialized!")
 
-def find_common_matches(user_query: str) -> Optional[List[str]]:
-    """Check if query matches common patterns for instant results."""
-    query_lower = user_query.lower()
-    
-    for pattern, matches in COMMON_QUERIES.items():
-        if pattern in query_lower:
-            return matches
-    
-    return None
-
-def search_segments_fast(user_query: str, top_k: int = 5) -> List[Dict]:
-    """Ultra-fast search using keyword matching first, then Pinecone fallback."""
-    global _index
-    
+def find_keyword_matches(user_query: str, top_k: int = 5) -> Optional[List[Dict]]:
+    """
+    Catalog segments named in the query (Aho-Corasick phrase matches), topped
+    up with BM25 keyword matches; None when nothing in the catalog matches.
+    """
+    results = _phrase_matcher.match_segments(user_query, top_k) if _phrase_matcher else []
+    if len(results) < top_k and _lexical_index is not None:
+        seen = {result['segment_id'] for result in results}
+        for result in _lexical_index.query(user_query, top_k):
+            if result['segment_id'] not in seen and len(results) < top_k:
+                results.append(result)
+    return results or None
+
+async def search_segments_fast(user_query: str, top_k: int = 5) -> List[Dict]:
+    """Ultra-fast search using keyword matching first, then a vector backend fallback."""
     initialize_services()
     
-    # First, try common query matching for instant results
-    common_matches = find_common_matches(user_query)
+    # First, try keyword matching for instant results (no embedding needed)
+    keyword_matches = find_keyword_matches(user_query, top_k)
     
-    if common_matches:
-        # Return instant results based on common patterns
-        results = []
-        for i, topic in enumerate(common_matches[:top_k]):
-            results.append({
-                'topic': topic,
-                'topic_id': f'common_{i}',
-                'score': 0.9 - (i * 0.1),
-                'segment_id': f'segment_common_{i}',
-                'method': 'instant_keyword_match'
-            })
-        return results, 'instant_keyword_match'
+    if keyword_matches:
+        for result in keyword_matches:
+            result['method'] = 'instant_keyword_match'
+        return keyword_matches, 'instant_keyword_match'
     
-    # Fallback: Use dummy vector for Pinecone query
-    dummy_vector = [0.1] * 1024
+    # Fallback: Use dummy vector for the vector backend query
+    dummy_vector = np.full(_backend.dimension() or 1024, 0.1, dtype=np.float32)
+    method = f"{SEARCH_BACKEND}_fallback"
     
-    response = _index.query(
-        vector=dummy_vector,
-        top_k=top_k,
-        include_metadata=True
-    )
+    # Awaited on the event loop: concurrent fallbacks overlap their network waits
+    results = await _backend.aquery(dummy_vector, top_k)
+    for result in results:
+        result['method'] = method
     
-    results = []
-    for match in response.matches:
-        metadata = match.metadata or {}
-        results.append({
-            'topic': metadata.get('topic', 'N/A'),
-            'topic_id': metadata.get('topic_ID', 'N/A'),
-            'score': match.score,
-            'segment_id': match.id,
-            'method': 'pinecone_fallback'
-        })
-    
-    return results, 'pinecone_fallback'
+    return results, method
 
 @app.on_event("startup")
 async def startup_event():
@@ -151,6 +119,12 @@ async def startup_event():
     initialize_services()
     logger.info("✅ API ready to serve requests!")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close pooled Pinecone connections."""
+    if hasattr(_backend, "aclose"):
+        await _backend.aclose()
+
 @app.get("/")
 async def root():
     """Health check endpoint."""
@@ -168,7 +142,7 @@ async def search_segments(request: SearchRequest):
         start_time = time.time()
         
         # Perform the search
-        results, method = search_segments_fast(request.query, request.top_k)
+        results, method = await search_segments_fast(request.query, request.top_k)
         
         total_time = time.time() - start_time
         
@@ -191,6 +165,12 @@ async def search_segments(request: SearchRequest):
             method=method
         )
         
+    except BackendUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": str(max(int(e.retry_after + 0.999), 1))})
+    except asyncio.TimeoutError as e:
+        logger.error(f"Search timeout: {str(e)}")
+        raise HTTPException(status_code=504, detail="Vector index timed out")
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
@@ -209,8 +189,10 @@ async def health_check():
 async def get_stats():
     """Get API statistics."""
     return {
-        "common_patterns": len(COMMON_QUERIES),
-        "supported_keywords": list(COMMON_QUERIES.keys()),
+        "lexical_index": _lexical_index.stats() if _lexical_index else None,
+        "phrase_matcher": _phrase_matcher.stats() if _phrase_matcher else None,
+        "metadata_store": _metadata_store.stats() if _metadata_store else None,
+        "vector_backend": _backend.stats() if _backend else None,
         "initialized": _initialized
     }
 
@@ -1,20 +1,41 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 import uvicorn
+import asyncio
 import time
+import hmac
 import logging
 import os
-from dotenv import load_dotenv
-import pinecone
-from sentence_transformers import SentenceTransformer
 import numpy as np
+# Model, vector backend, BM25 and snapshot reloads are shared with main_optimized; only the async query path lives here
+import main_optimized
+from main_optimized import (
+    ENCODER_KEY,
+    HYBRID_VECTOR_WEIGHT,
+    HYBRID_LEXICAL_WEIGHT,
+    HYBRID_CANDIDATES,
+    initialize_services,
+    start_background_initialization,
+    start_background_reload,
+    with_descriptions,
+    readiness,
+)
+from embedding_cache import get_embedding_cache
+from service_readiness import RETRY_AFTER_SECONDS
+from lexical_index import reciprocal_rank_fusion
+from vector_backends import SEARCH_BACKEND
+from backend_resilience import BackendUnavailable, backend_metrics, prometheus_text
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Required in X-Admin-Token for /segments writes and /admin/reload; those answer 403 while it is unset
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+
 # Initialize FastAPI app
 app = FastAPI(
     title="SPARK AI Optimized Audience Segment Search API",
@@ -31,16 +52,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global variables
-_model = None
-_pinecone_client = None
-_index = None
-_initialized = False
-
 # Pydantic models
 class SearchRequest(BaseModel):
     query: str
     top_k: Optional[int] = 5
+    category: Optional[str] = None
+    sub_category: Optional[str] = None
+    # Reciprocal rank fusion weights (defaults: HYBRID_VECTOR_WEIGHT / HYBRID_LEXICAL_WEIGHT)
+    vector_weight: Optional[float] = None
+    lexical_weight: Optional[float] = None
 
 class SearchResult(BaseModel):
     topic: str
@@ -48,6 +68,7 @@ class SearchResult(BaseModel):
     score: float
     segment_id: str
     method: str
+    description: Optional[str] = None
 
 class SearchResponse(BaseModel):
     results: List[SearchResult]
@@ -55,96 +76,143 @@ class SearchResponse(BaseModel):
     total_time: float
     embedding_time: float
     query_time: float
+    # Catalog snapshot that served the request; clients caching results should key on it
+    index_version: Optional[str] = None
 
-def normalize(vec):
-    """Normalize a vector to unit length (L2 norm)."""
-    vec = np.array(vec)
-    norm = np.linalg.norm(vec)
-    if norm == 0:
-        return vec
-    return vec / norm
+class ReloadRequest(BaseModel):
+    # Activate an existing snapshot; omitted = build one from the current catalog
+    version: Optional[str] = None
 
-def initialize_services():
-    """Initialize and cache the model and Pinecone connection."""
-    global _model, _pinecone_client, _index, _initialized
+class SegmentUpsert(BaseModel):
+    topic: str
+    category: Optional[str] = ""
+    sub_category: Optional[str] = ""
+    segment_id: Optional[str] = None
+    # Encoded from the topic when omitted
+    embedding: Optional[List[float]] = None
+
+async def search_segments_optimized(user_query: str, top_k: int = 5, category: Optional[str] = None,
+                                    sub_category: Optional[str] = None) -> List[Dict]:
+    """Optimized search using BAAI/bge-large-en-v1.5 embeddings (call once services are ready)."""
+    start_time = time.time()
     
-    if _initialized:
-        return
+    # Generate embedding in the thread pool (batched with concurrent requests)
+    logger.info(f"🔎 Generating embedding for: '{user_query}'")
+    loop = asyncio.get_running_loop()
+    embedding = await loop.run_in_executor(
+        None, get_embedding_cache().get_or_compute, user_query, ENCODER_KEY, main_optimized._scheduler.encode
+    )
     
-    start_time = time.time()
+    embedding_time = time.time() - start_time
     
-    # Load the BAAI/bge-large-en-v1.5 model (cached for performance)
-    if _model is None:
-        logger.info("🔄 Loading embedding model (BAAI/bge-large-en-v1.5)...")
-        _model = SentenceTransformer("BAAI/bge-large-en-v1.5")
-        logger.info("✅ Model loaded and cached!")
+    # Query the vector index with the real embedding
+    logger.info(f"📡 Querying {SEARCH_BACKEND} index for top {top_k} matches...")
+    results = await _query_backend(embedding, top_k, 'semantic_search', category, sub_category)
     
-    # Initialize Pinecone connection
-    if _pinecone_client is None:
-        load_dotenv()
-        api_key = os.getenv("PINECONE_API_KEY")
-        environment = os.getenv("PINECONE_ENV")
-        
-        if not api_key or not environment:
-            raise ValueError("Missing Pinecone credentials")
-        
-        logger.info("🔗 Connecting to Pinecone...")
-        _pinecone_client = pinecone.Pinecone(api_key=api_key)
-        _index = _pinecone_client.Index("audiencelab-embeddings-1024")
-        logger.info("✅ Pinecone connected!")
+    query_time = time.time() - start_time - embedding_time
+    total_time = time.time() - start_time
     
-    _initialized = True
-    logger.info(f"🚀 Services initialized in {time.time() - start_time:.2f} seconds")
-
-def search_segments_optimized(user_query: str, top_k: int = 5) -> List[Dict]:
-    """Optimized search using BAAI/bge-large-en-v1.5 embeddings."""
-    global _model, _index
+    logger.info(f"⚡ Search completed in {total_time:.3f}s (embedding: {embedding_time:.3f}s, query: {query_time:.3f}s)")
     
-    initialize_services()
+    return results, total_time, embedding_time, query_time
+
+async def search_segments_without_encoder(user_query: str, top_k: int = 5, category: Optional[str] = None,
+                                          sub_category: Optional[str] = None):
+    """Serve a search from a cached embedding while the model is still loading (None if not possible)."""
+    if main_optimized._backend is None:
+        return None
     
     start_time = time.time()
-    
-    # Generate embedding using the actual model
-    logger.info(f"🔎 Generating embedding for: '{user_query}'")
-    embedding = _model.encode(user_query)
-    embedding = normalize(embedding)
+    embedding = get_embedding_cache().get(user_query, ENCODER_KEY)
+    if embedding is None:
+        return None
     
     embedding_time = time.time() - start_time
+    results = await _query_backend(embedding, top_k, 'cached_embedding', category, sub_category)
+    total_time = time.time() - start_time
     
-    # Query Pinecone with the real embedding
-    logger.info(f"📡 Querying Pinecone for top {top_k} matches...")
-    response = _index.query(
-        vector=embedding.tolist(),
-        top_k=top_k,
-        include_metadata=True
-    )
-    
-    query_time = time.time() - start_time - embedding_time
+    return results, total_time, embedding_time, total_time - embedding_time
+
+async def search_segments_hybrid(user_query: str, top_k: int = 5, vector_weight: Optional[float] = None,
+                                 lexical_weight: Optional[float] = None, category: Optional[str] = None,
+                                 sub_category: Optional[str] = None):
+    """BM25 + vector search fused by reciprocal rank; exact segment names skip the encoder (None if unservable)."""
+    vector_weight = HYBRID_VECTOR_WEIGHT if vector_weight is None else vector_weight
+    lexical_weight = HYBRID_LEXICAL_WEIGHT if lexical_weight is None else lexical_weight
+    search = search_segments_optimized if readiness.ready else search_segments_without_encoder
+    lexical_index = main_optimized._lexical_index  # One version for the whole request, even if a reload swaps it
+    if lexical_index is None:
+        return await search(user_query, top_k, category, sub_category)
+    if lexical_weight <= 0:
+        try:
+            return await search(user_query, top_k, category, sub_category)
+        except (BackendUnavailable, asyncio.TimeoutError) as e:
+            return _lexical_fallback(lexical_index, e, user_query, top_k, category, sub_category)
     
-    # Process results
-    results = []
-    for match in response.matches:
-        metadata = match.metadata or {}
-        results.append({
-            'topic': metadata.get('topic', 'N/A'),
-            'topic_id': metadata.get('topic_ID', 'N/A'),
-            'score': match.score,
-            'segment_id': match.id,
-            'method': 'semantic_search'
-        })
+    start_time = time.time()
+    candidates = max(top_k, HYBRID_CANDIDATES)
+    lexical = with_descriptions(lexical_index.query(user_query, candidates, category, sub_category))
+    for result in lexical:
+        result['method'] = 'bm25'
+    lexical_time = time.time() - start_time
     
-    total_time = time.time() - start_time
+    if vector_weight <= 0 or (lexical and lexical_index.is_exact_topic(user_query)):
+        return lexical[:top_k], lexical_time, 0.0, lexical_time
     
-    logger.info(f"⚡ Search completed in {total_time:.3f}s (embedding: {embedding_time:.3f}s, query: {query_time:.3f}s)")
+    try:
+        outcome = await search(user_query, candidates, category, sub_category)
+    except (BackendUnavailable, asyncio.TimeoutError) as e:
+        if not lexical:
+            raise
+        logger.warning(f"⚠️  Vector search unavailable ({e}), serving BM25 results")
+        return lexical[:top_k], lexical_time, 0.0, lexical_time
+    if outcome is None:
+        if not lexical:
+            return None
+        return lexical[:top_k], lexical_time, 0.0, lexical_time
+    vector, _, embedding_time, _ = outcome
     
-    return results, total_time, embedding_time, query_time
+    results = reciprocal_rank_fusion([vector, lexical], [vector_weight, lexical_weight], top_k)
+    for result in results:
+        result['method'] = 'hybrid_rrf'
+    total_time = time.time() - start_time
+    return results, total_time, embedding_time, total_time - embedding_time
+
+def _lexical_fallback(lexical_index, error: Exception, user_query: str, top_k: int,
+                      category: Optional[str], sub_category: Optional[str]):
+    """BM25 results while the remote vector store is down or too slow; re-raises when BM25 finds nothing."""
+    start_time = time.time()
+    results = with_descriptions(lexical_index.query(user_query, top_k, category, sub_category))
+    if not results:
+        raise error
+    for result in results:
+        result['method'] = 'bm25'
+    logger.warning(f"⚠️  Vector search unavailable ({error}), serving BM25 results")
+    lexical_time = time.time() - start_time
+    return results, lexical_time, 0.0, lexical_time
+
+async def _query_backend(embedding: np.ndarray, top_k: int, method: str, category: Optional[str] = None,
+                          sub_category: Optional[str] = None) -> List[Dict]:
+    """Query the vector backend with a normalized embedding and tag the matches with the search method."""
+    # Pinecone is awaited on the event loop; local and pgvector queries run in the thread pool
+    results = await main_optimized._backend.aquery(embedding, top_k, category, sub_category)
+    for result in results:
+        result['method'] = method
+    return results
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize services on startup."""
+    """Start loading services in the background so the server accepts traffic right away."""
     logger.info("🚀 Starting SPARK AI Optimized Search API...")
-    initialize_services()
-    logger.info("✅ API ready to serve requests!")
+    start_background_initialization(async_client=True)
+    logger.info("✅ API accepting requests (model loading in background, see /ready)")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close pooled Pinecone connections."""
+    backend = main_optimized._backend
+    if hasattr(backend, "aclose"):
+        await backend.aclose()
 
 @app.get("/")
 async def root():
@@ -161,8 +229,20 @@ async def root():
 async def search_segments(request: SearchRequest):
     """Optimized search endpoint using real embeddings."""
     try:
-        # Perform the search with actual embeddings
-        results, total_time, embedding_time, query_time = search_segments_optimized(request.query, request.top_k)
+        # Encoding and local scoring run in the thread pool (concurrent requests share an encode
+        # batch); Pinecone calls are awaited. While the encoder loads, only BM25 and cached
+        # embeddings can answer.
+        outcome = await search_segments_hybrid(
+            request.query, request.top_k, request.vector_weight,
+            request.lexical_weight, request.category, request.sub_category
+        )
+        if outcome is None:
+            raise HTTPException(
+                status_code=503,
+                detail="Model is still loading, retry shortly",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+            )
+        results, total_time, embedding_time, query_time = outcome
         
         # Convert to Pydantic models
         search_results = [
@@ -171,7 +251,8 @@ async def search_segments(request: SearchRequest):
                 topic_id=result['topic_id'],
                 score=result['score'],
                 segment_id=result['segment_id'],
-                method=result['method']
+                method=result['method'],
+                description=result.get('description')
             )
             for result in results
         ]
@@ -181,13 +262,80 @@ async def search_segments(request: SearchRequest):
             query=request.query,
             total_time=total_time,
             embedding_time=embedding_time,
-            query_time=query_time
+            query_time=query_time,
+            index_version=main_optimized._index_version
         )
         
+    except HTTPException:
+        raise
+    except BackendUnavailable as e:
+        # Circuit open, no fallback tier and nothing from BM25
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": str(max(int(e.retry_after + 0.999), 1))})
+    except asyncio.TimeoutError as e:
+        logger.error(f"Search timeout: {str(e)}")
+        raise HTTPException(status_code=504, detail="Vector index timed out")
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
+def _require_admin(token: Optional[str]):
+    """403 while no ADMIN_API_TOKEN is configured, 401 unless the request carries it."""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_API_TOKEN to enable them")
+    if not hmac.compare_digest(token or "", ADMIN_API_TOKEN):
+        raise HTTPException(status_code=401, detail="Missing or invalid X-Admin-Token")
+
+def _mutable_backend():
+    """The vector backend when it accepts updates through the API, else a 409 (callers check _require_admin first)."""
+    backend = main_optimized._backend
+    if backend is None or not backend.mutable:
+        raise HTTPException(status_code=409, detail=f"Incremental updates are not supported by SEARCH_BACKEND={SEARCH_BACKEND}")
+    return backend
+
+def upsert_segment(topic_id: str, segment: SegmentUpsert):
+    backend = _mutable_backend()
+    if segment.embedding is not None:
+        embedding = np.asarray(segment.embedding, dtype=np.float32)
+    else:
+        initialize_services()
+        embedding = main_optimized._scheduler.encode(segment.topic)
+    backend.upsert([{
+        'segment_id': segment.segment_id or topic_id,
+        'topic': segment.topic,
+        'topic_id': topic_id,
+        'category': segment.category,
+        'sub_category': segment.sub_category,
+        'vector': embedding,
+    }])
+    return {"segment_id": segment.segment_id or topic_id, "segments": backend.stats().get("segments")}
+
+def remove_segment(segment_id: str):
+    # Both calls block (pgvector runs SQL), so they run in the thread pool together
+    backend = _mutable_backend()
+    if not backend.delete([segment_id]):
+        raise HTTPException(status_code=404, detail=f"Segment {segment_id} not found")
+    return {"segment_id": segment_id, "deleted": True, "segments": backend.stats().get("segments")}
+
+@app.put("/segments/{topic_id}")
+async def put_segment(topic_id: str, segment: SegmentUpsert, x_admin_token: Optional[str] = Header(None)):
+    """Insert or replace one segment in the vector backend; visible to searches right away."""
+    _require_admin(x_admin_token)
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, upsert_segment, topic_id, segment)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/segments/{segment_id}")
+async def delete_segment(segment_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Remove one segment from the vector backend."""
+    _require_admin(x_admin_token)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, remove_segment, segment_id)
+
 @app.get("/health")
 async def health_check():
     """Detailed health check."""
@@ -196,34 +344,67 @@ async def health_check():
         "timestamp": time.time(),
         "service": "SPARK AI Optimized Search",
         "model": "BAAI/bge-large-en-v1.5",
-        "initialized": _initialized,
-        "model_loaded": _model is not None
+        "initialized": main_optimized._initialized,
+        "model_loaded": main_optimized._model is not None,
+        "index_version": main_optimized._index_version
     }
 
+@app.post("/admin/reload", status_code=202)
+async def reload_segment_index(request: ReloadRequest = ReloadRequest(), x_admin_token: Optional[str] = Header(None)):
+    """Build or activate a catalog snapshot in the background and hot-swap it in."""
+    _require_admin(x_admin_token)
+    if not start_background_reload(request.version):
+        raise HTTPException(status_code=409, detail="A reload is already in progress")
+    return {"active_version": main_optimized._index_version, "requested_version": request.version, "reloading": True}
+
+@app.get("/ready")
+async def ready_check():
+    """Readiness check: 200 once the model is loaded, 503 with loading progress until then."""
+    status = readiness.status()
+    if status["ready"]:
+        return status
+    return JSONResponse(status_code=503, content=status, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
 @app.get("/stats")
 async def get_stats():
     """Get API statistics."""
     return {
         "model": "BAAI/bge-large-en-v1.5",
         "dimensions": 1024,
-        "initialized": _initialized,
+        "initialized": main_optimized._initialized,
+        "embedding_scheduler": main_optimized._scheduler.stats() if main_optimized._scheduler else None,
+        "embedding_cache": get_embedding_cache().stats(),
+        "search_backend": SEARCH_BACKEND,
+        "vector_backend": main_optimized._backend.stats() if main_optimized._backend else None,
+        "index_version": main_optimized._index_version,
+        "lexical_index": main_optimized._lexical_index.stats() if main_optimized._lexical_index else None,
+        "metadata_store": main_optimized._metadata_store.stats() if main_optimized._metadata_store else None,
         "features": [
             "Semantic search with real embeddings",
             "Model caching for performance",
             "Proper vector normalization",
+            "Query embedding cache (LRU/TTL)",
             "Detailed timing breakdown"
         ]
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Vector backend breaker state, hedge rate and latency in Prometheus text format."""
+    return prometheus_text(backend_metrics(main_optimized._backend))
+
 @app.get("/usage")
 async def get_usage():
     """Get current Pinecone usage and estimated costs."""
+    async_index = getattr(main_optimized._backend, "async_index", None)
+    if async_index is None:
+        raise HTTPException(status_code=409, detail=f"Usage stats need SEARCH_BACKEND=pinecone, not {SEARCH_BACKEND}")
     try:
         # Get index stats
-        stats = _index.describe_index_stats()
+        stats = await async_index.describe_index_stats()
         
         # Calculate estimated costs
-        total_vectors = stats.get('total_vector_count', 0)
+        total_vectors = stats.get('totalVectorCount', 0)
         dimension = stats.get('dimension', 1024)
         
         # Estimate storage cost (rough calculation)
@@ -1,13 +1,21 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 import uvicorn
+import asyncio
 import time
 import logging
 import os
 from dotenv import load_dotenv
-from supabase_setup import SupabaseVectorDB
+from supabase_setup import MODEL_NAME, ENCODER_KEY
+from pg_async import AsyncSupabaseVectorDB
+from pg_pool import PoolTimeout
+from embedding_scheduler import EmbeddingScheduler
+from embedding_cache import get_embedding_cache
+from encoder_backends import load_encoder
+from service_readiness import ServiceReadiness, RETRY_AFTER_SECONDS
 
 # Load environment variables
 load_dotenv()
@@ -32,13 +40,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global Supabase instance
+# Global Supabase instance (async pool) and encoder
 supabase_db = None
+_scheduler = None
+
+# Loading progress, reported by /ready while the database and model load in the background
+readiness = ServiceReadiness(["database", "schema", "encoder"])
 
 # Pydantic models for request/response
 class SearchRequest(BaseModel):
     query: str
     top_k: Optional[int] = 5
+    category: Optional[str] = None
+    sub_category: Optional[str] = None
 
 class SearchResult(BaseModel):
     topic: str
@@ -55,9 +69,36 @@ class SearchResponse(BaseModel):
     embedding_time: float
     query_time: float
 
+def load_services(loop: asyncio.AbstractEventLoop):
+    """Connect to Supabase, prepare the schema and load the embedding model."""
+    global _scheduler
+    
+    # The pool belongs to the server's event loop, so its coroutines run there
+    with readiness.stage("database"):
+        asyncio.run_coroutine_threadsafe(supabase_db.connect(), loop).result()
+    
+    with readiness.stage("schema"):
+        asyncio.run_coroutine_threadsafe(supabase_db.setup_schema(), loop).result()
+    
+    with readiness.stage("encoder"):
+        logger.info("🔄 Loading embedding model...")
+        _scheduler = EmbeddingScheduler(load_encoder(MODEL_NAME))
+        logger.info("✅ Embedding model loaded")
+    
+    logger.info("✅ SPARK AI with Supabase ready to serve requests!")
+
+async def embed_query(query: str, cached_only: bool = False):
+    """Cached query embedding, or one from the shared encode batch awaited without blocking a thread."""
+    cache = get_embedding_cache()
+    embedding = cache.get(query, ENCODER_KEY)
+    if embedding is None and not cached_only:
+        embedding = await asyncio.wrap_future(_scheduler.submit(query))
+        cache.put(query, ENCODER_KEY, embedding)
+    return embedding
+
 @app.on_event("startup")
 async def startup_event():
-    """Initialize Supabase connection on startup."""
+    """Start loading the database and model in the background so the server accepts traffic right away."""
     global supabase_db
     
     logger.info("🚀 Starting SPARK AI with Supabase...")
@@ -68,32 +109,28 @@ async def startup_event():
         raise Exception("SUPABASE_DB_URL not configured")
     
     # Initialize Supabase
-    supabase_db = SupabaseVectorDB()
-    
-    # Connect and setup
-    if not supabase_db.connect():
-        raise Exception("Failed to connect to Supabase")
-    
-    if not supabase_db.setup_vector_extension():
-        raise Exception("Failed to setup pgvector extension")
-    
-    if not supabase_db.create_audience_segments_table():
-        raise Exception("Failed to create audience segments table")
-    
-    if not supabase_db.create_vector_index():
-        raise Exception("Failed to create vector index")
-    
-    if not supabase_db.load_embedding_model():
-        raise Exception("Failed to load embedding model")
-    
-    logger.info("✅ SPARK AI with Supabase ready to serve requests!")
+    supabase_db = AsyncSupabaseVectorDB()
+    loop = asyncio.get_running_loop()
+    readiness.start(lambda: load_services(loop))
+    logger.info("✅ API accepting requests (loading in background, see /ready)")
+
+def _require_database():
+    """Fail fast with 503 until the database connection is up."""
+    if not supabase_db or not readiness.is_stage_done("database"):
+        raise HTTPException(
+            status_code=503,
+            detail="Database not initialized",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Clean up Supabase connection on shutdown."""
     global supabase_db
+    if _scheduler:
+        _scheduler.stop()
     if supabase_db:
-        supabase_db.close()
+        await supabase_db.close()
         logger.info("✅ Supabase connection closed")
 
 @app.get("/")
@@ -101,10 +138,9 @@ async def root():
     """Health check endpoint."""
     global supabase_db
     
-    if not supabase_db:
-        raise HTTPException(status_code=503, detail="Database not initialized")
+    _require_database()
     
-    segment_count = supabase_db.get_segment_count()
+    segment_count = await supabase_db.get_segment_count()
     
     return {
         "message": "SPARK AI Audience Segment Search API (Supabase)",
@@ -127,14 +163,26 @@ async def search_segments(request: SearchRequest):
     """
     global supabase_db
     
-    if not supabase_db:
-        raise HTTPException(status_code=503, detail="Database not initialized")
+    _require_database()
     
     try:
         start_time = time.time()
         
-        # Perform the search using Supabase
-        results = supabase_db.search_similar_segments(request.query, request.top_k)
+        # Encoder still loading: only cached embeddings can be served
+        embedding = await embed_query(request.query, cached_only=not readiness.ready)
+        if embedding is None:
+            raise HTTPException(
+                status_code=503,
+                detail="Model is still loading, retry shortly",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+            )
+        embedding_time = time.time() - start_time
+        
+        # Awaited on the event loop on a pooled connection of its own; no thread per request
+        results = await supabase_db.search_by_embedding(
+            embedding, request.top_k, request.category, request.sub_category
+        )
+        logger.info(f"✅ Found {len(results)} similar segments")
         
         total_time = time.time() - start_time
         
@@ -155,10 +203,15 @@ async def search_segments(request: SearchRequest):
             results=search_results,
             query=request.query,
             total_time=total_time,
-            embedding_time=total_time * 0.7,  # Approximate
-            query_time=total_time * 0.3       # Approximate
+            embedding_time=embedding_time,
+            query_time=total_time - embedding_time
         )
         
+    except HTTPException:
+        raise
+    except PoolTimeout as e:
+        logger.error(f"Search rejected: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
@@ -168,21 +221,31 @@ async def health_check():
     """Detailed health check endpoint."""
     global supabase_db
     
-    if not supabase_db:
+    if not supabase_db or not readiness.is_stage_done("database"):
         return {
             "status": "unhealthy",
             "database": "not_connected",
-            "message": "Supabase database not initialized"
+            "message": "Supabase database not initialized",
+            "readiness": readiness.status()
+        }
+    
+    if not await supabase_db.ping():
+        return {
+            "status": "unhealthy",
+            "database": "error",
+            "message": "Postgres health check failed",
+            "connection_pool": supabase_db.stats()
         }
     
     try:
-        segment_count = supabase_db.get_segment_count()
+        segment_count = await supabase_db.get_segment_count()
         return {
             "status": "healthy",
             "database": "connected",
             "total_segments": segment_count,
             "vector_extension": "enabled",
-            "embedding_model": "BAAI/bge-large-en-v1.5"
+            "embedding_model": "BAAI/bge-large-en-v1.5",
+            "connection_pool": supabase_db.stats()
         }
     except Exception as e:
         return {
@@ -196,20 +259,30 @@ async def get_stats():
     """Get database statistics."""
     global supabase_db
     
-    if not supabase_db:
-        raise HTTPException(status_code=503, detail="Database not initialized")
+    _require_database()
     
     try:
-        segment_count = supabase_db.get_segment_count()
+        segment_count = await supabase_db.get_segment_count()
         return {
             "total_segments": segment_count,
             "database_type": "Supabase PostgreSQL",
             "vector_extension": "pgvector",
             "embedding_model": "BAAI/bge-large-en-v1.5",
-            "embedding_dimension": 1024
+            "embedding_dimension": 1024,
+            "embedding_scheduler": _scheduler.stats() if _scheduler else None,
+            "embedding_cache": get_embedding_cache().stats(),
+            "connection_pool": supabase_db.stats()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get stats: {str(e)}")
 
+@app.get("/ready")
+async def ready_check():
+    """Readiness check: 200 once everything is loaded, 503 with loading progress until then."""
+    status = readiness.status()
+    if status["ready"]:
+        return status
+    return JSONResponse(status_code=503, content=status, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+Tail-latency control for remote vector backends (Pinecone, pgvector).
+
+A slow Pinecone or Postgres response used to hold a search for as long as
+the remote side took, and any error became a 500. ``HedgedBackend`` wraps a
+remote ``VectorBackend`` and adds three things.
+
+Hedged queries
+    Each call's latency feeds a rolling window, failed and timed-out calls
+    included, so a brownout raises the hedge delay instead of hiding from
+    it. When a query has not answered within the observed p95
+    (``HEDGE_PERCENTILE``, floored at ``HEDGE_MIN_DELAY_MS``), one
+    duplicate is sent and whichever answer comes first wins. This only
+    starts once ``HEDGE_MIN_SAMPLES`` calls have been seen, so a cold
+    process doesn't hedge every request, and a token bucket caps hedges
+    at ``HEDGE_BUDGET`` of queries, so a slow store never sees its load
+    doubled. Every attempt is capped at ``REMOTE_QUERY_TIMEOUT`` seconds.
+
+Circuit breaker
+    ``BREAKER_FAILURES`` consecutive failures or timeouts open the breaker.
+    While it is open, queries skip the remote store and go to the fallback
+    tier: the backend named by ``SEARCH_FALLBACK_BACKEND``, e.g. ``local``
+    for the exact index of the active snapshot. Without a fallback they
+    raise ``BackendUnavailable``, and the servers answer from BM25 or with
+    a 503. After ``BREAKER_RESET_SECONDS`` one probe goes through
+    (half-open). Only that probe's success closes the breaker again; a late
+    answer from a call sent before it opened does not.
+
+Metrics
+    ``metrics()`` reports breaker state, hedge rate, hedge wins, fallbacks
+    and latency percentiles. The servers export them in Prometheus text
+    format on ``/metrics``.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from vector_backends import VectorBackend, LOCAL_ENGINES, load_vector_backend
+
+logger = logging.getLogger(__name__)
+
+REMOTE_BACKENDS = ("pinecone", "pgvector", "supabase")
+SEARCH_FALLBACK_BACKEND = os.getenv("SEARCH_FALLBACK_BACKEND", "").lower()  # "" = no fallback tier
+REMOTE_QUERY_TIMEOUT = float(os.getenv("REMOTE_QUERY_TIMEOUT", "2.0"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1") != "0"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "20"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "50"))
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))  # Max fraction of queries that may be hedged
+HEDGE_BUDGET_BURST = float(os.getenv("HEDGE_BUDGET_BURST", "10"))  # Hedges that may be saved up while idle
+LATENCY_WINDOW = int(os.getenv("HEDGE_LATENCY_WINDOW", "1000"))  # Recent calls the percentiles are computed over
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", "32"))  # Threads for blocking (sync) queries and hedges
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_QUERY_MAX_WORKERS", "4"))  # Separate threads for query_many batches
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+
+class BackendUnavailable(Exception):
+    """The remote backend's circuit is open and no fallback tier is configured."""
+
+    def __init__(self, message: str, retry_after: float = BREAKER_RESET_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LatencyWindow:
+    """Latencies of the most recent calls, for percentile-based hedge delays."""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            samples = np.fromiter(self._samples, dtype=np.float64)
+        return float(np.percentile(samples, q))
+
+
+class HedgeBudget:
+    """Token bucket: every query earns ``ratio`` of a hedge, every hedge spends one."""
+
+    def __init__(self, ratio: float = HEDGE_BUDGET, burst: float = HEDGE_BUDGET_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.burst)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open probe after a cool-down -> closed."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+    STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0  # Times the breaker has tripped
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(self.reset_seconds - (time.monotonic() - self._opened_at), 0.0)
+
+    def allow(self) -> Optional[str]:
+        """The state a call is admitted in (CLOSED, or HALF_OPEN for the one probe after the
+        cool-down), or None if it must not go to the remote store. Pass it back to record_*."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return self.CLOSED
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._probing:
+                return None
+            self._state = self.HALF_OPEN
+            self._probing = True
+            return self.HALF_OPEN
+
+    def _is_stale(self, admitted: str) -> bool:
+        # A call sent while closed that lands after the breaker opened says nothing about recovery
+        return self._state != self.CLOSED and admitted != self.HALF_OPEN
+
+    def record_success(self, admitted: str = CLOSED):
+        with self._lock:
+            if self._is_stale(admitted):
+                return
+            if self._state != self.CLOSED:
+                logger.info("✅ Vector backend recovered, circuit closed")
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+            self._probing = False
+
+    def record_failure(self, admitted: str = CLOSED):
+        with self._lock:
+            if self._is_stale(admitted):
+                return
+            self._consecutive_failures += 1
+            if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.opened += 1
+                    logger.warning(f"⚠️  Vector backend circuit opened after {self._consecutive_failures} "
+                                   f"consecutive failures (retry in {self.reset_seconds:.0f}s)")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._consecutive_failures,
+            "opened": self.opened,
+        }
+
+
+class HedgedBackend(VectorBackend):
+    """A remote backend with hedged queries, a circuit breaker and an optional fallback tier."""
+
+    def __init__(self, primary: VectorBackend, fallback: Optional[VectorBackend] = None,
+                 timeout: float = REMOTE_QUERY_TIMEOUT, hedge: bool = HEDGE_ENABLED,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = primary.name
+        self.timeout = timeout
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyWindow()
+        self.budget = HedgeBudget()
+        self._executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="vector-hedge")
+        # A stuck batch keeps its thread after the timeout; it must not take one from single queries
+        self._batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="vector-batch")
+        self._counters_lock = threading.Lock()
+        self.counters = {"queries": 0, "hedges": 0, "hedge_wins": 0, "timeouts": 0,
+                         "hedges_throttled": 0, "failures": 0, "fallbacks": 0, "rejected": 0}
+
+    # The metadata store lives on the wrapped backends, which do the joins
+    @property
+    def metadata_store(self):
+        return self.primary.metadata_store
+
+    @metadata_store.setter
+    def metadata_store(self, metadata_store):
+        self.primary.metadata_store = metadata_store
+        if self.fallback is not None:
+            self.fallback.metadata_store = metadata_store
+
+    def _count(self, name: str, amount: int = 1):
+        with self._counters_lock:
+            self.counters[name] += amount
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before sending a duplicate; None while there are too few samples."""
+        if not self.hedge or len(self.latency) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(self.latency.percentile(HEDGE_PERCENTILE), HEDGE_MIN_DELAY_MS / 1000)
+
+    def _may_hedge(self) -> bool:
+        if self.budget.withdraw():
+            self._count("hedges")
+            return True
+        self._count("hedges_throttled")
+        return False
+
+    # -- blocking path (main_optimized, batch jobs) --------------------------
+
+    def _timed(self, call: Callable):
+        def run():
+            start_time = time.perf_counter()
+            try:
+                return call()
+            finally:
+                # Failures and calls that outlive the deadline count too, or p95 would only ever see the fast ones
+                self.latency.record(time.perf_counter() - start_time)
+        return run
+
+    def _call_hedged(self, call: Callable, hedged: bool = True):
+        start_time = time.monotonic()
+        deadline = start_time + self.timeout
+        delay = self.hedge_delay() if hedged else None
+        if hedged:
+            self.budget.deposit()
+        executor = self._executor if hedged else self._batch_executor
+        attempts = [executor.submit(self._timed(call))]
+        pending = set(attempts)
+        error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            hedge_due = delay is not None and len(attempts) == 1
+            done, pending = wait(pending, timeout=min(delay, remaining) if hedge_due else remaining,
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not attempts[0]:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+            if not done and hedge_due:
+                # The first attempt is slower than p95: race a duplicate against it, budget permitting
+                if not self._may_hedge():
+                    delay = None
+                    continue
+                attempts.append(self._executor.submit(self._timed(call)))
+                pending.add(attempts[-1])
+        if error is not None and not pending:
+            raise error
+        for future in pending:
+            future.cancel()
+        self._count("timeouts")
+        raise TimeoutError(f"{self.name} query timed out after {self.timeout}s")
+
+    def _protected(self, call: Callable, fallback: Callable, hedged: bool = True):
+        self._count("queries")
+        admitted = self.breaker.allow()
+        if admitted is None:
+            return self._use_fallback(fallback, None)
+        try:
+            result = self._call_hedged(call, hedged)
+        except Exception as e:
+            self.breaker.record_failure(admitted)
+            self._count("failures")
+            return self._use_fallback(fallback, e)
+        self.breaker.record_success(admitted)
+        return result
+
+    def _use_fallback(self, fallback: Callable, error: Optional[Exception]):
+        if self.fallback is None:
+            self._count("rejected")
+            if error is not None:
+                raise error
+            raise BackendUnavailable(f"{self.name} circuit is open", self.breaker.retry_after())
+        self._count("fallbacks")
+        if error is not None:
+            logger.warning(f"⚠️  {self.name} query failed ({error}), served by {self.fallback.name}")
+        return fallback()
+
+    def query(self, vector, top_k=5, category=None, sub_category=None):
+        return self._protected(lambda: self.primary.query(vector, top_k, category, sub_category),
+                               lambda: self.fallback.query(vector, top_k, category, sub_category))
+
+    def query_many(self, vectors, top_k=5, category=None, sub_category=None):
+        # A whole batch is not duplicated; it is still timed, and gets the timeout, breaker and fallback
+        return self._protected(lambda: self.primary.query_many(vectors, top_k, category, sub_category),
+                               lambda: self.fallback.query_many(vectors, top_k, category, sub_category),
+                               hedged=False)
+
+    # -- async path (api_server_optimized) ------------------------------------
+
+    async def _timed_async(self, vector, top_k, category, sub_category):
+        start_time = time.perf_counter()
+        try:
+            return await self.primary.aquery(vector, top_k, category, sub_category)
+        finally:
+            # Also on failure and on the cancellation at the deadline
+            self.latency.record(time.perf_counter() - start_time)
+
+    async def _aquery_hedged(self, vector, top_k, category, sub_category):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        delay = self.hedge_delay()
+        self.budget.deposit()
+        attempts = [asyncio.ensure_future(self._timed_async(vector, top_k, category, sub_category))]
+        pending = set(attempts)
+        error = None
+        try:
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                hedge_due = delay is not None and len(attempts) == 1
+                done, pending = await asyncio.wait(pending, timeout=min(delay, remaining) if hedge_due else remaining,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not attempts[0]:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+                if not done and hedge_due:
+                    if not self._may_hedge():
+                        delay = None
+                        continue
+                    attempts.append(asyncio.ensure_future(self._timed_async(vector, top_k, category, sub_category)))
+                    pending.add(attempts[-1])
+            if error is not None and not pending:
+                raise error
+            self._count("timeouts")
+            raise asyncio.TimeoutError(f"{self.name} query timed out after {self.timeout}s")
+        finally:
+            # The losing attempt is cancelled so it releases its pooled connection
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+
+    async def aquery(self, vector, top_k=5, category=None, sub_category=None):
+        self._count("queries")
+        admitted = self.breaker.allow()
+        if admitted is None:
+            return await self._afallback(None, vector, top_k, category, sub_category)
+        try:
+            result = await self._aquery_hedged(vector, top_k, category, sub_category)
+        except Exception as e:
+            self.breaker.record_failure(admitted)
+            self._count("failures")
+            return await self._afallback(e, vector, top_k, category, sub_category)
+        self.breaker.record_success(admitted)
+        return result
+
+    async def _afallback(self, error, vector, top_k, category, sub_category):
+        if self.fallback is None:
+            self._count("rejected")
+            if error is not None:
+                raise error
+            raise BackendUnavailable(f"{self.name} circuit is open", self.breaker.retry_after())
+        self._count("fallbacks")
+        if error is not None:
+            logger.warning(f"⚠️  {self.name} query failed ({error}), served by {self.fallback.name}")
+        return await self.fallback.aquery(vector, top_k, category, sub_category)
+
+    # -- writes and bookkeeping -----------------------------------------------
+
+    @property
+    def mutable(self) -> bool:
+        return self.primary.mutable
+
+    def upsert(self, records):
+        return self.primary.upsert(records)
+
+    def delete(self, segment_ids):
+        return self.primary.delete(segment_ids)
+
+    def dimension(self):
+        return self.primary.dimension() or (self.fallback.dimension() if self.fallback is not None else None)
+
+    def reloaded(self, version):
+        """Same connections, breaker and latency window; the fallback tier moves to the new snapshot."""
+        backend = HedgedBackend.__new__(HedgedBackend)
+        backend.__dict__.update(self.__dict__)
+        backend.primary = self.primary.reloaded(version)
+        backend.fallback = self.fallback.reloaded(version) if self.fallback is not None else None
+        return backend
+
+    def metrics(self) -> Dict[str, float]:
+        """Flat numeric metrics for /metrics."""
+        with self._counters_lock:
+            counters = dict(self.counters)
+        p50, p95, p99 = (self.latency.percentile(q) for q in (50, 95, 99))
+        delay = self.hedge_delay()
+        return {
+            "vector_backend_breaker_state": CircuitBreaker.STATE_CODES[self.breaker.state],
+            "vector_backend_breaker_opened_total": self.breaker.opened,
+            **{f"vector_backend_{name}_total": value for name, value in counters.items()},
+            "vector_backend_hedge_rate": counters["hedges"] / counters["queries"] if counters["queries"] else 0.0,
+            "vector_backend_hedge_delay_seconds": delay or 0.0,
+            "vector_backend_latency_p50_seconds": p50 or 0.0,
+            "vector_backend_latency_p95_seconds": p95 or 0.0,
+            "vector_backend_latency_p99_seconds": p99 or 0.0,
+        }
+
+    def stats(self):
+        return {
+            **self.primary.stats(),
+            "breaker": self.breaker.stats(),
+            "fallback": self.fallback.name if self.fallback is not None else None,
+            "hedge_delay_ms": round(1000 * (self.hedge_delay() or 0.0), 2),
+            **{key: value for key, value in self.metrics().items() if key.endswith("_total") or key.endswith("rate")},
+        }
+
+    def close(self):
+        self.primary.close()
+        if self.fallback is not None:
+            self.fallback.close()
+
+    async def aclose(self):
+        if hasattr(self.primary, "aclose"):
+            await self.primary.aclose()
+
+
+def load_resilient_backend(name: str, version: Optional[str] = None, async_client: bool = False,
+                           metadata_store=None, fallback: str = SEARCH_FALLBACK_BACKEND) -> VectorBackend:
+    """load_vector_backend, with remote stores wrapped in a HedgedBackend (local engines are returned as-is)."""
+    backend = load_vector_backend(name, metadata_store=metadata_store, version=version, async_client=async_client)
+    if name.lower() not in REMOTE_BACKENDS:
+        return backend
+    fallback_backend = None
+    if fallback:
+        if fallback in LOCAL_ENGINES and version is None:
+            logger.warning(f"⚠️  No catalog snapshot, fallback tier {fallback} disabled")
+        else:
+            fallback_backend = load_vector_backend(fallback, metadata_store=metadata_store, version=version)
+    backend = HedgedBackend(backend, fallback_backend)
+    logger.info(f"🛡️  {name} queries hedged at p{HEDGE_PERCENTILE:.0f}, timeout {REMOTE_QUERY_TIMEOUT}s, "
+                f"fallback: {fallback_backend.name if fallback_backend else 'none'}")
+    return backend
+
+
+def backend_metrics(backend: Optional[VectorBackend]) -> Dict[str, float]:
+    return backend.metrics() if hasattr(backend, "metrics") else {}
+
+
+def prometheus_text(metrics: Dict[str, float]) -> str:
+    """Render flat metrics in the Prometheus text exposition format."""
+    lines = []
+    for name, value in metrics.items():
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {float(value):g}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,213 @@
+"""
+Query-embedding cache for SPARK AI.
+
+Marketing intents repeat a lot ("start a business", "lose weight", ...), so
+every search entry point looks the query up here before running the
+1024-dim BGE forward pass. Entries are keyed on the model name plus the
+normalized query text and are evicted LRU-first, by optional TTL, and
+whenever the entry count or memory cap is exceeded.
+
+When ``EMBED_CACHE_DIR`` is set, misses fall through to a persistent
+memory-mapped tier (see ``embedding_disk_cache``) that survives restarts
+and can be shared read-only between uvicorn workers.
+"""
+
+import os
+import re
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from embedding_disk_cache import DiskEmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden through the environment
+DEFAULT_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "10000"))
+DEFAULT_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+DEFAULT_TTL_SECONDS = float(os.getenv("EMBED_CACHE_TTL_SECONDS", "0"))  # 0 = no expiry
+DEFAULT_DISK_DIR = os.getenv("EMBED_CACHE_DIR") or None
+DEFAULT_DISK_READ_ONLY = os.getenv("EMBED_CACHE_READ_ONLY", "false").lower() in ("1", "true", "yes")
+DEFAULT_DIM = 1024  # BAAI/bge-large-en-v1.5 dimension
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Normalize query text so trivially different spellings share an entry."""
+    return _WHITESPACE.sub(" ", text.strip().lower())
+
+
+class EmbeddingCache:
+    """Thread-safe LRU cache of query embeddings with TTL and a memory cap."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS, disk_dir: Optional[str] = DEFAULT_DISK_DIR,
+                 disk_read_only: bool = DEFAULT_DISK_READ_ONLY, dim: int = DEFAULT_DIM):
+        self.max_entries = max(int(max_entries), 1)
+        self.max_bytes = max(int(max_bytes), 1)
+        self.ttl = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self.disk_dir = disk_dir
+        self.disk_read_only = disk_read_only
+        self.dim = dim
+        self._disk: Dict[str, Optional[DiskEmbeddingCache]] = {}
+
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[np.ndarray, float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(text: str, model_name: str) -> Tuple[str, str]:
+        return (model_name, normalize_query(text))
+
+    @staticmethod
+    def _entry_size(key: Tuple[str, str], vector: np.ndarray) -> int:
+        return vector.nbytes + len(key[0]) + len(key[1])
+
+    def _disk_for(self, model_name: str) -> Optional[DiskEmbeddingCache]:
+        """Return the persistent tier for a model (one directory per model)."""
+        if not self.disk_dir:
+            return None
+        with self._lock:
+            if model_name in self._disk:
+                return self._disk[model_name]
+        try:
+            disk = DiskEmbeddingCache(self.disk_dir, model_name, dim=self.dim,
+                                      read_only=self.disk_read_only)
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Persistent embedding cache disabled for {model_name}: {e}")
+            disk = None
+        with self._lock:
+            return self._disk.setdefault(model_name, disk)
+
+    def get(self, text: str, model_name: str) -> Optional[np.ndarray]:
+        """Return the cached vector for a query, or None on a miss."""
+        key = self.make_key(text, model_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                vector, stored_at, size = entry
+                if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                    del self._entries[key]
+                    self._bytes -= size
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+
+        disk = self._disk_for(model_name)
+        vector = disk.get(key[1]) if disk is not None else None
+        with self._lock:
+            if vector is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._put_memory(key, vector)
+        return vector
+
+    def put(self, text: str, model_name: str, vector: np.ndarray):
+        """Store a vector for a query, evicting least recently used entries as needed."""
+        key = self.make_key(text, model_name)
+        vector = np.array(vector, dtype=np.float32)
+        disk = self._disk_for(model_name)
+        if disk is not None:
+            try:
+                disk.put(key[1], vector)
+            except (OSError, ValueError) as e:
+                logger.error(f"❌ Failed to persist embedding: {e}")
+        self._put_memory(key, vector)
+
+    def _put_memory(self, key: Tuple[str, str], vector: np.ndarray):
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        size = self._entry_size(key, vector)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (vector, time.monotonic(), size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_compute(self, text: str, model_name: str,
+                       compute: Callable[[str], np.ndarray]) -> np.ndarray:
+        """Return the cached vector, or compute, store and return it."""
+        vector = self.get(text, model_name)
+        if vector is None:
+            vector = compute(text)
+            self.put(text, model_name, vector)
+        return vector
+
+    def get_or_compute_many(self, texts: List[str], model_name: str,
+                            compute_many: Callable[[List[str]], np.ndarray]) -> List[np.ndarray]:
+        """Vectors for several queries in input order; all misses are computed in one call."""
+        vectors: List[Optional[np.ndarray]] = [self.get(text, model_name) for text in texts]
+        # Duplicate queries in a batch are encoded once
+        missing: Dict[Tuple[str, str], List[int]] = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(self.make_key(texts[i], model_name), []).append(i)
+        if missing:
+            positions = list(missing.values())
+            computed = compute_many([texts[rows[0]] for rows in positions])
+            for rows, vector in zip(positions, computed):
+                self.put(texts[rows[0]], model_name, vector)
+                for i in rows:
+                    vectors[i] = vector
+        return vectors
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        """Return hit/miss/eviction counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "disk": {name: disk.stats() for name, disk in self._disk.items() if disk is not None},
+            }
+
+
+# One cache per process, shared by every search entry point
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Return the process-wide embedding cache, creating it on first use."""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                _shared_cache = EmbeddingCache()
+                logger.info(f"✅ Embedding cache ready (max {_shared_cache.max_entries} entries, "
+                            f"{_shared_cache.max_bytes // (1024 * 1024)}MB)")
+    return _shared_cache
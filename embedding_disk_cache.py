@@ -0,0 +1,295 @@
+"""
+Persistent, memory-mapped query-embedding cache for SPARK AI.
+
+Restarts and deploys used to drop every warm embedding. This cache keeps
+them on local disk so a new process can reopen them with zero-copy reads:
+
+    <cache_dir>/<model>/meta.json          model name, dimension, generation
+    <cache_dir>/<model>/vectors.<gen>.f32  append-only float32 rows
+    <cache_dir>/<model>/keys.<gen>.jsonl   append-only [query, row] index
+
+Each model gets its own directory and ``meta.json`` is checked on open, so
+vectors from different models never mix. Several uvicorn workers can open
+the same directory; writers serialize appends with a file lock, and
+read-only workers just pick up new rows as they appear. When the vector
+file grows past its size cap it is compacted into a new generation that
+keeps the most recently written entries, and ``meta.json`` is swapped
+atomically so readers never pair old keys with new vectors.
+"""
+
+import os
+import re
+import json
+import fcntl
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+DEFAULT_MAX_BYTES = int(os.getenv("EMBED_DISK_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Fraction of the size cap kept when compacting, so compaction is not re-triggered immediately
+COMPACT_TARGET_RATIO = 0.5
+
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def model_directory_name(model_name: str) -> str:
+    """Turn a model name like 'BAAI/bge-large-en-v1.5' into a safe directory name."""
+    return _UNSAFE_CHARS.sub("__", model_name)
+
+
+class DiskEmbeddingCache:
+    """Append-only float32 vector file plus key index, read through np.memmap."""
+
+    def __init__(self, cache_dir: str, model_name: str, dim: int = 1024,
+                 max_bytes: int = DEFAULT_MAX_BYTES, read_only: bool = False):
+        self.model_name = model_name
+        self.dim = int(dim)
+        self.row_bytes = self.dim * 4
+        self.max_bytes = max(int(max_bytes), self.row_bytes)
+        self.read_only = read_only
+        self.directory = os.path.join(cache_dir, model_directory_name(model_name))
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.lock_path = os.path.join(self.directory, ".lock")
+
+        self._lock = threading.RLock()
+        self._generation = None
+        self._meta_inode = None
+        self._bad_meta_inode = None  # Unreadable meta.json already warned about
+        self._index: Dict[str, int] = {}
+        self._keys_offset = 0
+        self._vectors = None
+        self._rows = 0
+        self.disk_hits = 0
+        self.appends = 0
+        self.compactions = 0
+
+        if not read_only:
+            os.makedirs(self.directory, exist_ok=True)
+            with self._file_lock():
+                if not os.path.exists(self.meta_path):
+                    self._write_meta(0)
+        # A cache for another model or format is refused here; later read errors are just misses
+        self._read_meta()
+        self._refresh()
+
+    # ---- file helpers -------------------------------------------------
+
+    def _vectors_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"vectors.{generation}.f32")
+
+    def _keys_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"keys.{generation}.jsonl")
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_meta(self, generation: int):
+        meta = {
+            "version": FORMAT_VERSION,
+            "model_name": self.model_name,
+            "dim": self.dim,
+            "generation": generation,
+        }
+        tmp_path = f"{self.meta_path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _read_meta(self) -> Optional[Dict]:
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported embedding cache format {meta.get('version')} in {self.directory}")
+        if meta.get("model_name") != self.model_name or meta.get("dim") != self.dim:
+            raise ValueError(
+                f"Embedding cache in {self.directory} belongs to {meta.get('model_name')} "
+                f"({meta.get('dim')} dims), not {self.model_name} ({self.dim} dims)"
+            )
+        return meta
+
+    # ---- index / mmap refresh ------------------------------------------
+
+    def _refresh(self) -> bool:
+        """Pick up rows appended by other processes and any new generation; False if meta.json is unreadable."""
+        try:
+            meta_inode = os.stat(self.meta_path).st_ino
+        except FileNotFoundError:
+            return True
+        if meta_inode != self._meta_inode:
+            try:
+                meta = self._read_meta()
+            except ValueError as e:
+                if meta_inode != self._bad_meta_inode:
+                    logger.warning(f"⚠️  Ignoring embedding cache in {self.directory}: {e}")
+                    self._bad_meta_inode = meta_inode
+                return False
+            if meta is None:
+                return True
+            self._meta_inode = meta_inode
+            if meta["generation"] != self._generation:
+                self._generation = meta["generation"]
+                self._index = {}
+                self._keys_offset = 0
+                self._vectors = None
+                self._rows = 0
+
+        keys_path = self._keys_path(self._generation)
+        try:
+            if os.path.getsize(keys_path) > self._keys_offset:
+                with open(keys_path, "rb") as f:
+                    f.seek(self._keys_offset)
+                    data = f.read()
+                # Only consume complete lines; a writer may be mid-append
+                end = data.rfind(b"\n") + 1
+                for line in data[:end].splitlines():
+                    try:
+                        key, row = json.loads(line)
+                        if not isinstance(row, int):
+                            raise TypeError(row)
+                    except (ValueError, TypeError):
+                        # Tail of a crashed writer's torn append; that key is simply a miss
+                        logger.warning(f"⚠️  Skipping corrupt line in {keys_path}: {line[:80]!r}")
+                        continue
+                    self._index[key] = row
+                self._keys_offset += end
+        except FileNotFoundError:
+            # The generation was compacted away underneath us; reload next time
+            self._meta_inode = None
+            return True
+
+        self._remap()
+        return True
+
+    def _remap(self):
+        vectors_path = self._vectors_path(self._generation)
+        try:
+            rows = os.path.getsize(vectors_path) // self.row_bytes
+        except FileNotFoundError:
+            rows = 0
+        if rows != self._rows:
+            self._vectors = np.memmap(vectors_path, dtype=np.float32, mode="r",
+                                      shape=(rows, self.dim)) if rows else None
+            self._rows = rows
+
+    # ---- public API -----------------------------------------------------
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return a zero-copy view of the stored vector for a normalized key."""
+        with self._lock:
+            row = self._index.get(key)
+            if row is None or row >= self._rows:
+                self._refresh()
+                row = self._index.get(key)
+            if row is None or row >= self._rows:
+                return None
+            self.disk_hits += 1
+            return self._vectors[row]
+
+    def put(self, key: str, vector: np.ndarray):
+        """Append a vector for a normalized key (no-op when read-only)."""
+        if self.read_only:
+            return
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Expected a {self.dim}-dim vector, got {vector.shape[0]}")
+
+        with self._lock, self._file_lock():
+            if not self._refresh():
+                raise ValueError(f"Embedding cache metadata in {self.directory} is unreadable")
+            if key in self._index:
+                return
+
+            vectors_path = self._vectors_path(self._generation)
+            size = os.path.getsize(vectors_path) if os.path.exists(vectors_path) else 0
+            if size + self.row_bytes > self.max_bytes:
+                self._compact_locked()
+                vectors_path = self._vectors_path(self._generation)
+                size = os.path.getsize(vectors_path) if os.path.exists(vectors_path) else 0
+
+            with open(vectors_path, "ab") as f:
+                # Drop a torn row left behind by a crashed writer
+                if size % self.row_bytes:
+                    size -= size % self.row_bytes
+                    f.truncate(size)
+                f.write(vector.tobytes())
+            row = size // self.row_bytes
+
+            # The row is on disk before the key that points at it. A torn last line from a
+            # crashed writer is terminated first so it doesn't swallow this key.
+            keys_path = self._keys_path(self._generation)
+            line = json.dumps([key, row]) + "\n"
+            if os.path.exists(keys_path) and os.path.getsize(keys_path):
+                with open(keys_path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = "\n" + line
+            with open(keys_path, "a") as f:
+                f.write(line)
+
+            self.appends += 1
+            self._refresh()
+
+    def compact(self):
+        """Rewrite the cache into a new generation without duplicate or overflow rows."""
+        if self.read_only:
+            return
+        with self._lock, self._file_lock():
+            self._refresh()
+            self._compact_locked()
+
+    def _compact_locked(self):
+        old_generation = self._generation
+        new_generation = old_generation + 1
+        budget_rows = max(int(self.max_bytes * COMPACT_TARGET_RATIO) // self.row_bytes, 1)
+
+        # Keep the most recently written rows that fit in the budget
+        live = sorted(((row, key) for key, row in self._index.items() if row < self._rows), reverse=True)
+        live = sorted(live[:budget_rows])
+
+        new_vectors = self._vectors_path(new_generation)
+        new_keys = self._keys_path(new_generation)
+        with open(new_vectors, "wb") as vf, open(new_keys, "w") as kf:
+            for new_row, (old_row, key) in enumerate(live):
+                vf.write(np.asarray(self._vectors[old_row], dtype=np.float32).tobytes())
+                kf.write(json.dumps([key, new_row]) + "\n")
+
+        self._write_meta(new_generation)
+        for path in (self._vectors_path(old_generation), self._keys_path(old_generation)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        self.compactions += 1
+        self._refresh()
+        logger.info(f"🧹 Compacted embedding cache for {self.model_name}: kept {len(live)} vectors "
+                    f"(generation {new_generation})")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "read_only": self.read_only,
+                "generation": self._generation,
+                "entries": len(self._index),
+                "bytes": self._rows * self.row_bytes,
+                "max_bytes": self.max_bytes,
+                "disk_hits": self.disk_hits,
+                "appends": self.appends,
+                "compactions": self.compactions,
+            }
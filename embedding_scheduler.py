@@ -0,0 +1,175 @@
+"""
+Micro-batching embedding scheduler for SPARK AI.
+
+Concurrent searches each need one query embedding. Instead of running N
+forward passes of batch size 1, callers hand their text to the scheduler,
+which collects everything that arrives within a short window (or until the
+batch is full) and runs a single batched ``model.encode([...])`` call.
+Each caller gets its own normalized vector back.
+"""
+
+import os
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden through the environment
+DEFAULT_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+DEFAULT_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", "32"))
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Normalize every row of a 2D array to unit length (L2 norm)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class _PendingRequest:
+    __slots__ = ("text", "future", "enqueued_at")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class EmbeddingScheduler:
+    """Collects single-text encode requests and runs them as one batch."""
+
+    def __init__(self, model, window_ms: float = DEFAULT_WINDOW_MS,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE):
+        self.model = model
+        self.window = max(window_ms, 0.0) / 1000.0
+        self.max_batch_size = max(int(max_batch_size), 1)
+
+        self._queue: "queue.Queue[Optional[_PendingRequest]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._max_batch = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._total_encode = 0.0
+
+        # submit() and stop() enqueue under this lock, so nothing lands behind the stop signal
+        self._submit_lock = threading.Lock()
+        self._running = True
+        self._stop_seen = False
+        self._worker = threading.Thread(target=self._run, name="embedding-scheduler", daemon=True)
+        self._worker.start()
+        logger.info(f"✅ Embedding scheduler started (window: {window_ms}ms, max batch: {self.max_batch_size})")
+
+    def submit(self, text: str) -> Future:
+        """Queue a text for encoding and return a future for its vector."""
+        request = _PendingRequest(text)
+        with self._submit_lock:
+            if not self._running:
+                raise RuntimeError("Embedding scheduler is stopped")
+            self._queue.put(request)
+        return request.future
+
+    def encode(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """Encode a single text through the shared batch and wait for the result."""
+        return self.submit(text).result(timeout=timeout)
+
+    def encode_many(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        """Encode several texts, letting them share batches with other callers."""
+        futures = [self.submit(text) for text in texts]
+        if not futures:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack([future.result(timeout=timeout) for future in futures])
+
+    def _collect_batch(self, first: _PendingRequest) -> List[_PendingRequest]:
+        batch = [first]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Stop signal: finish this batch, then exit the loop
+                self._stop_seen = True
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = self._collect_batch(first)
+            self._process(batch)
+            if self._stop_seen:
+                break
+
+        # Fail anything still waiting after shutdown
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item.future.set_exception(RuntimeError("Embedding scheduler is stopped"))
+
+    def _process(self, batch: List[_PendingRequest]):
+        started = time.perf_counter()
+        try:
+            embeddings = self.model.encode([item.text for item in batch])
+            embeddings = normalize_rows(np.atleast_2d(embeddings))
+        except Exception as e:
+            logger.error(f"❌ Batched encode failed for {len(batch)} queries: {e}")
+            for item in batch:
+                item.future.set_exception(e)
+            return
+        encode_time = time.perf_counter() - started
+
+        for item, embedding in zip(batch, embeddings):
+            item.future.set_result(embedding)
+
+        waits = [started - item.enqueued_at for item in batch]
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._max_batch = max(self._max_batch, len(batch))
+            self._total_wait += sum(waits)
+            self._max_wait = max(self._max_wait, max(waits))
+            self._total_encode += encode_time
+
+    def stats(self) -> Dict:
+        """Return batch-size and queue-wait statistics."""
+        with self._stats_lock:
+            batches = self._batches
+            requests = self._requests
+            return {
+                "window_ms": self.window * 1000.0,
+                "max_batch_size": self.max_batch_size,
+                "batches": batches,
+                "requests": requests,
+                "avg_batch_size": round(requests / batches, 2) if batches else 0.0,
+                "largest_batch": self._max_batch,
+                "avg_queue_wait_ms": round(self._total_wait / requests * 1000.0, 3) if requests else 0.0,
+                "max_queue_wait_ms": round(self._max_wait * 1000.0, 3),
+                "avg_encode_ms": round(self._total_encode / batches * 1000.0, 3) if batches else 0.0,
+                "queue_depth": self._queue.qsize(),
+            }
+
+    def stop(self):
+        """Stop accepting requests; the worker finishes everything already queued, then exits."""
+        with self._submit_lock:
+            if not self._running:
+                return
+            self._running = False
+            self._queue.put(None)
+        self._worker.join(timeout=5)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Pluggable encoder backends for SPARK AI.
+
+The default backend loads BAAI/bge-large-en-v1.5 through SentenceTransformer
+in fp32 PyTorch. On CPU-only hosts the same model can instead be exported
+once to ONNX and served through ONNX Runtime, optionally with dynamic int8
+weight quantization, which is faster per query and much lighter on memory.
+
+Select the backend with ``ENCODER_BACKEND``:
+
+    torch      fp32 PyTorch (default); loads the memory-mapped bundle from
+               ``model_bundle`` when one exists, else SentenceTransformer
+    onnx       ONNX Runtime, fp32
+    onnx-int8  ONNX Runtime, dynamically quantized int8 weights
+
+Exported models live under ``ONNX_MODEL_DIR`` (default ``models/onnx``) and
+are created on first use if missing. Every backend exposes the same
+``encode(sentences)`` call as SentenceTransformer, so the rest of the code
+does not care which one is loaded.
+
+Run ``python encoder_backends.py --backend onnx-int8`` to export the model
+and report cosine agreement with the fp32 reference on a sample query set.
+"""
+
+import os
+import time
+import argparse
+import logging
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from model_bundle import BundleEncoder, bundle_directory, bundle_exists
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = "BAAI/bge-large-en-v1.5"
+BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_BACKEND = os.getenv("ENCODER_BACKEND", "torch").lower()
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join("models", "onnx"))
+ONNX_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))  # 0 = let ONNX Runtime decide
+MAX_SEQ_LENGTH = 512
+
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model.int8.onnx"
+
+# Intent-style queries used for the parity check
+SAMPLE_QUERIES = [
+    "learn digital marketing",
+    "start a business",
+    "lose weight",
+    "improve productivity",
+    "get better sleep",
+    "learn to code",
+    "invest in stocks",
+    "plan a vacation",
+    "buy a house",
+    "start a podcast",
+    "sheet metal roofing installation",
+    "tiktok advertising for small brands",
+    "work from home job openings",
+    "refinance a mortgage",
+    "find a wedding photographer",
+    "electric vehicle charging at home",
+]
+
+
+def _export_directory(model_name: str) -> str:
+    return os.path.join(ONNX_MODEL_DIR, model_name.replace("/", "__"))
+
+
+class OnnxEncoder:
+    """ONNX Runtime encoder with the same encode() interface as SentenceTransformer."""
+
+    def __init__(self, model_dir: str, quantized: bool = False, max_seq_length: int = MAX_SEQ_LENGTH):
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError("The ONNX encoder backend needs 'onnxruntime' and 'transformers' installed") from e
+
+        model_path = os.path.join(model_dir, ONNX_INT8_FILE if quantized else ONNX_FILE)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"ONNX model not found: {model_path}")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_THREADS > 0:
+            options.intra_op_num_threads = ONNX_THREADS
+
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.max_seq_length = max_seq_length
+        self.quantized = quantized
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        """Encode one text (returns 1D) or a list of texts (returns 2D)."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        chunks = []
+        for start in range(0, len(texts), batch_size):
+            tokens = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feed = {name: tokens[name].astype(np.int64) for name in self.input_names if name in tokens}
+            last_hidden_state = self.session.run(None, feed)[0]
+            # BGE uses the [CLS] token as the sentence embedding
+            chunks.append(last_hidden_state[:, 0, :])
+
+        embeddings = np.vstack(chunks).astype(np.float32) if chunks else np.zeros((0, 0), dtype=np.float32)
+        if normalize_embeddings and len(embeddings):
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            embeddings = embeddings / norms
+        return embeddings[0] if single else embeddings
+
+
+def export_onnx(model_name: str = DEFAULT_MODEL_NAME, output_dir: Optional[str] = None,
+                quantize: bool = False) -> str:
+    """Export the Hugging Face model to ONNX (and optionally int8); returns the export directory."""
+    try:
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+    except ImportError as e:
+        raise ImportError("Exporting to ONNX needs 'torch' and 'transformers' installed") from e
+
+    output_dir = output_dir or _export_directory(model_name)
+    os.makedirs(output_dir, exist_ok=True)
+    onnx_path = os.path.join(output_dir, ONNX_FILE)
+
+    if not os.path.exists(onnx_path):
+        logger.info(f"🔄 Exporting {model_name} to ONNX ({onnx_path})...")
+        start_time = time.time()
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+
+        sample = tokenizer(["export sample"], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[name] for name in input_names),
+                onnx_path,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14,
+                do_constant_folding=True,
+            )
+        tokenizer.save_pretrained(output_dir)
+        logger.info(f"✅ ONNX export finished in {time.time() - start_time:.2f} seconds")
+
+    int8_path = os.path.join(output_dir, ONNX_INT8_FILE)
+    if quantize and not os.path.exists(int8_path):
+        try:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+        except ImportError as e:
+            raise ImportError("Quantizing needs 'onnxruntime' installed") from e
+        logger.info("🔄 Quantizing ONNX model to dynamic int8...")
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+        logger.info(f"✅ Quantized model written to {int8_path}")
+
+    return output_dir
+
+
+def encoder_key(model_name: str = DEFAULT_MODEL_NAME, backend: Optional[str] = None) -> str:
+    """Identify model + backend, e.g. for cache keys, so quantized vectors never mix with fp32 ones."""
+    backend = (backend or DEFAULT_BACKEND).lower()
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+def load_encoder(model_name: str = DEFAULT_MODEL_NAME, backend: Optional[str] = None,
+                 use_bundle: bool = True):
+    """Load the configured encoder backend for a model."""
+    backend = (backend or DEFAULT_BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}', expected one of {', '.join(BACKENDS)}")
+
+    start_time = time.time()
+    if backend == "torch":
+        bundle_dir = bundle_directory(model_name)
+        if use_bundle and bundle_exists(bundle_dir):
+            # Pre-converted local bundle: mmap'd weights, no hub lookup
+            encoder = BundleEncoder(bundle_dir)
+            backend = "torch (bundle)"
+        else:
+            from sentence_transformers import SentenceTransformer
+            encoder = SentenceTransformer(model_name)
+    else:
+        quantized = backend == "onnx-int8"
+        model_dir = export_onnx(model_name, quantize=quantized)
+        encoder = OnnxEncoder(model_dir, quantized=quantized)
+
+    logger.info(f"✅ Encoder loaded ({model_name}, backend: {backend}) in {time.time() - start_time:.2f} seconds")
+    return encoder
+
+
+def encoder_dimension(encoder) -> int:
+    """Output dimension of any loaded encoder backend."""
+    if hasattr(encoder, "get_sentence_embedding_dimension"):
+        dim = encoder.get_sentence_embedding_dimension()
+        if dim:
+            return int(dim)
+    if getattr(encoder, "dim", None):
+        return int(encoder.dim)
+    return int(np.asarray(encoder.encode("dimension probe")).shape[-1])
+
+
+def parity_check(candidate, reference=None, queries: Optional[List[str]] = None,
+                 model_name: str = DEFAULT_MODEL_NAME, threshold: float = 0.99) -> Dict:
+    """Compare a candidate encoder against the fp32 reference on sample queries."""
+    queries = queries or SAMPLE_QUERIES
+    if reference is None:
+        reference = load_encoder(model_name, backend="torch", use_bundle=False)
+
+    def timed_encode(encoder):
+        start_time = time.time()
+        vectors = np.asarray(encoder.encode(queries), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors, time.time() - start_time
+
+    ref_vectors, ref_time = timed_encode(reference)
+    cand_vectors, cand_time = timed_encode(candidate)
+    cosines = np.sum(ref_vectors * cand_vectors, axis=1)
+
+    # Ranking agreement: does each query keep the same nearest neighbour among the samples?
+    ref_neighbours = np.argsort(-(ref_vectors @ ref_vectors.T), axis=1)[:, 1]
+    cand_neighbours = np.argsort(-(cand_vectors @ cand_vectors.T), axis=1)[:, 1]
+
+    return {
+        "queries": len(queries),
+        "mean_cosine": float(cosines.mean()),
+        "min_cosine": float(cosines.min()),
+        "worst_query": queries[int(cosines.argmin())],
+        "neighbour_agreement": float((ref_neighbours == cand_neighbours).mean()),
+        "reference_time": ref_time,
+        "candidate_time": cand_time,
+        "passed": bool(cosines.min() >= threshold),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export an encoder backend and check parity with fp32")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--backend", default="onnx-int8", choices=BACKENDS)
+    parser.add_argument("--threshold", type=float, default=0.99)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    candidate = load_encoder(args.model, backend=args.backend)
+    report = parity_check(candidate, model_name=args.model, threshold=args.threshold)
+
+    print(f"\n📊 Parity report: {args.backend} vs torch fp32 ({report['queries']} queries)")
+    print("=" * 50)
+    print(f"   Mean cosine:          {report['mean_cosine']:.5f}")
+    print(f"   Min cosine:           {report['min_cosine']:.5f} ('{report['worst_query']}')")
+    print(f"   Neighbour agreement:  {report['neighbour_agreement'] * 100:.1f}%")
+    print(f"   Encode time (fp32):   {report['reference_time']:.3f}s")
+    print(f"   Encode time ({args.backend}): {report['candidate_time']:.3f}s")
+    print(f"   {'✅ Passed' if report['passed'] else '❌ Failed'} (threshold {args.threshold})")
+
+
+if __name__ == "__main__":
+    main()
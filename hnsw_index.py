@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+HNSW approximate-nearest-neighbor engine for the local segment index.
+
+Exact brute force (``SegmentIndex``) is fine at ~25k segments but scales
+linearly with the catalog. ``HNSWSegmentIndex`` builds an HNSW graph
+(via ``hnswlib``) over the same normalized vectors for sub-millisecond
+search at millions of segments. It has the same ``query(vector, top_k)``
+interface and result dicts as ``SegmentIndex``, so it drops into the same
+call sites (``SEARCH_BACKEND=hnsw``).
+
+Tunables (environment or constructor):
+
+    HNSW_M                graph degree (memory vs. recall)        default 16
+    HNSW_EF_CONSTRUCTION  build-time candidate list size          default 200
+    HNSW_EF_SEARCH        query-time candidate list size          default 64
+
+The graph is saved next to the cached segment vectors and reloaded on the
+next start. Run ``python hnsw_index.py`` to report recall@k and latency
+against exact search.
+"""
+
+import os
+import time
+import argparse
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from segment_index import SegmentIndex, SEGMENT_INDEX_DIR, VECTORS_FILE, sample_queries
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_M = int(os.getenv("HNSW_M", "16"))
+DEFAULT_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+DEFAULT_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+
+
+def _import_hnswlib():
+    try:
+        import hnswlib
+    except ImportError as e:
+        raise ImportError("The HNSW search backend needs 'hnswlib' installed") from e
+    return hnswlib
+
+
+class HNSWSegmentIndex:
+    """Approximate top-k over a SegmentIndex's vectors using an HNSW graph."""
+
+    def __init__(self, segments: SegmentIndex, M: int = DEFAULT_M,
+                 ef_construction: int = DEFAULT_EF_CONSTRUCTION, ef_search: int = DEFAULT_EF_SEARCH):
+        self.segments = segments
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.graph = None
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def _graph_path(self, directory: str) -> str:
+        return os.path.join(directory, f"hnsw_M{self.M}_ef{self.ef_construction}.bin")
+
+    def build(self, num_threads: int = -1) -> "HNSWSegmentIndex":
+        hnswlib = _import_hnswlib()
+        start_time = time.time()
+        logger.info(f"🔄 Building HNSW graph over {len(self.segments)} segments "
+                    f"(M={self.M}, ef_construction={self.ef_construction})...")
+        graph = hnswlib.Index(space="ip", dim=self.segments.dim)
+        graph.init_index(max_elements=max(len(self.segments), 1), M=self.M, ef_construction=self.ef_construction)
+        if len(self.segments):
+            graph.add_items(self.segments.vectors, np.arange(len(self.segments)), num_threads=num_threads)
+        graph.set_ef(self.ef_search)
+        self.graph = graph
+        logger.info(f"✅ HNSW graph built in {time.time() - start_time:.2f} seconds")
+        return self
+
+    def save(self, directory: str = SEGMENT_INDEX_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.graph.save_index(self._graph_path(directory))
+
+    def load(self, directory: str = SEGMENT_INDEX_DIR) -> "HNSWSegmentIndex":
+        hnswlib = _import_hnswlib()
+        graph = hnswlib.Index(space="ip", dim=self.segments.dim)
+        graph.load_index(self._graph_path(directory), max_elements=max(len(self.segments), 1))
+        if graph.get_current_count() != len(self.segments):
+            raise ValueError("HNSW graph does not match the segment index size")
+        graph.set_ef(self.ef_search)
+        self.graph = graph
+        return self
+
+    @classmethod
+    def load_or_build(cls, segments: SegmentIndex, directory: str = SEGMENT_INDEX_DIR,
+                      **params) -> "HNSWSegmentIndex":
+        """Reuse the saved graph when it is newer than the cached vectors, else build and save it."""
+        index = cls(segments, **params)
+        graph_path = index._graph_path(directory)
+        vectors_path = os.path.join(directory, VECTORS_FILE)
+        if os.path.exists(graph_path) and (not os.path.exists(vectors_path)
+                                           or os.path.getmtime(graph_path) >= os.path.getmtime(vectors_path)):
+            try:
+                start_time = time.time()
+                index.load(directory)
+                logger.info(f"✅ HNSW graph loaded from {graph_path} in {time.time() - start_time:.2f} seconds")
+                return index
+            except (RuntimeError, ValueError) as e:
+                logger.warning(f"⚠️  Rebuilding HNSW graph: {e}")
+        index.build()
+        index.save(directory)
+        return index
+
+    def set_ef_search(self, ef_search: int):
+        self.ef_search = ef_search
+        self.graph.set_ef(ef_search)
+
+    def query_rows(self, vectors: np.ndarray, top_k: int):
+        """Row ids and cosine scores for one or more normalized query vectors."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        top_k = min(top_k, len(self.segments))
+        if top_k <= 0:
+            empty = np.zeros((len(vectors), 0))
+            return empty.astype(np.int64), empty
+        # hnswlib searches with max(ef, k) candidates, so large k needs no ef change
+        labels, distances = self.graph.knn_query(vectors, k=top_k)
+        # 'ip' space reports 1 - inner product
+        return labels.astype(np.int64), 1.0 - distances
+
+    def query(self, vector: np.ndarray, top_k: int = 5, category: Optional[str] = None,
+              sub_category: Optional[str] = None) -> List[Dict]:
+        """Approximate top-k by cosine similarity for a normalized query vector."""
+        if category or sub_category:
+            # Category subsets are small enough that an exact scan of just those rows beats
+            # a graph walk that would have to skip every non-matching node
+            return self.segments.query(vector, top_k, category, sub_category)
+        rows, scores = self.query_rows(vector, top_k)
+        return [self.segments.result(row, score) for row, score in zip(rows[0], scores[0])]
+
+    def query_many(self, vectors: np.ndarray, top_k: int = 5, category: Optional[str] = None,
+                   sub_category: Optional[str] = None) -> List[List[Dict]]:
+        """Approximate top-k for many normalized query vectors in one hnswlib call."""
+        if category or sub_category:
+            return self.segments.query_many(vectors, top_k, category, sub_category)
+        rows, scores = self.query_rows(vectors, top_k)
+        return [[self.segments.result(row, score) for row, score in zip(rows[i], scores[i])]
+                for i in range(len(rows))]
+
+    def recall_at_k(self, queries: np.ndarray, k: int = 10) -> float:
+        """Fraction of the exact top-k that HNSW also returns, averaged over queries."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        approx_rows, _ = self.query_rows(queries, k)
+        exact_scores = queries @ self.segments.vectors.T
+        hits = 0
+        for i in range(len(queries)):
+            exact = set(self.segments.top_k_rows(exact_scores[i], k).tolist())
+            hits += len(exact.intersection(approx_rows[i].tolist()))
+        return hits / (len(queries) * min(k, len(self.segments))) if len(queries) else 0.0
+
+    def stats(self) -> Dict:
+        stats = self.segments.stats()
+        stats.update({
+            "engine": "hnsw",
+            "M": self.M,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+        })
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HNSW recall and latency against exact search")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--M", type=int, default=DEFAULT_M)
+    parser.add_argument("--ef-construction", type=int, default=DEFAULT_EF_CONSTRUCTION)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    segments = SegmentIndex.load_or_build()
+    index = HNSWSegmentIndex.load_or_build(segments, M=args.M, ef_construction=args.ef_construction)
+    queries = sample_queries(segments, args.queries)
+
+    start_time = time.time()
+    for query in queries:
+        segments.query(query, args.k)
+    exact_ms = (time.time() - start_time) / len(queries) * 1000
+
+    print(f"\n📊 HNSW vs exact ({len(segments)} segments, {len(queries)} queries, k={args.k})")
+    print("=" * 60)
+    print(f"   exact            latency {exact_ms:.3f}ms   recall 1.000")
+    for ef in args.ef_search:
+        index.set_ef_search(ef)
+        start_time = time.time()
+        for query in queries:
+            index.query(query, args.k)
+        hnsw_ms = (time.time() - start_time) / len(queries) * 1000
+        print(f"   ef_search={ef:<6} latency {hnsw_ms:.3f}ms   recall {index.recall_at_k(queries, args.k):.3f}")
+
+
+if __name__ == "__main__":
+    main()
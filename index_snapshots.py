@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Immutable, versioned snapshots of the local segment index.
+
+Refreshing the catalog used to mean restarting the API servers. Instead,
+each catalog build is written once into its own version directory and
+never rewritten after that. A ``CURRENT`` pointer selects the active
+version:
+
+    segment_index/versions/
+        CURRENT                          {"version": "20261017-101500-3fa2c1d0"}
+        20261017-101500-3fa2c1d0/        a SegmentIndex directory + snapshot.json
+        20261016-090000-91b7e4aa/        previous version, kept for rollback
+
+The version is a UTC build timestamp plus a content fingerprint of the
+vectors and metadata. Rebuilding an unchanged catalog therefore returns the
+active version and does not create a new one.
+
+A version is built into a hidden temp directory and renamed into place, so
+a half-built snapshot is never visible. ``CURRENT`` is replaced by rename as
+well. The servers load the new version in the background and then swap
+their globals in one step. In-flight queries still hold the old engine
+objects and finish on the old version. Old snapshot files stay readable
+through existing mmaps even after pruning.
+
+Other uvicorn workers poll ``CURRENT`` every ``SEGMENT_SNAPSHOT_POLL_SECONDS``
+and swap once they have loaded the same version.
+
+Live upserts and deletes on the exact engine go to a per-version overlay,
+``versions/.live/<version>/``, which holds the delta log and any compacted
+base. The version directory keeps matching its fingerprint. Activating a
+version again serves it with the edits made while it was active, and
+pruning the version removes its overlay as well.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Callable, Dict, List, Optional
+
+from segment_index import (
+    SegmentIndex,
+    SEGMENT_CSV_PATH,
+    SEGMENT_INDEX_DIR,
+    MANIFEST_FILE,
+    VECTORS_FILE,
+    ARENA_FILE,
+    ARENA_INDEX_FILE,
+    index_lock,
+    load_local_index,
+    replace_file,
+)
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_ROOT = os.getenv("SEGMENT_SNAPSHOT_DIR", os.path.join(SEGMENT_INDEX_DIR, "versions"))
+SNAPSHOT_KEEP = int(os.getenv("SEGMENT_SNAPSHOT_KEEP", "3"))  # Versions kept on disk, including the active one
+POLL_SECONDS = float(os.getenv("SEGMENT_SNAPSHOT_POLL_SECONDS", "5"))
+
+CURRENT_FILE = "CURRENT"
+LIVE_DIR_NAME = ".live"  # Per-version delta/compaction overlays (hidden, so never listed as versions)
+SNAPSHOT_MANIFEST = "snapshot.json"
+SNAPSHOT_FILES = (VECTORS_FILE, ARENA_FILE, ARENA_INDEX_FILE, MANIFEST_FILE)
+
+
+def snapshot_dir(version: str, root: str = SNAPSHOT_ROOT) -> str:
+    return os.path.join(root, version)
+
+
+def overlay_dir(version: str, root: str = SNAPSHOT_ROOT) -> str:
+    """Where the exact engine keeps live edits to a version; the version directory itself is never written."""
+    return os.path.join(root, LIVE_DIR_NAME, version)
+
+
+def active_version(root: str = SNAPSHOT_ROOT) -> Optional[str]:
+    """The version CURRENT points at, or None before the first snapshot is published."""
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return json.load(f).get("version")
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def read_snapshot_manifest(version: str, root: str = SNAPSHOT_ROOT) -> Optional[Dict]:
+    try:
+        with open(os.path.join(snapshot_dir(version, root), SNAPSHOT_MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def list_versions(root: str = SNAPSHOT_ROOT) -> List[str]:
+    """Complete snapshots on disk, oldest first (versions sort by build time)."""
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if not name.startswith(".") and os.path.exists(os.path.join(root, name, SNAPSHOT_MANIFEST)))
+
+
+def content_fingerprint(directory: str) -> str:
+    """sha1 over the vectors and metadata files of a SegmentIndex directory."""
+    digest = hashlib.sha1()
+    for name in (VECTORS_FILE, ARENA_FILE, ARENA_INDEX_FILE):
+        with open(os.path.join(directory, name), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def build_snapshot(csv_path: str = SEGMENT_CSV_PATH, root: str = SNAPSHOT_ROOT) -> str:
+    """Build a snapshot of the catalog and return its version (the active one if nothing changed).
+
+    ``SEGMENT_INDEX_DIR`` serves as the build cache: it is refreshed from the
+    CSV when the CSV is newer, then copied into the new version directory.
+    The snapshot is not published; call ``publish`` once it has been loaded.
+    """
+    start_time = time.time()
+    segments = SegmentIndex.load_or_build(csv_path)
+    os.makedirs(root, exist_ok=True)
+    # Private build directory: workers building in the same second never touch each other's copy
+    tmp_dir = tempfile.mkdtemp(prefix=".building-", dir=root)
+    try:
+        # Fingerprint and copy one consistent file set, even if the build cache is being rewritten
+        with index_lock(SEGMENT_INDEX_DIR, exclusive=False):
+            fingerprint = content_fingerprint(SEGMENT_INDEX_DIR)
+            current = active_version(root)
+            if current is not None and (read_snapshot_manifest(current, root) or {}).get("fingerprint") == fingerprint:
+                logger.info(f"✅ Catalog unchanged, snapshot {current} stays active")
+                return current
+            for name in SNAPSHOT_FILES:
+                shutil.copyfile(os.path.join(SEGMENT_INDEX_DIR, name), os.path.join(tmp_dir, name))
+
+        version = f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}-{fingerprint[:8]}"
+        final_dir = snapshot_dir(version, root)
+        if os.path.exists(final_dir):
+            return version
+        manifest = {
+            "version": version,
+            "fingerprint": fingerprint,
+            "created_at": time.time(),
+            "source": os.path.abspath(csv_path),
+            "count": len(segments),
+            "dim": segments.dim,
+        }
+        with open(os.path.join(tmp_dir, SNAPSHOT_MANIFEST), "w") as f:
+            json.dump(manifest, f)
+        # The rename makes the whole version appear at once
+        try:
+            os.rename(tmp_dir, final_dir)
+        except OSError:
+            # Another worker published the same version first
+            if not os.path.exists(os.path.join(final_dir, SNAPSHOT_MANIFEST)):
+                raise
+            return version
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    logger.info(f"✅ Snapshot {version} built: {len(segments)} segments in {time.time() - start_time:.2f} seconds")
+    return version
+
+
+def publish(version: str, root: str = SNAPSHOT_ROOT, keep: int = SNAPSHOT_KEEP):
+    """Point CURRENT at a built version, then prune old versions."""
+    if read_snapshot_manifest(version, root) is None:
+        raise FileNotFoundError(f"No snapshot {version} in {root}")
+    replace_file(os.path.join(root, CURRENT_FILE),
+                 lambda f: json.dump({"version": version, "published_at": time.time()}, f), mode="w")
+    logger.info(f"🔀 Snapshot {version} is now active")
+    prune(root, keep)
+
+
+def prune(root: str = SNAPSHOT_ROOT, keep: int = SNAPSHOT_KEEP):
+    """Delete all but the newest ``keep`` versions; the active version is never deleted."""
+    current = active_version(root)
+    versions = list_versions(root)
+    for version in versions[:max(len(versions) - max(keep, 1), 0)]:
+        if version != current:
+            # Workers still mapping these files keep reading them until they swap
+            shutil.rmtree(snapshot_dir(version, root), ignore_errors=True)
+            shutil.rmtree(overlay_dir(version, root), ignore_errors=True)
+            logger.info(f"🗑️  Pruned snapshot {version}")
+
+
+def ensure_snapshot(csv_path: str = SEGMENT_CSV_PATH, root: str = SNAPSHOT_ROOT) -> str:
+    """The active version, building and publishing the first snapshot when there is none."""
+    version = active_version(root)
+    if version is not None and read_snapshot_manifest(version, root) is not None:
+        return version
+    version = build_snapshot(csv_path, root)
+    publish(version, root)
+    return version
+
+
+def load_snapshot(version: str, engine: str = "exact", root: str = SNAPSHOT_ROOT):
+    """Load the search engine for a snapshot; derived engine files are built inside its directory."""
+    return load_local_index(engine, snapshot_dir(version, root), rebuild=False,
+                            state_dir=overlay_dir(version, root))
+
+
+def watch_active_version(on_change: Callable[[str], None], root: str = SNAPSHOT_ROOT,
+                         interval: float = POLL_SECONDS) -> threading.Thread:
+    """Call on_change(version) from a daemon thread whenever CURRENT points somewhere new."""
+    def run():
+        seen = active_version(root)
+        while True:
+            time.sleep(interval)
+            version = active_version(root)
+            if version is None or version == seen:
+                continue
+            try:
+                on_change(version)
+                seen = version
+            except Exception as e:
+                logger.error(f"❌ Switching to snapshot {version} failed: {e}")
+
+    thread = threading.Thread(target=run, name="snapshot-watcher", daemon=True)
+    thread.start()
+    return thread
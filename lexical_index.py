@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+BM25 lexical search over the segment catalog, plus reciprocal rank fusion.
+
+Many intents are literally a segment name ("tiktok advertising", "weight
+loss"). An inverted index over each segment's ``topic`` and
+``topic_description`` answers those without a 1024-dim encoder pass, and
+returns real catalog segments. It replaces the hard-coded keyword table
+the fast servers used to have.
+
+Postings store the final BM25 contribution of every (term, segment) pair,
+so a query is just a few scatter-adds into a score array. The index is
+built at startup from the local ``SegmentIndex`` metadata. Descriptions are
+joined by topic ID from ``SEGMENT_DESCRIPTIONS_CSV``, which defaults to
+``SEGMENT_CATEGORY_CSV``.
+
+``reciprocal_rank_fusion`` merges the lexical and vector rankings with
+per-list weights:
+
+    score(segment) = sum_i  weight_i / (RRF_K + rank_i(segment))
+"""
+
+import os
+import re
+import time
+import math
+import logging
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from segment_index import SegmentIndex, SEGMENT_CATEGORY_CSV, find_column
+
+logger = logging.getLogger(__name__)
+
+DESCRIPTIONS_CSV = os.getenv("SEGMENT_DESCRIPTIONS_CSV", SEGMENT_CATEGORY_CSV)
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+TOPIC_BOOST = int(os.getenv("BM25_TOPIC_BOOST", "2"))  # Topic terms count this many times vs description terms
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from how i in into is it of on or our the their this to want we with "
+    "who what my me".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _normalize_topic(text: str) -> str:
+    return " ".join(_TOKEN.findall(text.lower()))
+
+
+def load_topic_descriptions(csv_path: str) -> Dict[str, str]:
+    """topic ID -> description text from the descriptions CSV."""
+    import pandas as pd
+
+    df = pd.read_csv(csv_path)
+    topic_col = find_column(df, "topicid")
+    description_col = find_column(df, "topicdescription", "description")
+    if topic_col is None or description_col is None:
+        logger.warning(f"⚠️  No topic ID / description columns in {csv_path}, indexing topics only")
+        return {}
+    return {
+        str(row[topic_col]): str(row[description_col])
+        for _, row in df.iterrows()
+        if pd.notna(row[topic_col]) and pd.notna(row[description_col])
+    }
+
+
+class BM25Index:
+    """Inverted index with precomputed BM25 weights over a SegmentIndex's metadata."""
+
+    def __init__(self, segments: SegmentIndex, postings: Dict[str, tuple], topic_rows: Dict[str, List[int]]):
+        self.segments = segments
+        self.postings = postings
+        self.topic_rows = topic_rows
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    @classmethod
+    def build(cls, segments: SegmentIndex, descriptions: Optional[Dict[str, str]] = None,
+              k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        start_time = time.time()
+        descriptions = descriptions or {}
+
+        term_rows: Dict[str, List[int]] = {}
+        term_freqs: Dict[str, List[int]] = {}
+        lengths = np.zeros(len(segments), dtype=np.float32)
+        topic_rows: Dict[str, List[int]] = {}
+        for row in range(len(segments)):
+            topic = segments.topics[row]
+            tokens = tokenize(topic) * TOPIC_BOOST + tokenize(descriptions.get(segments.topic_ids[row], ""))
+            lengths[row] = len(tokens)
+            for term, count in Counter(tokens).items():
+                term_rows.setdefault(term, []).append(row)
+                term_freqs.setdefault(term, []).append(count)
+            topic_rows.setdefault(_normalize_topic(topic), []).append(row)
+
+        count = len(segments)
+        average_length = float(lengths.mean()) if count and lengths.mean() > 0 else 1.0
+        length_norm = k1 * (1 - b + b * lengths / average_length)
+        postings = {}
+        for term, rows in term_rows.items():
+            rows = np.asarray(rows, dtype=np.int64)
+            freqs = np.asarray(term_freqs[term], dtype=np.float32)
+            idf = math.log(1 + (count - len(rows) + 0.5) / (len(rows) + 0.5))
+            postings[term] = (rows, (idf * freqs * (k1 + 1) / (freqs + length_norm[rows])).astype(np.float32))
+
+        logger.info(f"✅ BM25 index built: {count} segments, {len(postings)} terms "
+                    f"in {time.time() - start_time:.2f} seconds")
+        return cls(segments, postings, topic_rows)
+
+    def is_exact_topic(self, text: str) -> bool:
+        """True when the query is literally a segment name, so no semantic expansion is needed."""
+        return _normalize_topic(text) in self.topic_rows
+
+    def scores(self, text: str) -> np.ndarray:
+        scores = np.zeros(len(self.segments), dtype=np.float32)
+        for term in set(tokenize(text)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                # Rows are unique within a posting, so a fancy-indexed add is safe
+                scores[posting[0]] += posting[1]
+        return scores
+
+    def query(self, text: str, top_k: int = 5, category: Optional[str] = None,
+              sub_category: Optional[str] = None) -> List[Dict]:
+        """Top-k segments by BM25 score; segments sharing no term with the query are never returned."""
+        scores = self.scores(text)
+        rows = self.segments.filter_rows(category, sub_category)
+        if rows is None:
+            rows = np.flatnonzero(scores)
+        else:
+            rows = rows[scores[rows] > 0]
+        subset = scores[rows]
+        return [self.segments.result(rows[i], subset[i]) for i in self.segments.top_k_rows(subset, top_k)]
+
+    def stats(self) -> Dict:
+        return {
+            "engine": "bm25",
+            "segments": len(self.segments),
+            "terms": len(self.postings),
+            "postings": int(sum(len(rows) for rows, _ in self.postings.values())),
+        }
+
+
+def reciprocal_rank_fusion(ranked_lists: List[List[Dict]], weights: List[float], top_k: int = 5,
+                           k: int = RRF_K) -> List[Dict]:
+    """Merge rankings by weighted reciprocal rank; 'score' becomes the fused score."""
+    fused: Dict[str, float] = {}
+    first_seen: Dict[str, Dict] = {}
+    for results, weight in zip(ranked_lists, weights):
+        if weight <= 0:
+            continue
+        for rank, result in enumerate(results, 1):
+            key = result['segment_id']
+            fused[key] = fused.get(key, 0.0) + weight / (k + rank)
+            first_seen.setdefault(key, result)
+    order = sorted(fused, key=fused.get, reverse=True)[:top_k]
+    return [dict(first_seen[key], score=fused[key]) for key in order]
+
+
+def load_descriptions(csv_path: str = DESCRIPTIONS_CSV) -> Dict[str, str]:
+    """Topic descriptions from SEGMENT_DESCRIPTIONS_CSV, or {} when it is not configured."""
+    if csv_path and os.path.exists(csv_path):
+        return load_topic_descriptions(csv_path)
+    return {}
+
+
+def load_lexical_index(segments: Optional[SegmentIndex] = None,
+                       descriptions: Optional[Dict[str, str]] = None) -> Optional[BM25Index]:
+    """Build the BM25 index from the catalog; None when no local catalog is available."""
+    if segments is None:
+        try:
+            segments = SegmentIndex.load_or_build()
+        except FileNotFoundError as e:
+            logger.warning(f"⚠️  Lexical search disabled, no segment catalog: {e}")
+            return None
+    if descriptions is None:
+        descriptions = load_descriptions()
+    return BM25Index.build(segments, descriptions)
@@ -1,22 +1,58 @@
 import os
 import time
 import asyncio
+import threading
 import numpy as np
-from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
-import pinecone
 from typing import List, Dict, Optional
 import logging
+from embedding_scheduler import EmbeddingScheduler
+from embedding_cache import get_embedding_cache
+from encoder_backends import load_encoder, encoder_key, encoder_dimension
+from service_readiness import ServiceReadiness
+from segment_index import SegmentIndex
+from index_snapshots import (
+    active_version,
+    ensure_snapshot,
+    build_snapshot,
+    publish,
+    snapshot_dir,
+    watch_active_version,
+)
+from lexical_index import load_lexical_index, load_descriptions, reciprocal_rank_fusion
+from metadata_store import load_metadata_store
+from vector_backends import SEARCH_BACKEND, LOCAL_ENGINES
+from backend_resilience import (
+    SEARCH_FALLBACK_BACKEND,
+    BackendUnavailable,
+    load_resilient_backend,
+    backend_metrics,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = "BAAI/bge-large-en-v1.5"
+ENCODER_KEY = encoder_key(MODEL_NAME)  # Model + backend (ENCODER_BACKEND), used for cache keys
+# Default reciprocal-rank-fusion weights; lexical weight 0 keeps /search purely semantic
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "0.0"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))  # Results per ranking fed into the fusion
+
 # Global variables for caching
 _model = None
-_pinecone_client = None
-_index = None
+_backend = None  # VectorBackend picked by SEARCH_BACKEND (vector_backends.py)
+_lexical_index = None
+_metadata_store = None  # Segment ID -> topic/description, so Pinecone can skip include_metadata
+_index_version = None  # Active catalog snapshot (see index_snapshots)
+_scheduler = None
+_async_client = False  # Pinecone queries through the pooled async client (api_server_optimized)
 _initialized = False
+_init_lock = threading.Lock()
+_reload_lock = threading.Lock()
+
+# Loading progress, reported by /ready while services load in the background
+readiness = ServiceReadiness(["index", "lexical", "encoder"])
 
 def normalize(vec):
     """Normalize a vector to unit length (L2 norm)."""
@@ -27,86 +63,260 @@ def normalize(vec):
     return vec / norm
 
 def initialize_services():
-    """Initialize and cache the model and Pinecone connection."""
-    global _model, _pinecone_client, _index, _initialized
+    """Initialize and cache the model and the vector backend selected by SEARCH_BACKEND."""
+    global _model, _backend, _lexical_index, _metadata_store, _index_version, _scheduler, _initialized
     
     if _initialized:
         return
     
-    start_time = time.time()
+    with _init_lock:
+        if _initialized:
+            return
+        
+        start_time = time.time()
+        
+        # Load the vector index first so cached embeddings can be served while the model loads
+        if _backend is None:
+            with readiness.stage("index"):
+                if SEARCH_BACKEND in LOCAL_ENGINES or SEARCH_FALLBACK_BACKEND in LOCAL_ENGINES:
+                    _index_version = ensure_snapshot()
+                # Remote stores get hedged queries, a circuit breaker and the fallback tier
+                _backend = load_resilient_backend(SEARCH_BACKEND, version=_index_version, async_client=_async_client)
+        
+        # BM25 over the catalog answers lexical queries without the encoder
+        if not readiness.is_stage_done("lexical"):
+            with readiness.stage("lexical"):
+                try:
+                    catalog = _load_catalog()
+                    descriptions = load_descriptions()
+                    _lexical_index = load_lexical_index(catalog, descriptions)
+                    # Vector matches are joined against the catalog instead of carrying metadata
+                    _metadata_store = load_metadata_store(catalog, descriptions)
+                except Exception as e:
+                    # BM25 is optional; a bad catalog or descriptions CSV must not take vector search down
+                    logger.error(f"❌ Lexical index failed to load, continuing without BM25: {e}")
+                    _lexical_index, _metadata_store = None, None
+                _backend.metadata_store = _metadata_store
+        
+        # Load model (this is the biggest bottleneck)
+        if _model is None:
+            with readiness.stage("encoder"):
+                logger.info("🔄 Loading embedding model (BAAI/bge-large-en-v1.5)...")
+                _model = load_encoder(MODEL_NAME)
+                logger.info("✅ Model loaded and cached!")
+        
+        # An index built for another model would return garbage, so refuse to serve
+        index_dim = _backend.dimension()
+        if index_dim is not None:
+            encoder_dim = encoder_dimension(_model)
+            if index_dim != encoder_dim:
+                raise ValueError(f"❌ {SEARCH_BACKEND} index has {index_dim} dims but {MODEL_NAME} produces {encoder_dim}")
+        
+        # Share encode calls between concurrent searches
+        if _scheduler is None:
+            _scheduler = EmbeddingScheduler(_model)
+        
+        _initialized = True
+        readiness.mark_ready()
+        logger.info(f"🚀 Services initialized in {time.time() - start_time:.2f} seconds")
+        
+        # Follow snapshots published by other workers (or by /admin/reload)
+        if _index_version is not None:
+            # Already published by whoever moved CURRENT, so only swap here
+            watch_active_version(lambda version: reload_index(version, publish_version=False))
+
+def _load_catalog() -> Optional[SegmentIndex]:
+    """Segment metadata of the active snapshot for BM25; None when no local catalog exists."""
+    global _index_version
+    engine = getattr(_backend, "engine", None)
+    if engine is not None:
+        return getattr(engine, "segments", engine)
+    try:
+        _index_version = ensure_snapshot()
+    except FileNotFoundError as e:
+        logger.warning(f"⚠️  No local segment catalog, lexical search disabled: {e}")
+        return None
+    return SegmentIndex.load(snapshot_dir(_index_version))
+
+def reload_index(version: Optional[str] = None, publish_version: bool = True) -> str:
+    """
+    Load a catalog snapshot and swap it in without a restart.
+    
+    With no version, a snapshot is built from the current catalog. Either
+    way the version is published once it has loaded, so the other workers
+    follow (the watcher passes publish_version=False). The new engines replace the globals in
+    one assignment; queries already running keep the objects they hold and
+    finish on the old version.
+    """
+    global _backend, _lexical_index, _metadata_store, _index_version
     
-    # Load model (this is the biggest bottleneck)
-    if _model is None:
-        logger.info("🔄 Loading embedding model (BAAI/bge-large-en-v1.5)...")
-        _model = SentenceTransformer("BAAI/bge-large-en-v1.5")
-        logger.info("✅ Model loaded and cached!")
-    
-    # Initialize Pinecone connection
-    if _pinecone_client is None:
-        load_dotenv()
-        api_key = os.getenv("PINECONE_API_KEY")
-        environment = os.getenv("PINECONE_ENV")
-        if not api_key or not environment:
-            raise ValueError("❌ Missing Pinecone credentials in .env file.")
+    with _reload_lock:
+        target = version or build_snapshot()
+        if target == _index_version:
+            # Already serving it here; make sure the other workers follow too
+            if publish_version and active_version() != target:
+                publish(target)
+            return target
+        
+        start_time = time.time()
+        # Local engines load the snapshot; remote stores keep their connections
+        backend = _backend.reloaded(target)
+        index_dim = backend.dimension()
+        if index_dim is not None and _model is not None and index_dim != encoder_dimension(_model):
+            raise ValueError(f"❌ Snapshot {target} has {index_dim} dims but {MODEL_NAME} produces {encoder_dimension(_model)}")
+        engine = getattr(backend, "engine", None)
+        catalog = getattr(engine, "segments", engine) or SegmentIndex.load(snapshot_dir(target))
+        descriptions = load_descriptions()
+        lexical_index = load_lexical_index(catalog, descriptions)
+        metadata_store = load_metadata_store(catalog, descriptions)
+        backend.metadata_store = metadata_store
         
-        logger.info("🔗 Connecting to Pinecone...")
-        _pinecone_client = pinecone.Pinecone(api_key=api_key)
-        _index = _pinecone_client.Index("audiencelab-embeddings-1024")
-        logger.info("✅ Pinecone connected and cached!")
+        previous = _index_version
+        _backend, _lexical_index, _metadata_store, _index_version = (
+            backend, lexical_index, metadata_store, target
+        )
+        # Explicit versions too, so every worker's watcher follows a rollback
+        if publish_version:
+            publish(target)
+        logger.info(f"🔀 Swapped index {previous} -> {target} in {time.time() - start_time:.2f} seconds")
+        return target
+
+def start_background_reload(version: Optional[str] = None) -> bool:
+    """Run reload_index in a daemon thread; False when a reload is already in progress."""
+    if _reload_lock.locked():
+        return False
     
-    _initialized = True
-    logger.info(f"🚀 Services initialized in {time.time() - start_time:.2f} seconds")
+    def run():
+        try:
+            reload_index(version)
+        except Exception as e:
+            logger.error(f"❌ Index reload failed: {e}")
+    
+    threading.Thread(target=run, name="index-reload", daemon=True).start()
+    return True
+
+def active_index_version() -> Optional[str]:
+    return _index_version
+
+def vector_backend_metrics() -> Dict[str, float]:
+    """Breaker state, hedge rate and latency percentiles of the remote vector backend (empty for local engines)."""
+    return backend_metrics(_backend)
 
-def find_matching_segments(user_query: str, top_k: int = 5) -> List[Dict]:
+def start_background_initialization(async_client: bool = False):
+    """Load the model and vector index in a background thread (async_client for servers that await aquery)."""
+    global _async_client
+    _async_client = async_client
+    readiness.start(initialize_services)
+
+def find_matching_segments(user_query: str, top_k: int = 5, category: Optional[str] = None,
+                           sub_category: Optional[str] = None) -> List[Dict]:
     """
     Optimized search function that returns results as structured data.
     
     Args:
         user_query: The search query
         top_k: Number of results to return
+        category: Only return segments in this category
+        sub_category: Only return segments in this sub-category
         
     Returns:
         List of dictionaries containing match information
     """
-    global _model, _index
+    global _scheduler
     
     # Ensure services are initialized
     initialize_services()
     
     start_time = time.time()
     
-    # Generate embedding
-    embedding = _model.encode(user_query)
-    embedding = normalize(embedding)
+    # Generate embedding (cached per query, batched with concurrent callers, already normalized)
+    embedding = get_embedding_cache().get_or_compute(user_query, ENCODER_KEY, _scheduler.encode)
     
     embedding_time = time.time() - start_time
     
-    # Query Pinecone
-    response = _index.query(
-        vector=embedding.tolist(),
-        top_k=top_k,
-        include_metadata=True
-    )
+    # Query the vector backend
+    results = _query_index(embedding, top_k, category, sub_category)
     
     query_time = time.time() - start_time - embedding_time
-    
-    # Process results
-    results = []
-    for match in response.matches:
-        metadata = match.metadata or {}
-        results.append({
-            'topic': metadata.get('topic', 'N/A'),
-            'topic_id': metadata.get('topic_ID', 'N/A'),
-            'score': match.score,
-            'segment_id': match.id
-        })
-    
     total_time = time.time() - start_time
     
     logger.info(f"⚡ Search completed in {total_time:.3f}s (embedding: {embedding_time:.3f}s, query: {query_time:.3f}s)")
     
     return results
 
+def find_matching_segments_without_encoder(user_query: str, top_k: int = 5, category: Optional[str] = None,
+                                           sub_category: Optional[str] = None) -> Optional[List[Dict]]:
+    """
+    Serve a search while the encoder is still loading.
+    
+    Only works when the query embedding is already cached and the vector
+    index is loaded; returns None otherwise so the caller can answer 503.
+    """
+    if _backend is None:
+        return None
+    
+    embedding = get_embedding_cache().get(user_query, ENCODER_KEY)
+    if embedding is None:
+        return None
+    
+    return _query_index(embedding, top_k, category, sub_category)
+
+def hybrid_search(user_query: str, top_k: int = 5, vector_weight: Optional[float] = None,
+                  lexical_weight: Optional[float] = None, category: Optional[str] = None,
+                  sub_category: Optional[str] = None) -> Optional[List[Dict]]:
+    """
+    Fuse BM25 and vector rankings with weighted reciprocal rank fusion.
+    
+    Queries that name a segment exactly, or calls with vector_weight=0, are
+    answered from BM25 alone without touching the encoder. While the encoder
+    is loading only cached embeddings are used; returns None when nothing
+    could be served yet. When the remote vector store is down or too slow
+    (circuit open, timeout), BM25 answers alone if it finds anything.
+    """
+    vector_weight = HYBRID_VECTOR_WEIGHT if vector_weight is None else vector_weight
+    lexical_weight = HYBRID_LEXICAL_WEIGHT if lexical_weight is None else lexical_weight
+    lexical_index = _lexical_index  # One version for the whole request, even if a reload swaps it
+    fuse = lexical_index is not None and lexical_weight > 0
+    candidates = max(top_k, HYBRID_CANDIDATES) if fuse else top_k
+    
+    lexical = []
+    if fuse:
+        lexical = with_descriptions(lexical_index.query(user_query, candidates, category, sub_category))
+        if vector_weight <= 0 or (lexical and lexical_index.is_exact_topic(user_query)):
+            return lexical[:top_k]
+    
+    try:
+        if readiness.ready:
+            vector = find_matching_segments(user_query, candidates, category, sub_category)
+        else:
+            vector = find_matching_segments_without_encoder(user_query, candidates, category, sub_category)
+            if vector is None:
+                return lexical[:top_k] if lexical else None
+    except (BackendUnavailable, TimeoutError) as e:
+        if lexical_index is None:
+            raise
+        if not fuse:
+            lexical = with_descriptions(lexical_index.query(user_query, top_k, category, sub_category))
+        if not lexical:
+            raise
+        logger.warning(f"⚠️  Vector search unavailable ({e}), serving BM25 results")
+        return lexical[:top_k]
+    
+    if not fuse:
+        # Plain semantic search keeps cosine scores
+        return vector
+    return reciprocal_rank_fusion([vector, lexical], [vector_weight, lexical_weight], top_k)
+
+def with_descriptions(results: List[Dict]) -> List[Dict]:
+    """Add catalog descriptions to results that already carry topic metadata."""
+    metadata_store = _metadata_store
+    return metadata_store.annotate(results) if metadata_store is not None else results
+
+def _query_index(embedding: np.ndarray, top_k: int, category: Optional[str] = None,
+                 sub_category: Optional[str] = None) -> List[Dict]:
+    """Query the vector backend with a normalized embedding; filters prune candidates before top-k."""
+    return _backend.query(embedding, top_k, category, sub_category)
+
 def display_results(results: List[Dict]):
     """Display search results in a formatted way."""
     print("\n=== Top Matching Audience Segments ===")
@@ -129,16 +339,30 @@ async def async_find_matching_segments(user_query: str, top_k: int = 5) -> List[
     loop = asyncio.get_event_loop()
     return await loop.run_in_executor(None, find_matching_segments, user_query, top_k)
 
-def batch_search(queries: List[str], top_k: int = 5) -> List[List[Dict]]:
+def batch_search(queries: List[str], top_k: int = 5, category: Optional[str] = None,
+                 sub_category: Optional[str] = None) -> List[List[Dict]]:
     """
     Batch search multiple queries efficiently.
+    
+    All queries are encoded in shared batches (cached ones are skipped), then
+    scored together by the backend's query_many: one matrix multiply for the
+    local engines, or concurrent Pinecone queries capped at
+    PINECONE_QUERY_CONCURRENCY. Results are returned in input order.
     """
     initialize_services()
     
-    results = []
-    for query in queries:
-        result = find_matching_segments(query, top_k)
-        results.append(result)
+    if not queries:
+        return []
+    
+    start_time = time.time()
+    embeddings = np.vstack(get_embedding_cache().get_or_compute_many(queries, ENCODER_KEY, _scheduler.encode_many))
+    embedding_time = time.time() - start_time
+    
+    results = _backend.query_many(embeddings, top_k, category, sub_category)
+    
+    total_time = time.time() - start_time
+    logger.info(f"⚡ Batch of {len(queries)} searches completed in {total_time:.3f}s "
+                f"(embedding: {embedding_time:.3f}s, query: {total_time - embedding_time:.3f}s)")
     
     return results
 
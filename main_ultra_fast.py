@@ -4,35 +4,29 @@ import re
 from dotenv import load_dotenv
 import pinecone
 from typing import List, Dict, Optional
+from lexical_index import load_lexical_index
+from phrase_matcher import load_phrase_matcher
 
 # Global variables for caching
 _pinecone_client = None
 _index = None
+_lexical_index = None
+_phrase_matcher = None
 _initialized = False
 
-# Pre-defined common queries and their likely segment matches
-COMMON_QUERIES = {
-    'digital marketing': ['Digital Marketing', 'Marketing Skills', 'Digital Agency'],
-    'business': ['Business', 'Entrepreneurship', 'Startup'],
-    'weight loss': ['Weight Loss', 'Fitness', 'Health'],
-    'productivity': ['Productivity', 'Time Management', 'Work'],
-    'sleep': ['Sleep', 'Health', 'Wellness'],
-    'coding': ['Programming', 'Technology', 'Software'],
-    'investment': ['Investment', 'Finance', 'Stocks'],
-    'vacation': ['Travel', 'Vacation', 'Leisure'],
-    'house': ['Real Estate', 'Home Buying', 'Property'],
-    'podcast': ['Podcasting', 'Content Creation', 'Media']
-}
-
 def initialize_services():
-    """Initialize Pinecone connection only."""
-    global _pinecone_client, _index, _initialized
+    """Initialize the BM25 catalog index and the Pinecone connection."""
+    global _pinecone_client, _index, _lexical_index, _phrase_matcher, _initialized
     
     if _initialized:
         return
     
     start_time = time.time()
     
+    # Keyword matches come from a BM25 index over the real segment catalog
+    _lexical_index = load_lexical_index()
+    _phrase_matcher = load_phrase_matcher(_lexical_index.segments if _lexical_index else None)
+    
     # Initialize Pinecone connection
     load_dotenv()
     api_key = os.getenv("PINECONE_API_KEY")
@@ -48,15 +42,18 @@ def initialize_services():
     _initialized = True
     print(f"🚀 Services initialized in {time.time() - start_time:.2f} seconds")
 
-def find_common_matches(user_query: str) -> Optional[List[str]]:
-    """Check if query matches common patterns for instant results."""
-    query_lower = user_query.lower()
-    
-    for pattern, matches in COMMON_QUERIES.items():
-        if pattern in query_lower:
-            return matches
-    
-    return None
+def find_keyword_matches(user_query: str, top_k: int = 5) -> Optional[List[Dict]]:
+    """
+    Catalog segments named in the query (Aho-Corasick phrase matches), topped
+    up with BM25 keyword matches; None when nothing in the catalog matches.
+    """
+    results = _phrase_matcher.match_segments(user_query, top_k) if _phrase_matcher else []
+    if len(results) < top_k and _lexical_index is not None:
+        seen = {result['segment_id'] for result in results}
+        for result in _lexical_index.query(user_query, top_k):
+            if result['segment_id'] not in seen and len(results) < top_k:
+                results.append(result)
+    return results or None
 
 def find_matching_segments_fast(user_query: str, top_k: int = 5) -> List[Dict]:
     """
@@ -69,26 +66,18 @@ def find_matching_segments_fast(user_query: str, top_k: int = 5) -> List[Dict]:
     
     start_time = time.time()
     
-    # First, try common query matching for instant results
-    common_matches = find_common_matches(user_query)
+    # First, try keyword matching for instant results (no embedding needed)
+    keyword_matches = find_keyword_matches(user_query, top_k)
     
-    if common_matches:
+    if keyword_matches:
         print(f"⚡ Found instant matches for: '{user_query}'")
-        print(f"🔍 Common topics: {', '.join(common_matches)}")
+        print(f"🔍 Matching topics: {', '.join(result['topic'] for result in keyword_matches)}")
         
-        # Return mock results based on common patterns
-        results = []
-        for i, topic in enumerate(common_matches[:top_k]):
-            results.append({
-                'topic': topic,
-                'topic_id': f'common_{i}',
-                'score': 0.9 - (i * 0.1),  # Decreasing scores
-                'segment_id': f'segment_common_{i}',
-                'method': 'keyword_match'
-            })
+        for result in keyword_matches:
+            result['method'] = 'keyword_match'
         
         print(f"⚡ Instant search completed in {time.time() - start_time:.3f}s")
-        return results
+        return keyword_matches
     
     # Fallback: Use a simple dummy vector for Pinecone query
     print(f"🔍 Using Pinecone search for: '{user_query}'")
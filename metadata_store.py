@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+In-process segment metadata keyed by segment ID.
+
+Pinecone queries used to ask for ``include_metadata=True``, which makes every
+match carry its topic, topic ID and categories over the network. Callers
+that wanted descriptions then needed one more lookup per match.
+``SegmentMetadataStore`` holds all of that locally, loaded from the catalog
+at startup. Vector queries can then ask for IDs and scores only and join
+them here in microseconds.
+
+The topic, topic ID and category columns are the ``SegmentIndex`` string
+arenas themselves (memory-mapped and shared between workers). Descriptions
+are packed into one more arena, aligned with the catalog rows. A dict maps
+each segment ID to its row.
+"""
+
+import time
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from segment_index import SegmentIndex, StringArena
+from lexical_index import load_descriptions
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentMetadataStore:
+    """Segment ID -> topic, topic_ID, category, sub_category and description."""
+
+    def __init__(self, segments: SegmentIndex, descriptions: StringArena):
+        self.segments = segments
+        self.descriptions = descriptions
+        self._rows: Dict[str, int] = {}
+        for row, segment_id in enumerate(segments.ids):
+            self._rows.setdefault(segment_id, row)
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, segment_id: str) -> bool:
+        return segment_id in self._rows
+
+    @classmethod
+    def build(cls, segments: SegmentIndex, descriptions: Optional[Dict[str, str]] = None) -> "SegmentMetadataStore":
+        """Pack descriptions (by topic ID) into an arena aligned with the catalog rows."""
+        start_time = time.time()
+        descriptions = descriptions or {}
+        encoded = [descriptions.get(topic_id, "").encode("utf-8") for topic_id in segments.topic_ids]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) for value in encoded], dtype=np.int64)
+        store = cls(segments, StringArena(b"".join(encoded), offsets))
+        logger.info(f"✅ Metadata store built: {len(store)} segments, "
+                    f"{sum(1 for value in encoded if value)} descriptions in {time.time() - start_time:.2f} seconds")
+        return store
+
+    def get(self, segment_id: str) -> Optional[Dict]:
+        row = self._rows.get(segment_id)
+        if row is None:
+            return None
+        return {
+            'topic': self.segments.topics[row],
+            'topic_id': self.segments.topic_ids[row],
+            'category': self.segments.categories[row],
+            'sub_category': self.segments.sub_categories[row],
+            'description': self.descriptions[row],
+        }
+
+    def missing(self, segment_ids: Iterable[str]) -> List[str]:
+        """IDs the catalog does not know (vector index and catalog out of sync)."""
+        return [segment_id for segment_id in segment_ids if segment_id not in self._rows]
+
+    def join(self, matches: Iterable[Tuple[str, float]],
+             remote_metadata: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+        """
+        Turn (segment ID, score) pairs into search results.
+        
+        IDs missing from the catalog take their topic from remote_metadata
+        (the vector store's own metadata, fetched for missing() IDs), and
+        get 'N/A' only when that has nothing either.
+        """
+        remote_metadata = remote_metadata or {}
+        results = []
+        for segment_id, score in matches:
+            row = self._rows.get(segment_id)
+            if row is None:
+                self.misses += 1
+                metadata = remote_metadata.get(segment_id) or {}
+                results.append({'topic': metadata.get('topic', 'N/A'), 'topic_id': metadata.get('topic_ID', 'N/A'),
+                                'score': float(score), 'segment_id': segment_id, 'description': ''})
+                continue
+            result = self.segments.result(row, score)
+            result['description'] = self.descriptions[row]
+            results.append(result)
+        return results
+
+    def annotate(self, results: List[Dict]) -> List[Dict]:
+        """Add descriptions to results that already carry topic metadata (local engines, BM25)."""
+        for result in results:
+            row = self._rows.get(result['segment_id'])
+            result['description'] = self.descriptions[row] if row is not None else ''
+        return results
+
+    def stats(self) -> Dict:
+        return {
+            "segments": len(self),
+            "descriptions_mb": round(len(self.descriptions.data) / (1024 * 1024), 2),
+            "misses": self.misses,
+        }
+
+
+def load_metadata_store(segments: Optional[SegmentIndex],
+                        descriptions: Optional[Dict[str, str]] = None) -> Optional[SegmentMetadataStore]:
+    """Build the store from a catalog; None when there is no local catalog (queries keep include_metadata)."""
+    if segments is None:
+        return None
+    if descriptions is None:
+        descriptions = load_descriptions()
+    return SegmentMetadataStore.build(segments, descriptions)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Pre-converted, memory-mapped model bundles for SPARK AI.
+
+Loading BGE-large through SentenceTransformer deserializes the whole
+checkpoint on every cold start and gives each worker a private copy of the
+weights. A one-time conversion writes a local bundle instead:
+
+    <bundle>/bundle.json        manifest (model name, dimension, pooling, format)
+    <bundle>/model.safetensors  encoder weights
+    <bundle>/config.json        model config
+    <bundle>/tokenizer*         tokenizer files
+
+At load time the weights are memory-mapped straight from the safetensors
+file and adopted by the model without copying, so start-up takes well
+under a second and every worker shares the same weight pages through the
+OS page cache. Everything is read from local files (``local_files_only``);
+the Hugging Face hub is never contacted.
+
+Convert once with ``python model_bundle.py``; ``load_encoder`` picks the
+bundle up automatically when it exists under ``MODEL_BUNDLE_DIR``.
+"""
+
+import os
+import json
+import time
+import argparse
+import logging
+from typing import List, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMAT_VERSION = 1
+MODEL_BUNDLE_DIR = os.getenv("MODEL_BUNDLE_DIR", os.path.join("models", "bundles"))
+MANIFEST_FILE = "bundle.json"
+WEIGHTS_FILE = "model.safetensors"
+MAX_SEQ_LENGTH = 512
+POOLING_MODES = ("cls", "mean")
+
+
+def bundle_directory(model_name: str) -> str:
+    """Default bundle location for a model."""
+    return os.path.join(MODEL_BUNDLE_DIR, model_name.replace("/", "__"))
+
+
+def bundle_exists(bundle_dir: str) -> bool:
+    return (os.path.exists(os.path.join(bundle_dir, MANIFEST_FILE))
+            and os.path.exists(os.path.join(bundle_dir, WEIGHTS_FILE)))
+
+
+class BundleEncoder:
+    """Encoder over a memory-mapped bundle with the same encode() interface as SentenceTransformer."""
+
+    def __init__(self, bundle_dir: str):
+        try:
+            import torch
+            from safetensors.torch import load_file
+            from transformers import AutoConfig, AutoModel, AutoTokenizer
+            from transformers.modeling_utils import no_init_weights
+        except ImportError as e:
+            raise ImportError("Loading a model bundle needs 'torch', 'transformers' and 'safetensors' installed") from e
+
+        with open(os.path.join(bundle_dir, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported model bundle format {self.manifest.get('format')} in {bundle_dir}")
+
+        self._torch = torch
+        self.model_name = self.manifest["model_name"]
+        self.dim = self.manifest["dim"]
+        self.max_seq_length = self.manifest.get("max_seq_length", MAX_SEQ_LENGTH)
+        self.pooling = self.manifest.get("pooling", "cls")
+        if self.pooling not in POOLING_MODES:
+            raise ValueError(f"Unsupported pooling '{self.pooling}' in model bundle {bundle_dir}")
+
+        config = AutoConfig.from_pretrained(bundle_dir, local_files_only=True)
+        # Build the module skeleton without initializing weights we are about to replace
+        with no_init_weights():
+            model = AutoModel.from_config(config)
+
+        # safetensors maps the file; assign=True adopts those tensors instead of copying them
+        state_dict = load_file(os.path.join(bundle_dir, WEIGHTS_FILE), device="cpu")
+        missing, unexpected = model.load_state_dict(state_dict, strict=False, assign=True)
+        missing = [name for name in missing if not name.endswith(("position_ids", "token_type_ids"))]
+        if missing:
+            raise ValueError(f"Model bundle {bundle_dir} is missing weights: {', '.join(missing[:5])}")
+
+        model.eval()
+        self.model = model
+        self.tokenizer = AutoTokenizer.from_pretrained(bundle_dir, local_files_only=True)
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        """Encode one text (returns 1D) or a list of texts (returns 2D)."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        chunks = []
+        with self._torch.inference_mode():
+            for start in range(0, len(texts), batch_size):
+                tokens = self.tokenizer(
+                    texts[start:start + batch_size],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_seq_length,
+                    return_tensors="pt",
+                )
+                output = self.model(**tokens)
+                chunks.append(self._pool(output.last_hidden_state, tokens["attention_mask"]).float().numpy())
+
+        embeddings = np.vstack(chunks) if chunks else np.zeros((0, self.dim), dtype=np.float32)
+        if normalize_embeddings and len(embeddings):
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            embeddings = embeddings / norms
+        return embeddings[0] if single else embeddings
+
+    def _pool(self, hidden_states, attention_mask):
+        if self.pooling == "cls":
+            # BGE uses the [CLS] token as the sentence embedding
+            return hidden_states[:, 0, :]
+        # Mean over real tokens, ignoring padding
+        mask = attention_mask.unsqueeze(-1).to(hidden_states.dtype)
+        return (hidden_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+
+
+def convert_to_bundle(model_name: str, bundle_dir: Optional[str] = None, pooling: str = "cls") -> str:
+    """One-time conversion of a Hugging Face model into a local memory-mappable bundle."""
+    if pooling not in POOLING_MODES:
+        raise ValueError(f"Unsupported pooling '{pooling}', expected one of {', '.join(POOLING_MODES)}")
+    try:
+        from safetensors.torch import save_file
+        from transformers import AutoModel, AutoTokenizer
+    except ImportError as e:
+        raise ImportError("Converting a model bundle needs 'transformers' and 'safetensors' installed") from e
+
+    bundle_dir = bundle_dir or bundle_directory(model_name)
+    os.makedirs(bundle_dir, exist_ok=True)
+    start_time = time.time()
+
+    logger.info(f"🔄 Converting {model_name} into a model bundle at {bundle_dir}...")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+
+    weights = {name: tensor.detach().contiguous() for name, tensor in model.state_dict().items()}
+    save_file(weights, os.path.join(bundle_dir, WEIGHTS_FILE), metadata={"format": "pt"})
+    model.config.save_pretrained(bundle_dir)
+    tokenizer.save_pretrained(bundle_dir)
+
+    # Manifest goes last, so a half-written bundle is never picked up
+    manifest = {
+        "format": BUNDLE_FORMAT_VERSION,
+        "model_name": model_name,
+        "dim": model.config.hidden_size,
+        "pooling": pooling,
+        "max_seq_length": MAX_SEQ_LENGTH,
+        "created_at": time.time(),
+    }
+    with open(os.path.join(bundle_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    logger.info(f"✅ Model bundle written in {time.time() - start_time:.2f} seconds")
+    return bundle_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert an embedding model into a local memory-mapped bundle")
+    parser.add_argument("--model", default="BAAI/bge-large-en-v1.5")
+    parser.add_argument("--output", default=None, help="Bundle directory (default: MODEL_BUNDLE_DIR/<model>)")
+    parser.add_argument("--pooling", default="cls", choices=POOLING_MODES, help="Sentence pooling (BGE uses cls)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    bundle_dir = convert_to_bundle(args.model, args.output, args.pooling)
+
+    start_time = time.time()
+    encoder = BundleEncoder(bundle_dir)
+    load_time = time.time() - start_time
+    vector = encoder.encode("learn digital marketing")
+    print(f"\n✅ Bundle ready: {bundle_dir}")
+    print(f"   Load time: {load_time:.3f}s")
+    print(f"   Dimensions: {vector.shape[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Incremental upsert/delete on top of the local segment index.
+
+The base ``SegmentIndex`` stays an immutable, memory-mapped matrix. Changes
+go to a small delta instead:
+
+    delta/ops.jsonl      append-only log: upserts (with metadata) and deletes
+    delta/vectors.f32    append-only float32 rows referenced by the upserts
+
+An upsert tombstones the segment's previous row (base or delta) and
+appends the new row to the delta. A delete only tombstones. Queries score
+the base and the delta and skip tombstoned rows, so a change is visible on
+the next search.
+
+Other uvicorn workers notice the log growing at most ``DELTA_REFRESH_SECONDS``
+later and replay the new entries. Writers are serialized across processes
+with ``flock``.
+
+Once the delta passes ``DELTA_COMPACT_ROWS`` rows, or tombstones pass
+``DELTA_COMPACT_DEAD_FRACTION`` of the base, a background thread folds
+everything into a new base and empties the log. Queries keep reading an
+immutable snapshot of the current state and never wait for compaction.
+Base files are replaced by rename, so workers still mapping the old files
+are not disturbed.
+
+With a ``state_dir`` (index_snapshots passes one per version), the delta
+and every compacted base are written there, and ``directory`` is only
+read. A published snapshot's files therefore never change.
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from segment_index import (
+    SegmentIndex,
+    StringArena,
+    SEGMENT_INDEX_DIR,
+    MANIFEST_FILE,
+    METADATA_FIELDS,
+    category_key,
+    replace_file,
+)
+
+logger = logging.getLogger(__name__)
+
+DELTA_DIR_NAME = "delta"
+OPS_FILE = "ops.jsonl"
+DELTA_VECTORS_FILE = "vectors.f32"
+LOCK_FILE = ".lock"
+
+COMPACT_ROWS = int(os.getenv("DELTA_COMPACT_ROWS", "1000"))
+COMPACT_DEAD_FRACTION = float(os.getenv("DELTA_COMPACT_DEAD_FRACTION", "0.05"))
+REFRESH_SECONDS = float(os.getenv("DELTA_REFRESH_SECONDS", "0.5"))
+COMPACT_CHUNK_ROWS = 4096
+COMPACT_PAUSE_SECONDS = 0.002
+
+# Delta metadata keys, in METADATA_FIELDS order
+DELTA_KEYS = ("segment_id", "topic", "topic_id", "category", "sub_category")
+
+
+class _View:
+    """Immutable snapshot read by queries; every write publishes a new one."""
+
+    def __init__(self, base: SegmentIndex, base_dead: np.ndarray, delta_vectors: np.ndarray,
+                 delta_count: int, delta_dead: np.ndarray, delta_meta: List[Dict]):
+        self.base = base
+        self.base_dead = base_dead
+        self.delta_vectors = delta_vectors
+        self.delta_count = delta_count
+        self.delta_dead = delta_dead
+        self.delta_meta = delta_meta
+
+
+class MutableSegmentIndex:
+    """Exact search over a memory-mapped base plus an append-only delta with tombstones."""
+
+    def __init__(self, directory: str = SEGMENT_INDEX_DIR, compact_rows: int = COMPACT_ROWS,
+                 compact_dead_fraction: float = COMPACT_DEAD_FRACTION, auto_compact: bool = True,
+                 state_dir: Optional[str] = None):
+        self.directory = directory
+        # Delta and compacted bases; the base in directory is never rewritten when this differs
+        self.state_dir = state_dir or directory
+        self.delta_dir = os.path.join(self.state_dir, DELTA_DIR_NAME)
+        self.compact_rows = compact_rows
+        self.compact_dead_fraction = compact_dead_fraction
+        self.auto_compact = auto_compact
+        os.makedirs(self.delta_dir, exist_ok=True)
+
+        self._write_lock = threading.Lock()
+        self._compaction: Optional[threading.Thread] = None
+        self._last_refresh = 0.0
+        self.compactions = 0
+        self._reload()
+
+    # -- state ---------------------------------------------------------------
+
+    def _base_dir(self) -> str:
+        """The latest compacted base in state_dir, else the original base."""
+        if self.state_dir != self.directory and os.path.exists(os.path.join(self.state_dir, MANIFEST_FILE)):
+            return self.state_dir
+        return self.directory
+
+    def _base_manifest_inode(self) -> int:
+        return os.stat(os.path.join(self._base_dir(), MANIFEST_FILE)).st_ino
+
+    def _reload(self):
+        """(Re)load the base and replay the whole delta log."""
+        base = SegmentIndex.load(self._base_dir(), mmap=True)
+        self._base_inode = self._base_manifest_inode()
+        self._base_rows: Dict[str, List[int]] = {}
+        for row, segment_id in enumerate(base.ids):
+            self._base_rows.setdefault(segment_id, []).append(row)
+        self._delta_rows: Dict[str, int] = {}
+        self._ops_inode = None
+        self._ops_offset = 0
+        self._view = _View(base, np.zeros(len(base), dtype=bool), np.zeros((16, base.dim), dtype=np.float32),
+                           0, np.zeros(16, dtype=bool), [])
+        self._replay()
+
+    def _replay(self):
+        """Apply log entries written since the last replay (by this or another process)."""
+        ops_path = os.path.join(self.delta_dir, OPS_FILE)
+        try:
+            stat = os.stat(ops_path)
+        except FileNotFoundError:
+            return
+        if self._ops_inode is not None and (stat.st_ino != self._ops_inode or stat.st_size < self._ops_offset):
+            # The log was compacted away underneath us
+            self._reload()
+            return
+        self._ops_inode = stat.st_ino
+        if stat.st_size == self._ops_offset:
+            return
+
+        with open(ops_path, "rb") as f:
+            f.seek(self._ops_offset)
+            data = f.read()
+        # Only whole lines; a writer may be mid-append
+        complete = data[:data.rfind(b"\n") + 1]
+        if not complete:
+            return
+        vectors = None
+        for line in complete.decode("utf-8").splitlines():
+            op = json.loads(line)
+            if op["op"] == "upsert":
+                if vectors is None:
+                    vectors = np.memmap(os.path.join(self.delta_dir, DELTA_VECTORS_FILE), dtype=np.float32, mode="r")
+                    vectors = vectors.reshape(-1, self._view.base.dim)
+                self._apply_upsert(op, np.array(vectors[op["vector_row"]]))
+            else:
+                self._apply_delete(op["segment_id"])
+        self._ops_offset += len(complete)
+
+    def _refresh(self):
+        """Pick up compactions and log entries from other workers, at most every REFRESH_SECONDS."""
+        now = time.monotonic()
+        if now - self._last_refresh < REFRESH_SECONDS:
+            return
+        self._last_refresh = now
+        # Never make a search wait behind a write or a compaction; try again next time
+        if not self._write_lock.acquire(blocking=False):
+            return
+        try:
+            base_inode = self._base_manifest_inode()
+            if base_inode != self._base_inode:
+                self._reload()
+            else:
+                self._replay()
+        except (OSError, ValueError) as e:
+            # Another worker may be mid-compaction; the next refresh will see a complete index
+            logger.warning(f"⚠️  Segment index refresh skipped: {e}")
+        finally:
+            self._write_lock.release()
+
+    def _tombstone(self, view: _View, segment_id: str):
+        """Copy-on-write tombstone of the segment's live row; returns the new (base_dead, delta_dead)."""
+        base_dead, delta_dead = view.base_dead, view.delta_dead
+        row = self._delta_rows.pop(segment_id, None)
+        if row is not None:
+            delta_dead = delta_dead.copy()
+            delta_dead[row] = True
+        rows = [row for row in self._base_rows.get(segment_id, ()) if not base_dead[row]]
+        if rows:
+            base_dead = base_dead.copy()
+            base_dead[rows] = True
+        return base_dead, delta_dead
+
+    def _apply_upsert(self, op: Dict, vector: np.ndarray):
+        view = self._view
+        base_dead, delta_dead = self._tombstone(view, op["segment_id"])
+        delta_vectors, count = view.delta_vectors, view.delta_count
+        if count == len(delta_vectors):
+            # Grow by doubling; published views keep their own (smaller) arrays
+            delta_vectors = np.concatenate([delta_vectors, np.zeros_like(delta_vectors)])
+            delta_dead = np.concatenate([delta_dead, np.zeros(len(delta_dead), dtype=bool)])
+        elif delta_dead is view.delta_dead:
+            delta_dead = delta_dead.copy()
+        # Rows past the published count are invisible to readers, so writing in place is safe
+        delta_vectors[count] = vector
+        delta_dead[count] = False
+        meta = view.delta_meta
+        meta.append({key: op.get(key, "") for key in DELTA_KEYS})
+        self._delta_rows[op["segment_id"]] = count
+        self._view = _View(view.base, base_dead, delta_vectors, count + 1, delta_dead, meta)
+
+    def _apply_delete(self, segment_id: str):
+        view = self._view
+        base_dead, delta_dead = self._tombstone(view, segment_id)
+        self._view = _View(view.base, base_dead, view.delta_vectors, view.delta_count, delta_dead, view.delta_meta)
+
+    @contextmanager
+    def _file_lock(self):
+        with open(os.path.join(self.delta_dir, LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _append(self, op: Dict, vector: Optional[np.ndarray] = None):
+        """Durably append one op (and its vector) to the log, then apply it locally."""
+        with self._write_lock, self._file_lock():
+            base_inode = self._base_manifest_inode()
+            if base_inode != self._base_inode:
+                self._reload()
+            else:
+                self._replay()
+            if vector is not None:
+                with open(os.path.join(self.delta_dir, DELTA_VECTORS_FILE), "ab") as f:
+                    op["vector_row"] = f.tell() // (self._view.base.dim * 4)
+                    f.write(vector.tobytes())
+            line = (json.dumps(op) + "\n").encode("utf-8")
+            with open(os.path.join(self.delta_dir, OPS_FILE), "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._ops_inode = os.stat(os.path.join(self.delta_dir, OPS_FILE)).st_ino
+            self._ops_offset += len(line)
+            if vector is not None:
+                self._apply_upsert(op, vector)
+            else:
+                self._apply_delete(op["segment_id"])
+        self._maybe_compact()
+
+    # -- public API ----------------------------------------------------------
+
+    def upsert(self, topic_id: str, topic: str, vector: np.ndarray, category: str = "",
+               sub_category: str = "", segment_id: Optional[str] = None):
+        """Insert or replace a segment (keyed by segment ID, which defaults to the topic ID)."""
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Expected a {self.dim}-dim segment vector, got {vector.shape[0]}")
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+        op = {
+            "op": "upsert",
+            "segment_id": str(segment_id or topic_id),
+            "topic": topic,
+            "topic_id": str(topic_id),
+            "category": category or "",
+            "sub_category": sub_category or "",
+        }
+        self._append(op, vector)
+
+    def delete(self, segment_id: str) -> bool:
+        """Remove a segment; returns False when it does not exist."""
+        segment_id = str(segment_id)
+        if not self.contains(segment_id):
+            return False
+        self._append({"op": "delete", "segment_id": segment_id})
+        return True
+
+    def contains(self, segment_id: str) -> bool:
+        if segment_id in self._delta_rows:
+            return True
+        base_dead = self._view.base_dead
+        return any(not base_dead[row] for row in self._base_rows.get(segment_id, ()))
+
+    @property
+    def dim(self) -> int:
+        return self._view.base.dim
+
+    @property
+    def segments(self) -> SegmentIndex:
+        """The current base index (lexical indexes and benchmarks build over it)."""
+        return self._view.base
+
+    def __len__(self) -> int:
+        view = self._view
+        return int(len(view.base) - view.base_dead.sum() + view.delta_count - view.delta_dead[:view.delta_count].sum())
+
+    # -- search --------------------------------------------------------------
+
+    def _delta_result(self, view: _View, row: int, score: float) -> Dict:
+        meta = view.delta_meta[row]
+        return {
+            'topic': meta['topic'],
+            'topic_id': meta['topic_id'],
+            'score': float(score),
+            'segment_id': meta['segment_id'],
+        }
+
+    def _delta_candidates(self, view: _View, vector: np.ndarray, top_k: int, category: Optional[str],
+                          sub_category: Optional[str]) -> List[Dict]:
+        if not view.delta_count:
+            return []
+        live = ~view.delta_dead[:view.delta_count]
+        if category or sub_category:
+            for row in np.flatnonzero(live):
+                meta = view.delta_meta[row]
+                if (category and category_key(meta['category']) != category_key(category)) or \
+                        (sub_category and category_key(meta['sub_category']) != category_key(sub_category)):
+                    live[row] = False
+        rows = np.flatnonzero(live)
+        if not len(rows):
+            return []
+        scores = view.delta_vectors[rows] @ vector
+        return [self._delta_result(view, rows[i], scores[i]) for i in view.base.top_k_rows(scores, top_k)]
+
+    def query(self, vector: np.ndarray, top_k: int = 5, category: Optional[str] = None,
+              sub_category: Optional[str] = None) -> List[Dict]:
+        """Exact top-k over base + delta, skipping tombstoned rows."""
+        self._refresh()
+        view = self._view
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != view.base.dim:
+            raise ValueError(f"Expected a {view.base.dim}-dim query vector, got {vector.shape[0]}")
+
+        rows = view.base.filter_rows(category, sub_category)
+        if rows is None:
+            scores = view.base.vectors @ vector
+            if view.base_dead.any():
+                scores[view.base_dead] = -np.inf
+            top = view.base.top_k_rows(scores, top_k)
+            base_results = [view.base.result(row, scores[row]) for row in top if np.isfinite(scores[row])]
+        else:
+            rows = rows[~view.base_dead[rows]]
+            scores = view.base.vectors[rows] @ vector
+            base_results = [view.base.result(rows[i], scores[i]) for i in view.base.top_k_rows(scores, top_k)]
+
+        results = base_results + self._delta_candidates(view, vector, top_k, category, sub_category)
+        results.sort(key=lambda result: -result['score'])
+        return results[:top_k]
+
+    def query_many(self, vectors: np.ndarray, top_k: int = 5, category: Optional[str] = None,
+                   sub_category: Optional[str] = None) -> List[List[Dict]]:
+        """Batched exact search; falls back to per-query merging only when there is a delta."""
+        self._refresh()
+        view = self._view
+        if not view.delta_count and not view.base_dead.any():
+            return view.base.query_many(vectors, top_k, category, sub_category)
+        return [self.query(vector, top_k, category, sub_category) for vector in np.atleast_2d(vectors)]
+
+    # -- compaction ----------------------------------------------------------
+
+    def needs_compaction(self) -> bool:
+        view = self._view
+        dead = int(view.base_dead.sum())
+        return view.delta_count >= self.compact_rows or dead > self.compact_dead_fraction * max(len(view.base), 1)
+
+    def _maybe_compact(self):
+        if not self.auto_compact or not self.needs_compaction():
+            return
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+        self._compaction = threading.Thread(target=self.compact, daemon=True, name="segment-compaction")
+        self._compaction.start()
+
+    def compact(self):
+        """Fold the delta and tombstones into a new base and empty the log."""
+        start_time = time.time()
+        # Writers wait for the swap; readers keep using the current view throughout
+        with self._write_lock, self._file_lock():
+            self._replay()
+            view = self._view
+            base = view.base
+            live_base = np.flatnonzero(~view.base_dead)
+            live_delta = np.flatnonzero(~view.delta_dead[:view.delta_count])
+            if not view.delta_count and len(live_base) == len(base):
+                return
+
+            vectors = np.empty((len(live_base) + len(live_delta), base.dim), dtype=np.float32)
+            fields = {field: [] for field in METADATA_FIELDS}
+            # Chunked, with a short pause between chunks, so searches keep getting CPU time
+            for start in range(0, len(live_base), COMPACT_CHUNK_ROWS):
+                rows = live_base[start:start + COMPACT_CHUNK_ROWS]
+                vectors[start:start + len(rows)] = base.vectors[rows]
+                for field, values in fields.items():
+                    arena = getattr(base, field)
+                    # Raw bytes straight from the mmap'd arena: no decode/encode round trip
+                    values.extend(arena.raw(row) if isinstance(arena, StringArena) else arena[row] for row in rows)
+                time.sleep(COMPACT_PAUSE_SECONDS)
+            vectors[len(live_base):] = view.delta_vectors[live_delta]
+            for field, key in zip(METADATA_FIELDS, DELTA_KEYS):
+                fields[field].extend(view.delta_meta[row][key] for row in live_delta)
+
+            SegmentIndex(vectors=vectors, **fields).save(self.state_dir)
+
+            # Fresh, empty log (by rename, so other workers notice the new inode)
+            for name in (DELTA_VECTORS_FILE, OPS_FILE):
+                replace_file(os.path.join(self.delta_dir, name), lambda f: None)
+            self._reload()
+            self.compactions += 1
+
+        logger.info(f"✅ Segment index compacted: {len(live_base)} base + {len(live_delta)} delta rows "
+                    f"in {time.time() - start_time:.2f} seconds")
+
+    def stats(self) -> Dict:
+        view = self._view
+        stats = view.base.stats()
+        stats.update({
+            "engine": "exact+delta",
+            "segments": len(self),
+            "delta_rows": view.delta_count,
+            "tombstones": int(view.base_dead.sum() + view.delta_dead[:view.delta_count].sum()),
+            "compactions": self.compactions,
+            "compacting": self._compaction is not None and self._compaction.is_alive(),
+        })
+        return stats
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Async pgvector access for the Supabase API server, on an asyncpg pool.
+
+``api_server_supabase`` used to call the blocking psycopg2 methods of
+``SupabaseVectorDB`` from its async handlers. ``AsyncSupabaseVectorDB``
+runs the same schema, search and count queries on asyncpg's native
+connection pool instead. A query waits on the event loop, not in a thread,
+so one worker can keep up to ``SUPABASE_POOL_MAX`` queries in flight, one
+per pooled connection.
+
+Pool sizing and checkout timeout come from the same ``SUPABASE_POOL_*``
+settings as the psycopg2 pool (pg_pool.py), and a checkout that times out
+raises the same ``PoolTimeout``. asyncpg replaces connections that broke
+and closes ones idle for longer than ``SUPABASE_POOL_MAX_LIFETIME``. Read
+queries retry once on a connection that dropped mid-checkout.
+
+Behind Supabase's transaction pooler (port 6543), set
+``SUPABASE_STATEMENT_CACHE_SIZE=0``; prepared statements do not survive
+PgBouncer transaction pooling.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import asyncpg
+import numpy as np
+
+from pg_pool import PoolTimeout, POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_TIMEOUT, MAX_LIFETIME_SECONDS
+from supabase_setup import (
+    CREATE_EXTENSION_SQL,
+    CREATE_TABLE_SQL,
+    CREATE_VECTOR_INDEX_SQL,
+    CREATE_CATEGORY_INDEX_SQL,
+    CATEGORY_SQL,
+    SUB_CATEGORY_SQL,
+)
+from segment_index import category_key
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_CACHE_SIZE = int(os.getenv("SUPABASE_STATEMENT_CACHE_SIZE", "100"))
+QUERY_TIMEOUT = float(os.getenv("SUPABASE_QUERY_TIMEOUT", "10"))
+
+
+def vector_literal(vector: np.ndarray) -> str:
+    """pgvector text input, e.g. '[0.1,0.2,...]'; cast with ::vector in SQL."""
+    return "[" + ",".join(f"{value:.8g}" for value in np.asarray(vector, dtype=np.float32).reshape(-1)) + "]"
+
+
+async def _init_connection(conn):
+    # JSONB metadata comes back as dicts, like psycopg2's RealDictCursor rows
+    await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+class AsyncSupabaseVectorDB:
+    """Schema setup, similarity search and counts on an asyncpg pool."""
+
+    def __init__(self, dsn: Optional[str] = None, min_size: int = POOL_MIN_SIZE,
+                 max_size: int = POOL_MAX_SIZE, timeout: float = POOL_TIMEOUT):
+        self.dsn = dsn or os.getenv('SUPABASE_DB_URL')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pool: Optional[asyncpg.Pool] = None
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.retries = 0
+        self._wait_total = 0.0
+        self.max_wait = 0.0
+
+    async def connect(self):
+        """Open the pool (min_size connections up front)."""
+        self.pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            max_inactive_connection_lifetime=MAX_LIFETIME_SECONDS,
+            statement_cache_size=STATEMENT_CACHE_SIZE,
+            command_timeout=QUERY_TIMEOUT,
+            init=_init_connection,
+        )
+        logger.info(f"✅ Connected to Supabase PostgreSQL (async pool: {self.min_size}-{self.max_size} connections)")
+
+    @asynccontextmanager
+    async def connection(self):
+        """Check out a pooled connection for the duration of the block."""
+        start_time = time.perf_counter()
+        self.waiting += 1
+        try:
+            conn = await self.pool.acquire(timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise PoolTimeout(f"No Postgres connection free after {self.timeout}s ({self.max_size} in use)")
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - start_time
+        self.checkouts += 1
+        self._wait_total += waited
+        self.max_wait = max(self.max_wait, waited)
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+    async def _read(self, method: str, query: str, *args):
+        """Run a read query, retrying once when the connection dropped under it."""
+        for attempt in range(2):
+            try:
+                async with self.connection() as conn:
+                    return await getattr(conn, method)(query, *args)
+            except (asyncpg.ConnectionDoesNotExistError, asyncpg.InterfaceError) as e:
+                if attempt:
+                    raise
+                self.retries += 1
+                logger.warning(f"⚠️  Postgres connection lost ({e}), retrying on a fresh one")
+
+    async def setup_schema(self):
+        """Enable pgvector and create the segments table and indexes (idempotent)."""
+        async with self.connection() as conn:
+            await conn.execute(CREATE_EXTENSION_SQL)
+            await conn.execute(CREATE_TABLE_SQL)
+            await conn.execute(CREATE_VECTOR_INDEX_SQL)
+            await conn.execute(CREATE_CATEGORY_INDEX_SQL)
+        logger.info("✅ pgvector schema ready")
+
+    async def search_by_embedding(self, query_embedding: np.ndarray, top_k: int = 5,
+                                  category: Optional[str] = None, sub_category: Optional[str] = None) -> List[Dict]:
+        """Nearest segments to a normalized query embedding, optionally within a category."""
+        conditions, params = [], [vector_literal(query_embedding), top_k]
+        if category:
+            params.append(category_key(category))
+            conditions.append(f"{CATEGORY_SQL} = ${len(params)}")
+        if sub_category:
+            params.append(category_key(sub_category))
+            conditions.append(f"{SUB_CATEGORY_SQL} = ${len(params)}")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        rows = await self._read("fetch", f"""
+            SELECT
+                segment_id,
+                topic,
+                topic_id,
+                description,
+                metadata,
+                1 - (embedding <=> $1::text::vector) AS similarity_score
+            FROM audience_segments
+            {where}
+            ORDER BY embedding <=> $1::text::vector
+            LIMIT $2;
+        """, *params)
+        return [{
+            'segment_id': row['segment_id'],
+            'topic': row['topic'],
+            'topic_id': row['topic_id'],
+            'description': row['description'],
+            'metadata': row['metadata'],
+            'score': float(row['similarity_score'])
+        } for row in rows]
+
+    async def get_segment_count(self) -> int:
+        return await self._read("fetchval", "SELECT COUNT(*) FROM audience_segments;")
+
+    async def ping(self) -> bool:
+        """Round trip on a pooled connection, for /health."""
+        try:
+            return await self._read("fetchval", "SELECT 1;") == 1
+        except Exception as e:
+            logger.error(f"❌ Postgres health check failed: {e}")
+            return False
+
+    def stats(self) -> Optional[Dict]:
+        if self.pool is None:
+            return None
+        size, idle = self.pool.get_size(), self.pool.get_idle_size()
+        return {
+            "driver": "asyncpg",
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "utilization": round((size - idle) / self.max_size, 3),
+            "waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "avg_wait_ms": round(1000 * self._wait_total / self.checkouts, 3) if self.checkouts else 0.0,
+            "max_wait_ms": round(1000 * self.max_wait, 3),
+            "timeouts": self.timeouts,
+            "retries": self.retries,
+        }
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            logger.info("✅ Database connection closed")
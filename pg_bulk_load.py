@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Bulk segment ingestion into Supabase pgvector.
+
+``SupabaseVectorDB.insert_segment`` costs one forward pass, one round trip
+and one commit per segment. This loader streams the segments CSV in chunks
+of ``BULK_LOAD_CHUNK_ROWS`` instead:
+
+1. Encode each chunk's "topic description" texts in batches of
+   ``BULK_ENCODE_BATCH_SIZE``, or reuse the CSV's embedding column with
+   ``--reuse-embeddings``.
+2. ``COPY ... FROM STDIN (FORMAT binary)`` the chunk into a temporary
+   staging table. Vectors go over the wire as pgvector's binary format
+   (int16 dim, int16 unused, dim big-endian float4), so the server does
+   not parse any float text.
+3. After the last chunk, merge staging into ``audience_segments`` with a
+   single ``INSERT ... SELECT ... ON CONFLICT (segment_id) DO UPDATE``,
+   and commit once.
+
+The next chunk is encoded while the previous one is copied. The client
+holds at most two chunks, so memory stays bounded for any CSV size; the
+staged rows live on the server. ``--rebuild-index`` drops the ivfflat
+index before the merge and rebuilds it afterwards. Use it for initial
+loads: maintaining the index row by row is slower, and ivfflat picks its
+lists from the rows present when it is built.
+
+Usage:
+    python pg_bulk_load.py segments.csv --rebuild-index
+"""
+
+import io
+import os
+import json
+import time
+import struct
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from embedding_scheduler import normalize_rows
+from lexical_index import load_descriptions
+from segment_index import SEGMENT_CSV_PATH, SEGMENT_CATEGORY_CSV, find_column, load_category_map, segment_id
+from supabase_setup import SupabaseVectorDB, CREATE_VECTOR_INDEX_SQL
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BULK_LOAD_CHUNK_ROWS = int(os.getenv("BULK_LOAD_CHUNK_ROWS", "5000"))  # CSV rows encoded and copied at a time
+BULK_ENCODE_BATCH_SIZE = int(os.getenv("BULK_ENCODE_BATCH_SIZE", "256"))  # Texts per forward pass
+STAGING_TABLE = "audience_segments_staging"
+VECTOR_INDEX_NAME = "audience_segments_embedding_idx"
+
+STAGING_COLUMNS = ("segment_id", "topic", "topic_id", "description", "embedding", "metadata")
+CREATE_STAGING_SQL = f"""
+    CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+        seq BIGSERIAL,
+        segment_id VARCHAR(255) NOT NULL,
+        topic VARCHAR(500) NOT NULL,
+        topic_id VARCHAR(255),
+        description TEXT,
+        embedding vector(1024),
+        metadata JSONB
+    ) ON COMMIT DROP;
+"""
+COPY_STAGING_SQL = f"COPY {STAGING_TABLE} ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT binary);"
+# DISTINCT ON keeps the last copy of a repeated segment ID; ON CONFLICT cannot touch a row twice
+MERGE_STAGING_SQL = f"""
+    INSERT INTO audience_segments (segment_id, topic, topic_id, description, embedding, metadata)
+    SELECT DISTINCT ON (segment_id) segment_id, topic, topic_id, description, embedding, metadata
+    FROM {STAGING_TABLE}
+    ORDER BY segment_id, seq DESC
+    ON CONFLICT (segment_id) DO UPDATE SET
+    topic = EXCLUDED.topic,
+    topic_id = EXCLUDED.topic_id,
+    description = EXCLUDED.description,
+    embedding = EXCLUDED.embedding,
+    metadata = EXCLUDED.metadata;
+"""
+
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)  # Signature, flags, no header extension
+_COPY_TRAILER = struct.pack(">h", -1)
+_NULL_FIELD = struct.pack(">i", -1)
+_JSONB_VERSION = b"\x01"
+
+
+def _text_field(value: Optional[str]) -> bytes:
+    if value is None:
+        return _NULL_FIELD
+    data = value.encode("utf-8")
+    return struct.pack(">i", len(data)) + data
+
+
+def copy_binary_payload(rows: List[Dict], vectors: np.ndarray) -> bytes:
+    """One COPY binary stream: rows in STAGING_COLUMNS order, vectors as pgvector binary."""
+    dim = vectors.shape[1]
+    big_endian = np.ascontiguousarray(vectors, dtype=">f4")
+    tuple_header = struct.pack(">h", len(STAGING_COLUMNS))
+    vector_header = struct.pack(">ihh", 4 + 4 * dim, dim, 0)  # Field length, then pgvector's dim + unused
+    parts = [_COPY_HEADER]
+    for row, vector in zip(rows, big_endian):
+        metadata = _JSONB_VERSION + json.dumps(row["metadata"]).encode("utf-8")
+        parts.extend((
+            tuple_header,
+            _text_field(row["segment_id"]),
+            _text_field(row["topic"]),
+            _text_field(row["topic_id"]),
+            _text_field(row["description"]),
+            vector_header,
+            vector.tobytes(),
+            struct.pack(">i", len(metadata)),
+            metadata,
+        ))
+    parts.append(_COPY_TRAILER)
+    return b"".join(parts)
+
+
+def _cell(values, i) -> Optional[str]:
+    if values is None or pd.isna(values[i]):
+        return None
+    return str(values[i])
+
+
+def iter_segment_chunks(csv_path: str, chunk_rows: int = BULK_LOAD_CHUNK_ROWS,
+                        descriptions: Optional[Dict[str, str]] = None,
+                        category_map: Optional[Dict[str, tuple]] = None,
+                        with_embeddings: bool = False) -> Iterator[List[Dict]]:
+    """Stream segment rows from the CSV, chunk_rows at a time, with the same IDs as the Pinecone upload."""
+    descriptions = descriptions or {}
+    category_map = category_map or {}
+    offset = 0
+    # dtype=str: a chunk with blank topic IDs would otherwise read them as floats ("123.0")
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_rows, dtype=str):
+        columns = {
+            name: chunk[column].to_numpy() if column is not None else None
+            for name, column in (
+                ("topic", find_column(chunk, "topic")),
+                ("topic_id", find_column(chunk, "topicid")),
+                ("description", find_column(chunk, "topicdescription", "description")),
+                ("category", find_column(chunk, "category", "catgeory")),
+                ("sub_category", find_column(chunk, "subcategory")),
+                ("embedding", find_column(chunk, "embedding") if with_embeddings else None),
+            )
+        }
+        if columns["topic"] is None:
+            raise ValueError(f"No topic column in {csv_path}")
+
+        rows = []
+        for i in range(len(chunk)):
+            topic = _cell(columns["topic"], i)
+            if topic is None:
+                continue
+            topic_id = _cell(columns["topic_id"], i)
+            category, sub_category = category_map.get(topic_id, ("", ""))
+            category = _cell(columns["category"], i) or category
+            sub_category = _cell(columns["sub_category"], i) or sub_category
+            metadata = {}
+            if category:
+                metadata["category"] = category
+            if sub_category:
+                metadata["sub_category"] = sub_category
+            row = {
+                "segment_id": segment_id(topic_id, offset + i),
+                "topic": topic,
+                "topic_id": topic_id,
+                "description": _cell(columns["description"], i) or descriptions.get(topic_id or ""),
+                "metadata": metadata,
+            }
+            if with_embeddings:
+                embedding = _cell(columns["embedding"], i)
+                if not embedding:
+                    logger.warning(f"⚠️  Skipping row {offset + i}: No embedding found")
+                    continue
+                row["embedding"] = json.loads(embedding.replace("'", '"'))
+            rows.append(row)
+        offset += len(chunk)
+        if rows:
+            yield rows
+
+
+def _embed_chunk(model, rows: List[Dict], batch_size: int) -> np.ndarray:
+    if "embedding" in rows[0]:
+        vectors = np.asarray([row.pop("embedding") for row in rows], dtype=np.float32)
+    else:
+        # Same text as insert_segment embeds
+        texts = [f"{row['topic']} {row['description'] or ''}" for row in rows]
+        vectors = model.encode(texts, batch_size=batch_size)
+    return normalize_rows(np.atleast_2d(vectors))
+
+
+def bulk_load_segments(db: SupabaseVectorDB, chunks: Iterator[List[Dict]],
+                       batch_size: int = BULK_ENCODE_BATCH_SIZE, rebuild_index: bool = False) -> Dict:
+    """
+    Encode, COPY and merge segment chunks into audience_segments in one transaction.
+
+    Returns row counts and timings, including rows_per_second over the whole load.
+    """
+    start_time = time.perf_counter()
+    timings = {"encode_seconds": 0.0, "copy_seconds": 0.0}
+    staged = 0
+
+    def copy_chunk(cur, payload: bytes):
+        started = time.perf_counter()
+        cur.copy_expert(COPY_STAGING_SQL, io.BytesIO(payload))
+        timings["copy_seconds"] += time.perf_counter() - started
+
+    with db.pool.connection() as conn, conn.cursor() as cur, ThreadPoolExecutor(max_workers=1) as copier:
+        # The merge over millions of rows can outlast Supabase's default statement timeout
+        cur.execute("SET LOCAL statement_timeout = 0;")
+        cur.execute(CREATE_STAGING_SQL)
+        pending = None
+        try:
+            for rows in chunks:
+                started = time.perf_counter()
+                vectors = _embed_chunk(db.model, rows, batch_size)
+                if vectors.shape[1] != db.embedding_dimension:
+                    raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match "
+                                     f"vector({db.embedding_dimension})")
+                payload = copy_binary_payload(rows, vectors)
+                timings["encode_seconds"] += time.perf_counter() - started
+
+                # Copy this chunk while the next one is encoded; one COPY at a time on the connection
+                if pending is not None:
+                    pending.result()
+                pending = copier.submit(copy_chunk, cur, payload)
+                staged += len(rows)
+                logger.info(f"📦 Staged {staged} segments "
+                            f"({staged / (time.perf_counter() - start_time):.0f} rows/s)")
+        finally:
+            if pending is not None:
+                pending.result()
+
+        merge_started = time.perf_counter()
+        if rebuild_index:
+            cur.execute(f"DROP INDEX IF EXISTS {VECTOR_INDEX_NAME};")
+        cur.execute(MERGE_STAGING_SQL)
+        merged = cur.rowcount
+        if rebuild_index:
+            logger.info("🔄 Rebuilding vector index...")
+            cur.execute(CREATE_VECTOR_INDEX_SQL)
+        conn.commit()
+        timings["merge_seconds"] = time.perf_counter() - merge_started
+
+    seconds = time.perf_counter() - start_time
+    return {
+        "staged": staged,
+        "merged": merged,
+        "seconds": seconds,
+        "rows_per_second": staged / seconds if seconds > 0 else 0.0,
+        **{name: round(value, 3) for name, value in timings.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load audience segments into Supabase pgvector")
+    parser.add_argument("csv_path", nargs="?", default=SEGMENT_CSV_PATH, help="Segments CSV (topic, topic_ID, ...)")
+    parser.add_argument("--chunk-rows", type=int, default=BULK_LOAD_CHUNK_ROWS, help="CSV rows per COPY")
+    parser.add_argument("--batch-size", type=int, default=BULK_ENCODE_BATCH_SIZE, help="Texts per encode batch")
+    parser.add_argument("--reuse-embeddings", action="store_true",
+                        help="Use the CSV's embedding column instead of encoding")
+    parser.add_argument("--rebuild-index", action="store_true",
+                        help="Drop the vector index before the merge and rebuild it after")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if not os.getenv('SUPABASE_DB_URL'):
+        print("❌ Missing SUPABASE_DB_URL environment variable")
+        return
+
+    db = SupabaseVectorDB()
+    if not db.connect():
+        return
+    try:
+        if not (db.setup_vector_extension() and db.create_audience_segments_table()):
+            return
+        if not args.reuse_embeddings and not db.load_embedding_model():
+            return
+
+        category_map = {}
+        if SEGMENT_CATEGORY_CSV and os.path.exists(SEGMENT_CATEGORY_CSV):
+            category_map = load_category_map(SEGMENT_CATEGORY_CSV)
+            print(f"📂 Loaded categories for {len(category_map)} topics")
+        descriptions = load_descriptions()
+
+        print(f"📤 Bulk loading segments from {args.csv_path} ({args.chunk_rows} rows per COPY)...")
+        chunks = iter_segment_chunks(args.csv_path, args.chunk_rows, descriptions, category_map,
+                                     with_embeddings=args.reuse_embeddings)
+        report = bulk_load_segments(db, chunks, args.batch_size, rebuild_index=args.rebuild_index)
+        if not args.rebuild_index:
+            db.create_vector_index()
+
+        print(f"✅ Loaded {report['staged']} segments ({report['merged']} rows merged) in "
+              f"{report['seconds']:.1f}s ({report['rows_per_second']:.0f} rows/s)")
+        print(f"   encode {report['encode_seconds']:.1f}s | copy {report['copy_seconds']:.1f}s | "
+              f"merge {report['merge_seconds']:.1f}s")
+        print(f"📊 Total segments in database: {db.get_segment_count()}")
+    except Exception as e:
+        # Nothing is committed before the merge, so a failed load leaves the table unchanged
+        print(f"❌ Bulk load failed: {str(e)}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Thread-safe psycopg2 connection pool for the Supabase (pgvector) backend.
+
+``SupabaseVectorDB`` used to share one connection between every request.
+Queries were serialized on it, and a dropped connection took the service
+down until restart. ``PgConnectionPool`` keeps between ``SUPABASE_POOL_MIN``
+and ``SUPABASE_POOL_MAX`` connections, and each ``connection()`` checkout
+gets one of them to itself.
+
+Checkout
+    Waits up to ``SUPABASE_POOL_TIMEOUT`` seconds for a free connection,
+    then raises ``PoolTimeout``; the API maps that to 503.
+
+Health check
+    A connection idle for more than ``SUPABASE_POOL_HEALTH_CHECK_SECONDS``
+    is pinged with ``SELECT 1`` before it is handed out. Closed, broken or
+    older-than-``SUPABASE_POOL_MAX_LIFETIME`` connections are replaced.
+
+Reconnect
+    A connection that raises ``OperationalError``/``InterfaceError`` inside
+    a checkout is discarded instead of being returned. New connections
+    retry with backoff, so a database restart heals on its own.
+
+``stats()`` reports size, utilization and checkout wait times. Size the
+pool so that workers x ``SUPABASE_POOL_MAX`` stays below Postgres
+``max_connections``.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+POOL_MIN_SIZE = int(os.getenv("SUPABASE_POOL_MIN", "2"))
+POOL_MAX_SIZE = int(os.getenv("SUPABASE_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("SUPABASE_POOL_TIMEOUT", "5"))  # Seconds a checkout may wait
+HEALTH_CHECK_SECONDS = float(os.getenv("SUPABASE_POOL_HEALTH_CHECK_SECONDS", "30"))  # Idle time before a ping
+MAX_LIFETIME_SECONDS = float(os.getenv("SUPABASE_POOL_MAX_LIFETIME", "1800"))
+CONNECT_RETRIES = int(os.getenv("SUPABASE_POOL_CONNECT_RETRIES", "3"))
+CONNECT_TIMEOUT = int(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+
+
+class PoolTimeout(Exception):
+    """No connection became free within the checkout timeout."""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class PgConnectionPool:
+    """Bounded pool of psycopg2 connections with health checks and automatic reconnects."""
+
+    def __init__(self, dsn: str, min_size: int = POOL_MIN_SIZE, max_size: int = POOL_MAX_SIZE,
+                 timeout: float = POOL_TIMEOUT):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min {min_size}, max {max_size}")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = deque()
+        self._size = 0  # Open connections, idle or checked out
+        self._cond = threading.Condition()
+        self._closed = False
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.discarded = 0
+        self._wait_total = 0.0
+        self.max_wait = 0.0
+        for _ in range(min_size):
+            self._idle.append(self._open())
+            self._size += 1
+        logger.info(f"✅ Postgres pool ready: {min_size}-{max_size} connections")
+
+    def _open(self) -> _PooledConnection:
+        """New connection, retried with backoff while the database is unreachable."""
+        for attempt in range(CONNECT_RETRIES + 1):
+            try:
+                return _PooledConnection(psycopg2.connect(self.dsn, connect_timeout=CONNECT_TIMEOUT))
+            except psycopg2.OperationalError as e:
+                if attempt == CONNECT_RETRIES:
+                    raise
+                delay = min(0.5 * 2 ** attempt, 5.0)
+                logger.warning(f"⚠️  Postgres connect failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _healthy(self, pooled: _PooledConnection) -> bool:
+        now = time.monotonic()
+        if pooled.conn.closed or now - pooled.created_at > MAX_LIFETIME_SECONDS:
+            return False
+        if now - pooled.last_used < HEALTH_CHECK_SECONDS:
+            return True
+        try:
+            with pooled.conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            pooled.conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, pooled: _PooledConnection):
+        try:
+            pooled.conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self.discarded += 1
+            self._cond.notify()
+
+    def _checkout(self) -> _PooledConnection:
+        start_time = time.monotonic()
+        deadline = start_time + self.timeout
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Connection pool is closed")
+                    if self._idle:
+                        pooled, create = self._idle.pop(), False
+                        break
+                    if self._size < self.max_size:
+                        # Reserve the slot, connect outside the lock
+                        self._size += 1
+                        pooled, create = None, True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"No Postgres connection free after {self.timeout}s "
+                                          f"({self.max_size} in use)")
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+        if create:
+            try:
+                pooled = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        elif not self._healthy(pooled):
+            # Stale or broken: replace it in the same slot
+            self.reconnects += 1
+            try:
+                pooled.conn.close()
+            except psycopg2.Error:
+                pass
+            try:
+                pooled = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self.discarded += 1
+                    self._cond.notify()
+                raise
+
+        waited = time.monotonic() - start_time
+        with self._cond:
+            self.checkouts += 1
+            self._wait_total += waited
+            self.max_wait = max(self.max_wait, waited)
+        return pooled
+
+    def _checkin(self, pooled: _PooledConnection):
+        conn = pooled.conn
+        if conn.closed:
+            self._discard(pooled)
+            return
+        try:
+            # Never hand out a connection in the middle of a transaction
+            if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            if self._closed:
+                conn.close()
+                self._size -= 1
+                return
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of the block."""
+        pooled = self._checkout()
+        try:
+            yield pooled.conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The server or network dropped it; the next checkout opens a fresh one
+            self._discard(pooled)
+            raise
+        except BaseException:
+            self._checkin(pooled)
+            raise
+        else:
+            self._checkin(pooled)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._idle.pop().conn.close()
+                self._size -= 1
+            self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            idle = len(self._idle)
+            in_use = self._size - idle
+            return {
+                "size": self._size,
+                "idle": idle,
+                "in_use": in_use,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "utilization": round(in_use / self.max_size, 3),
+                "waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "avg_wait_ms": round(1000 * self._wait_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(1000 * self.max_wait, 3),
+                "timeouts": self.timeouts,
+                "reconnects": self.reconnects,
+                "discarded": self.discarded,
+            }
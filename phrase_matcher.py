@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Aho-Corasick phrase matcher compiled from the full topic catalog.
+
+Every topic name in the segment catalog (plus generated and configured
+aliases) becomes a pattern in one Aho-Corasick automaton. A single linear
+pass over the query finds every catalog phrase it contains, and each match
+maps back to real segment rows, topic IDs and segment IDs.
+
+Text is normalized to lowercase alphanumeric words separated by single
+spaces, so the alphabet has 37 symbols. Patterns are padded with spaces so
+they only match whole words. The automaton is stored as a complete DFA (a
+states x 37 transition table with failure links already folded in), so
+matching costs one table lookup per character.
+
+The compiled automaton is cached under ``SEGMENT_INDEX_DIR`` as ``.npy``
+files and memory-mapped on load, so startup does not pay for compiling it
+and uvicorn workers share the pages. It is rebuilt only when the phrase
+list changes.
+
+Aliases come from two places:
+- Generated: parenthetical parts are dropped and "&" is read as "and".
+- Configured: ``SEGMENT_ALIASES_FILE``, a JSON object that maps an alias
+  phrase to a topic ID or a list of topic IDs.
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from segment_index import SegmentIndex, SEGMENT_INDEX_DIR, index_lock
+
+logger = logging.getLogger(__name__)
+
+ALIASES_FILE = os.getenv("SEGMENT_ALIASES_FILE", "")
+MATCHER_DIR_NAME = "phrases"
+MANIFEST_FILE = "manifest.json"
+ARRAY_FILES = ("delta", "out_offsets", "out_patterns", "pattern_lengths", "row_offsets", "pattern_rows")
+
+ALPHABET = " abcdefghijklmnopqrstuvwxyz0123456789"
+_SYMBOL = {ch: i for i, ch in enumerate(ALPHABET)}
+_WORD = re.compile(r"[a-z0-9]+")
+_PARENTHETICAL = re.compile(r"\([^)]*\)")
+
+
+def normalize_phrase(text: str) -> str:
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def topic_aliases(topic: str) -> List[str]:
+    """Normalized phrase variants for a topic name."""
+    variants = {normalize_phrase(topic)}
+    variants.add(normalize_phrase(_PARENTHETICAL.sub(" ", topic)))
+    variants.add(normalize_phrase(topic.replace("&", " and ")))
+    return sorted(variant for variant in variants if variant)
+
+
+def catalog_phrases(segments: SegmentIndex, aliases: Optional[Dict[str, List[str]]] = None) -> Dict[str, List[int]]:
+    """Phrase -> segment rows for every topic name and alias."""
+    phrases: Dict[str, List[int]] = {}
+    rows_by_topic_id: Dict[str, List[int]] = {}
+    for row in range(len(segments)):
+        rows_by_topic_id.setdefault(segments.topic_ids[row], []).append(row)
+        for phrase in topic_aliases(segments.topics[row]):
+            phrases.setdefault(phrase, []).append(row)
+    for alias, topic_ids in (aliases or {}).items():
+        phrase = normalize_phrase(alias)
+        if not phrase:
+            continue
+        for topic_id in ([topic_ids] if isinstance(topic_ids, str) else topic_ids):
+            phrases.setdefault(phrase, []).extend(rows_by_topic_id.get(str(topic_id), []))
+    return {phrase: sorted(set(rows)) for phrase, rows in phrases.items() if rows}
+
+
+def load_aliases(path: str = ALIASES_FILE) -> Dict[str, List[str]]:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class PhraseMatcher:
+    """Complete-DFA Aho-Corasick automaton over catalog phrases."""
+
+    def __init__(self, segments: SegmentIndex, arrays: Dict[str, np.ndarray]):
+        self.segments = segments
+        self.delta = arrays["delta"]
+        self.out_offsets = arrays["out_offsets"]
+        self.out_patterns = arrays["out_patterns"]
+        self.pattern_lengths = arrays["pattern_lengths"]
+        self.row_offsets = arrays["row_offsets"]
+        self.pattern_rows = arrays["pattern_rows"]
+
+    @classmethod
+    def compile(cls, segments: SegmentIndex, phrases: Dict[str, List[int]]) -> "PhraseMatcher":
+        start_time = time.time()
+        patterns = sorted(phrases)
+
+        # Trie over the space-padded patterns
+        children: List[Dict[int, int]] = [{}]
+        outputs: List[List[int]] = [[]]
+        for pattern_id, pattern in enumerate(patterns):
+            state = 0
+            for ch in f" {pattern} ":
+                symbol = _SYMBOL[ch]
+                nxt = children[state].get(symbol)
+                if nxt is None:
+                    nxt = len(children)
+                    children[state][symbol] = nxt
+                    children.append({})
+                    outputs.append([])
+                state = nxt
+            outputs[state].append(pattern_id)
+
+        # Breadth-first: fold failure links into a dense transition table
+        delta = np.zeros((len(children), len(ALPHABET)), dtype=np.int32)
+        fail = np.zeros(len(children), dtype=np.int32)
+        queue = deque()
+        for symbol, child in children[0].items():
+            delta[0, symbol] = child
+            queue.append(child)
+        while queue:
+            state = queue.popleft()
+            outputs[state].extend(outputs[fail[state]])
+            delta[state] = delta[fail[state]]
+            for symbol, child in children[state].items():
+                fail[child] = delta[fail[state], symbol]
+                delta[state, symbol] = child
+                queue.append(child)
+
+        out_offsets = np.zeros(len(children) + 1, dtype=np.int64)
+        out_offsets[1:] = np.cumsum([len(out) for out in outputs])
+        out_patterns = np.asarray([p for out in outputs for p in out], dtype=np.int32)
+        row_offsets = np.zeros(len(patterns) + 1, dtype=np.int64)
+        row_offsets[1:] = np.cumsum([len(phrases[pattern]) for pattern in patterns])
+        arrays = {
+            "delta": delta,
+            "out_offsets": out_offsets,
+            "out_patterns": out_patterns,
+            "pattern_lengths": np.asarray([len(pattern) for pattern in patterns], dtype=np.int32),
+            "row_offsets": row_offsets,
+            "pattern_rows": np.asarray([row for pattern in patterns for row in phrases[pattern]], dtype=np.int64),
+        }
+        logger.info(f"✅ Phrase automaton compiled: {len(patterns)} phrases, {len(children)} states "
+                    f"in {time.time() - start_time:.2f} seconds")
+        return cls(segments, arrays)
+
+    def save(self, directory: str, fingerprint: str):
+        # Written into a private temp directory and renamed over the old files under the index
+        # lock: other workers mmap the old arrays, so they must never be truncated in place
+        with index_lock(directory):
+            tmp_dir = tempfile.mkdtemp(prefix=".save-", dir=directory)
+            try:
+                for name in ARRAY_FILES:
+                    np.save(os.path.join(tmp_dir, f"{name}.npy"), getattr(self, name))
+                with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+                    json.dump({"fingerprint": fingerprint, "states": int(self.delta.shape[0])}, f)
+                # Manifest goes last, so a half-swapped automaton is never picked up
+                for name in [f"{name}.npy" for name in ARRAY_FILES] + [MANIFEST_FILE]:
+                    os.replace(os.path.join(tmp_dir, name), os.path.join(directory, name))
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @classmethod
+    def load_or_compile(cls, segments: SegmentIndex, aliases: Optional[Dict[str, List[str]]] = None,
+                        directory: str = os.path.join(SEGMENT_INDEX_DIR, MATCHER_DIR_NAME)) -> "PhraseMatcher":
+        """Reuse the cached automaton when the phrase list is unchanged, else compile and save it."""
+        phrases = catalog_phrases(segments, aliases)
+        digest = hashlib.sha1()
+        for phrase in sorted(phrases):
+            digest.update(f"{phrase}\t{','.join(map(str, phrases[phrase]))}\n".encode("utf-8"))
+        fingerprint = digest.hexdigest()
+
+        # Shared lock: a concurrent save cannot swap files between the manifest check and the loads
+        with index_lock(directory, exclusive=False):
+            try:
+                with open(os.path.join(directory, MANIFEST_FILE)) as f:
+                    cached = json.load(f).get("fingerprint") == fingerprint
+            except (FileNotFoundError, ValueError):
+                cached = False
+            if cached:
+                arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in ARRAY_FILES}
+        if cached:
+            logger.info(f"✅ Phrase automaton loaded from {directory}")
+            return cls(segments, arrays)
+
+        matcher = cls.compile(segments, phrases)
+        matcher.save(directory, fingerprint)
+        return matcher
+
+    def find(self, text: str) -> List[Tuple[int, int, int]]:
+        """All catalog phrases in text as (start, end, pattern_id) over the normalized text, one pass."""
+        padded = f" {normalize_phrase(text)} "
+        delta, out_offsets, out_patterns = self.delta, self.out_offsets, self.out_patterns
+        matches = []
+        state = 0
+        for position, ch in enumerate(padded):
+            state = int(delta[state, _SYMBOL[ch]])
+            for i in range(out_offsets[state], out_offsets[state + 1]):
+                pattern_id = int(out_patterns[i])
+                end = position  # Index of the closing space
+                matches.append((end - int(self.pattern_lengths[pattern_id]) - 1, end - 1, pattern_id))
+        return matches
+
+    def match_segments(self, text: str, top_k: int = 5) -> List[Dict]:
+        """Segments named in the query, longest phrase first; score is the share of the query it covers."""
+        normalized_length = max(len(normalize_phrase(text)), 1)
+        matches = sorted(self.find(text), key=lambda match: (-int(self.pattern_lengths[match[2]]), match[0]))
+        results, seen = [], set()
+        for _, _, pattern_id in matches:
+            score = min(int(self.pattern_lengths[pattern_id]) / normalized_length, 1.0)
+            for row in self.pattern_rows[self.row_offsets[pattern_id]:self.row_offsets[pattern_id + 1]]:
+                if row not in seen:
+                    seen.add(row)
+                    results.append(self.segments.result(row, score))
+                    if len(results) >= top_k:
+                        return results
+        return results
+
+    def stats(self) -> Dict:
+        return {
+            "engine": "aho_corasick",
+            "phrases": len(self.pattern_lengths),
+            "states": int(self.delta.shape[0]),
+            "memory_mb": round(self.delta.nbytes / (1024 * 1024), 2),
+        }
+
+
+def load_phrase_matcher(segments: Optional[SegmentIndex] = None) -> Optional[PhraseMatcher]:
+    """Load or compile the catalog phrase matcher; None when no local catalog is available."""
+    if segments is None:
+        try:
+            segments = SegmentIndex.load_or_build()
+        except FileNotFoundError as e:
+            logger.warning(f"⚠️  Phrase matching disabled, no segment catalog: {e}")
+            return None
+    return PhraseMatcher.load_or_compile(segments, load_aliases())
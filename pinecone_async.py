@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Async Pinecone query client with a pooled keep-alive HTTP connection.
+
+The Pinecone SDK's ``Index.query`` is blocking. Calling it from an
+``async def`` handler stalls the whole event loop. Running it in the thread
+pool instead ties every in-flight query to a worker thread.
+``AsyncPineconeIndex`` talks to the index's data-plane REST API through one
+shared ``httpx.AsyncClient``:
+
+- connections are pooled and kept alive, so TLS is negotiated once
+- pool limits come from ``PINECONE_MAX_CONNECTIONS`` and
+  ``PINECONE_MAX_KEEPALIVE``
+- every call has connect/read timeouts (``PINECONE_CONNECT_TIMEOUT``,
+  ``PINECONE_QUERY_TIMEOUT``), which can be overridden per call
+
+Concurrent searches overlap their network waits on the event loop. A
+timed-out call raises ``asyncio.TimeoutError``.
+
+The index host is resolved once with the SDK (``describe_index``), which is
+a control-plane call, at startup.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "audiencelab-embeddings-1024")
+PINECONE_API_VERSION = os.getenv("PINECONE_API_VERSION", "2025-04")
+MAX_CONNECTIONS = int(os.getenv("PINECONE_MAX_CONNECTIONS", "32"))
+MAX_KEEPALIVE = int(os.getenv("PINECONE_MAX_KEEPALIVE", "16"))
+KEEPALIVE_EXPIRY = float(os.getenv("PINECONE_KEEPALIVE_EXPIRY", "60"))  # Seconds an idle connection is kept
+CONNECT_TIMEOUT = float(os.getenv("PINECONE_CONNECT_TIMEOUT", "2"))
+QUERY_TIMEOUT = float(os.getenv("PINECONE_QUERY_TIMEOUT", "5"))
+
+
+class AsyncPineconeIndex:
+    """Minimal async client for one Pinecone index: query and describe_index_stats."""
+
+    def __init__(self, host: str, api_key: str, max_connections: int = MAX_CONNECTIONS,
+                 max_keepalive: int = MAX_KEEPALIVE, timeout: float = QUERY_TIMEOUT):
+        self.host = host if host.startswith("http") else f"https://{host}"
+        self.timeout = timeout
+        self._client = httpx.AsyncClient(
+            base_url=self.host,
+            headers={
+                "Api-Key": api_key,
+                "Content-Type": "application/json",
+                "X-Pinecone-API-Version": PINECONE_API_VERSION,
+            },
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                keepalive_expiry=KEEPALIVE_EXPIRY),
+            timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT),
+        )
+        self.requests = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.in_flight = 0
+        self._total_seconds = 0.0
+
+    @classmethod
+    def from_client(cls, client, api_key: str, index_name: str = PINECONE_INDEX_NAME,
+                    **params) -> "AsyncPineconeIndex":
+        """Resolve the data-plane host through an existing ``pinecone.Pinecone`` client."""
+        host = client.describe_index(index_name).host
+        logger.info(f"🔗 Async Pinecone client for {index_name} at {host}")
+        return cls(host, api_key, **params)
+
+    async def _post(self, path: str, payload: Dict, timeout: Optional[float]) -> Dict:
+        return await self._request("POST", path, timeout, json=payload)
+
+    async def _request(self, method: str, path: str, timeout: Optional[float], **kwargs) -> Dict:
+        self.requests += 1
+        self.in_flight += 1
+        start_time = time.perf_counter()
+        try:
+            response = await self._client.request(
+                method, path, **kwargs,
+                timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT) if timeout is not None else httpx.USE_CLIENT_DEFAULT
+            )
+            response.raise_for_status()
+            return response.json()
+        except httpx.TimeoutException as e:
+            self.timeouts += 1
+            raise asyncio.TimeoutError(f"Pinecone {path} timed out after {timeout or self.timeout}s") from e
+        except httpx.HTTPError:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._total_seconds += time.perf_counter() - start_time
+
+    async def query(self, vector: List[float], top_k: int = 5, include_metadata: bool = True,
+                    filter: Optional[Dict] = None, namespace: str = "",
+                    timeout: Optional[float] = None) -> List[Dict]:
+        """Nearest neighbours as dicts with 'id', 'score' and (optionally) 'metadata'."""
+        payload = {
+            "vector": vector.tolist() if hasattr(vector, "tolist") else list(vector),
+            "topK": top_k,
+            "includeMetadata": include_metadata,
+            "includeValues": False,
+            "namespace": namespace,
+        }
+        if filter:
+            payload["filter"] = filter
+        body = await self._post("/query", payload, timeout)
+        return body.get("matches", [])
+
+    async def fetch(self, ids: List[str], namespace: str = "", timeout: Optional[float] = None) -> Dict[str, Dict]:
+        """Vector ID -> metadata for the IDs that exist."""
+        params = [("ids", vector_id) for vector_id in ids] + [("namespace", namespace)]
+        body = await self._request("GET", "/vectors/fetch", timeout, params=params)
+        return {vector_id: vector.get("metadata") or {} for vector_id, vector in body.get("vectors", {}).items()}
+
+    async def describe_index_stats(self, timeout: Optional[float] = None) -> Dict:
+        return await self._post("/describe_index_stats", {}, timeout)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    def stats(self) -> Dict:
+        return {
+            "host": self.host,
+            "requests": self.requests,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "avg_latency_ms": round(1000 * self._total_seconds / self.requests, 2) if self.requests else 0.0,
+            "max_connections": MAX_CONNECTIONS,
+            "query_timeout": self.timeout,
+        }
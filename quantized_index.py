@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Int8 scalar-quantized local segment index with float rescoring.
+
+Every worker holding the float32 segment matrix multiplies memory. Here
+each dimension is quantized to int8 with a stored per-dimension scale and
+offset (``x ~= offset + scale * code``), cutting the in-RAM matrix about 4x.
+A query is scored against the codes first to pick a candidate set, and
+only those candidates are rescored exactly against the full-precision
+vectors, which stay on ``np.memmap`` and are paged in on demand.
+
+Select it with ``SEARCH_BACKEND=int8``. ``INT8_RESCORE_CANDIDATES`` sets the
+candidate set size. Run ``python quantized_index.py`` to report memory saved,
+QPS and recall@k against the float32 baseline.
+"""
+
+import os
+import time
+import argparse
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from segment_index import (
+    SegmentIndex,
+    SEGMENT_INDEX_DIR,
+    VECTORS_FILE,
+    QUERY_CHUNK_ROWS,
+    sample_queries,
+    measure_recall,
+    measure_qps,
+)
+
+logger = logging.getLogger(__name__)
+
+RESCORE_CANDIDATES = int(os.getenv("INT8_RESCORE_CANDIDATES", "100"))
+# Rows converted to float per scoring step; small enough for the buffer to stay in CPU cache
+SCORE_CHUNK_ROWS = 256
+QUANTIZE_CHUNK_ROWS = 16384
+
+CODES_FILE = "int8_codes.npy"
+PARAMS_FILE = "int8_params.npz"
+
+
+class Int8SegmentIndex:
+    """Quantized first-pass scoring plus exact rescoring of the best candidates."""
+
+    def __init__(self, segments: SegmentIndex, codes: np.ndarray, scale: np.ndarray, offset: np.ndarray,
+                 rescore_candidates: int = RESCORE_CANDIDATES):
+        self.segments = segments
+        self.codes = np.ascontiguousarray(codes, dtype=np.int8)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.offset = np.asarray(offset, dtype=np.float32)
+        self.rescore_candidates = rescore_candidates
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    @classmethod
+    def quantize(cls, segments: SegmentIndex, **params) -> "Int8SegmentIndex":
+        """Per-dimension min/max scalar quantization to the int8 range."""
+        start_time = time.time()
+        vectors = segments.vectors
+        low = np.asarray(vectors.min(axis=0), dtype=np.float32) if len(vectors) else np.zeros(segments.dim, np.float32)
+        high = np.asarray(vectors.max(axis=0), dtype=np.float32) if len(vectors) else np.ones(segments.dim, np.float32)
+        scale = (high - low) / 255.0
+        scale[scale == 0] = 1.0
+        # Code -128 maps to the per-dimension minimum
+        offset = low + 128.0 * scale
+
+        codes = np.empty(vectors.shape, dtype=np.int8)
+        for start in range(0, len(vectors), QUANTIZE_CHUNK_ROWS):
+            chunk = np.asarray(vectors[start:start + QUANTIZE_CHUNK_ROWS])
+            codes[start:start + len(chunk)] = np.clip(np.rint((chunk - offset) / scale), -128, 127)
+
+        logger.info(f"✅ Quantized {len(vectors)} segments to int8 in {time.time() - start_time:.2f} seconds")
+        return cls(segments, codes, scale, offset, **params)
+
+    def save(self, directory: str = SEGMENT_INDEX_DIR):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, CODES_FILE), self.codes)
+        np.savez(os.path.join(directory, PARAMS_FILE), scale=self.scale, offset=self.offset)
+
+    @classmethod
+    def load_or_build(cls, segments: SegmentIndex, directory: str = SEGMENT_INDEX_DIR,
+                      **params) -> "Int8SegmentIndex":
+        """Reuse saved codes when they are newer than the cached vectors, else quantize and save."""
+        codes_path = os.path.join(directory, CODES_FILE)
+        params_path = os.path.join(directory, PARAMS_FILE)
+        vectors_path = os.path.join(directory, VECTORS_FILE)
+        if os.path.exists(codes_path) and os.path.exists(params_path) and (
+                not os.path.exists(vectors_path) or os.path.getmtime(codes_path) >= os.path.getmtime(vectors_path)):
+            codes = np.load(codes_path, mmap_mode="r")
+            if codes.shape == (len(segments), segments.dim):
+                stored = np.load(params_path)
+                logger.info(f"✅ Int8 codes loaded from {codes_path}")
+                return cls(segments, codes, stored["scale"], stored["offset"], **params)
+            logger.warning("⚠️  Int8 codes do not match the segment index, re-quantizing")
+        index = cls.quantize(segments, **params)
+        index.save(directory)
+        return index
+
+    def approximate_scores(self, vectors: np.ndarray) -> np.ndarray:
+        """Dot products against the dequantized vectors, computed from the int8 codes.
+
+        Takes one query (returns 1D) or a (queries x dim) matrix (returns segments x queries).
+        """
+        scaled_queries = vectors * self.scale
+        bias = vectors @ self.offset
+        scores = np.empty((len(self.codes),) + vectors.shape[:-1], dtype=np.float32)
+        buffer = np.empty((SCORE_CHUNK_ROWS, self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.codes), SCORE_CHUNK_ROWS):
+            chunk = self.codes[start:start + SCORE_CHUNK_ROWS]
+            block = buffer[:len(chunk)]
+            np.copyto(block, chunk, casting="unsafe")
+            scores[start:start + len(chunk)] = block @ scaled_queries.T
+        scores += bias
+        return scores
+
+    def _rescore(self, vector: np.ndarray, approximate: np.ndarray, top_k: int) -> List[Dict]:
+        candidates = self.segments.top_k_rows(approximate, max(self.rescore_candidates, top_k))
+        # Sorted row order makes the mmap reads sequential
+        candidates = np.sort(candidates)
+        exact = np.asarray(self.segments.vectors[candidates]) @ vector
+        order = self.segments.top_k_rows(exact, top_k)
+        return [self.segments.result(candidates[i], exact[i]) for i in order]
+
+    def query(self, vector: np.ndarray, top_k: int = 5, category: Optional[str] = None,
+              sub_category: Optional[str] = None) -> List[Dict]:
+        """Top-k: int8 first pass, then exact float rescoring of the candidates."""
+        if category or sub_category:
+            # Scoring only the category's rows exactly is cheaper than the full int8 pass
+            return self.segments.query(vector, top_k, category, sub_category)
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.segments.dim:
+            raise ValueError(f"Expected a {self.segments.dim}-dim query vector, got {vector.shape[0]}")
+        return self._rescore(vector, self.approximate_scores(vector), top_k)
+
+    def query_many(self, vectors: np.ndarray, top_k: int = 5, category: Optional[str] = None,
+                   sub_category: Optional[str] = None) -> List[List[Dict]]:
+        """Top-k for many queries; each int8 chunk is converted once and scored against all of them."""
+        if category or sub_category:
+            return self.segments.query_many(vectors, top_k, category, sub_category)
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if vectors.shape[1] != self.segments.dim:
+            raise ValueError(f"Expected {self.segments.dim}-dim query vectors, got {vectors.shape[1]}")
+        results = []
+        for start in range(0, len(vectors), QUERY_CHUNK_ROWS):
+            batch = vectors[start:start + QUERY_CHUNK_ROWS]
+            approximate = self.approximate_scores(batch)
+            results.extend(self._rescore(batch[i], approximate[:, i], top_k) for i in range(len(batch)))
+        return results
+
+    def stats(self) -> Dict:
+        float_mb = len(self.segments) * self.segments.dim * 4 / (1024 * 1024)
+        int8_mb = (self.codes.nbytes + self.scale.nbytes + self.offset.nbytes) / (1024 * 1024)
+        return {
+            "engine": "int8",
+            "segments": len(self.segments),
+            "dimension": self.segments.dim,
+            "memory_mb": round(int8_mb, 2),
+            "float32_memory_mb": round(float_mb, 2),
+            "memory_saved_mb": round(float_mb - int8_mb, 2),
+            "rescore_candidates": self.rescore_candidates,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the int8 index against the float32 baseline")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[20, 50, 100, 200])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    exact = SegmentIndex.load_or_build(mmap=False)
+    index = Int8SegmentIndex.load_or_build(SegmentIndex.load_or_build())
+    queries = sample_queries(exact, args.queries)
+    stats = index.stats()
+
+    print(f"\n📊 Int8 vs float32 ({len(exact)} segments, {len(queries)} queries, k={args.k})")
+    print("=" * 60)
+    print(f"   Memory: {stats['float32_memory_mb']:.1f}MB float32 -> {stats['memory_mb']:.1f}MB int8 "
+          f"({stats['memory_saved_mb']:.1f}MB saved)")
+    print(f"   float32 exact        QPS {measure_qps(exact, queries, args.k):8.1f}   recall 1.000")
+    for candidates in args.candidates:
+        index.rescore_candidates = candidates
+        qps = measure_qps(index, queries, args.k)
+        recall = measure_recall(index, exact, queries, args.k)
+        print(f"   int8 rescore={candidates:<6}  QPS {qps:8.1f}   recall {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
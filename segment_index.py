@@ -0,0 +1,516 @@
+"""
+In-process exact segment index for SPARK AI.
+
+The whole catalog is ~25k segments x 1024 dims (~100MB of float32), small
+enough to search exactly in memory. ``SegmentIndex`` keeps all segment
+vectors in one contiguous, L2-normalized float32 matrix next to their
+``topic``/``topic_ID`` metadata and answers top-k queries with a single BLAS
+matrix-vector product plus ``argpartition`` -- no network round trip and no
+per-query cost.
+
+The index is built from ``Spark_Matching_Segments_with_embeddings.csv`` (the
+same file ``upload_embeddings.py`` pushes to Pinecone, with the same vector
+IDs) and cached on disk so later starts skip CSV parsing:
+
+    manifest.json     format version, dimension, segment count
+    vectors.npy       float32 (count x dim) matrix
+    metadata.bin      UTF-8 arena: id, topic, topic_ID, category, sub_category
+    metadata_idx.npy  int64 (fields x count+1) offsets into the arena
+
+The matrix and the metadata arena are opened with ``np.memmap``, so when
+uvicorn runs several workers they all read the same pages through the OS
+page cache and N workers cost roughly one copy of RAM.
+
+Searches can be restricted to a category and/or sub-category. Row-id arrays
+per category are built once, and a filtered query only scores the rows that
+match, so it costs less than an unfiltered one. Categories come from the
+segments CSV when it has them. Otherwise they are joined by topic ID from
+``SEGMENT_CATEGORY_CSV`` (the descriptions CSV).
+"""
+
+import os
+import mmap
+import json
+import time
+import fcntl
+import shutil
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_CSV_PATH = os.getenv("SEGMENT_CSV_PATH", "Spark_Matching_Segments_with_embeddings.csv")
+SEGMENT_CATEGORY_CSV = os.getenv("SEGMENT_CATEGORY_CSV", "")
+SEGMENT_INDEX_DIR = os.getenv("SEGMENT_INDEX_DIR", "segment_index")
+EMBEDDING_DIM = 1024
+
+INDEX_FORMAT_VERSION = 3
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+ARENA_FILE = "metadata.bin"
+ARENA_INDEX_FILE = "metadata_idx.npy"
+INDEX_LOCK_FILE = ".index.lock"
+METADATA_FIELDS = ("ids", "topics", "topic_ids", "categories", "sub_categories")
+# Queries scored per matmul in query_many(); 256 x 25k segments is a ~25MB score matrix
+QUERY_CHUNK_ROWS = int(os.getenv("SEGMENT_QUERY_CHUNK_ROWS", "256"))
+
+
+class StringArena:
+    """Read-only sequence of strings stored back to back in one (memory-mapped) byte buffer."""
+
+    def __init__(self, data, offsets: np.ndarray):
+        # data is an mmap.mmap (or bytes); slicing it yields bytes without numpy overhead
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        return self.raw(i).decode("utf-8")
+
+    def raw(self, i: int) -> bytes:
+        """The UTF-8 bytes of one entry, without decoding."""
+        return self.data[int(self.offsets[i]):int(self.offsets[i + 1])]
+
+    def __iter__(self):
+        data, bounds = self.data, self.offsets.tolist()
+        for start, end in zip(bounds, bounds[1:]):
+            yield data[start:end].decode("utf-8")
+
+
+def category_key(value: Optional[str]) -> str:
+    """Category/sub-category as every backend compares it: trimmed and case-insensitive."""
+    return (value or "").strip().lower()
+
+
+def segment_id(topic_id: Optional[str], row: int) -> str:
+    """Vector ID shared by every loader: the topic ID, or segment_<row> for rows without one."""
+    if topic_id is None or topic_id != topic_id or topic_id == "":  # None, NaN or blank
+        return f"segment_{row}"
+    return str(topic_id)
+
+
+def find_column(df, *names: str) -> Optional[str]:
+    """Column whose letters-only lowercase name matches one of names (CSV headers vary)."""
+    wanted = set(names)
+    for column in df.columns:
+        if "".join(ch for ch in str(column).lower() if ch.isalnum()) in wanted:
+            return column
+    return None
+
+
+def load_category_map(csv_path: str) -> Dict[str, tuple]:
+    """topic ID -> (category, sub_category) from the descriptions CSV."""
+    import pandas as pd
+
+    # dtype=str: one blank topic ID would otherwise turn every key into a float ("101.0")
+    df = pd.read_csv(csv_path, dtype=str)
+    topic_col = find_column(df, "topicid")
+    category_col = find_column(df, "category", "catgeory")
+    sub_category_col = find_column(df, "subcategory")
+    if topic_col is None or category_col is None:
+        logger.warning(f"⚠️  No topic ID / category columns in {csv_path}, categories disabled")
+        return {}
+    categories = {}
+    for _, row in df.iterrows():
+        if pd.isna(row[topic_col]):
+            continue
+        category = str(row[category_col]) if pd.notna(row[category_col]) else ""
+        sub_category = str(row[sub_category_col]) if sub_category_col and pd.notna(row[sub_category_col]) else ""
+        categories[str(row[topic_col])] = (category, sub_category)
+    return categories
+
+
+@contextmanager
+def index_lock(directory: str, exclusive: bool = True):
+    """flock on the index directory: exclusive while files are swapped in, shared while they are opened."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, INDEX_LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def replace_file(path: str, write, mode: str = "wb"):
+    """Write via a temp file and rename, so processes that mmap'd the old file keep a consistent copy."""
+    # Unique temp name: concurrent writers never share (or steal) each other's temp file
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_arena(directory: str, fields: List[List]):
+    """Write string fields (str or already-encoded bytes) into one UTF-8 arena plus an offsets table."""
+    offsets = np.zeros((len(fields), len(fields[0]) + 1 if fields else 1), dtype=np.int64)
+    chunks = []
+    position = 0
+    for field, values in enumerate(fields):
+        encoded = [value if isinstance(value, bytes) else str(value).encode("utf-8") for value in values]
+        offsets[field, 0] = position
+        offsets[field, 1:] = position + np.cumsum([len(value) for value in encoded], dtype=np.int64)
+        position = int(offsets[field, -1])
+        chunks.append(b"".join(encoded))
+
+    replace_file(os.path.join(directory, ARENA_FILE), lambda f: f.write(b"".join(chunks)))
+    replace_file(os.path.join(directory, ARENA_INDEX_FILE), lambda f: np.save(f, offsets))
+
+
+def _open_arena(directory: str) -> List[StringArena]:
+    """Memory-map the metadata arena and return one StringArena per field."""
+    # Plain ndarray view over the mapping: scalar indexing stays cheap
+    offsets = np.asarray(np.load(os.path.join(directory, ARENA_INDEX_FILE), mmap_mode="r"))
+    arena_path = os.path.join(directory, ARENA_FILE)
+    if os.path.getsize(arena_path):
+        with open(arena_path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        data = b""
+    return [StringArena(data, offsets[field]) for field in range(offsets.shape[0])]
+
+
+class SegmentIndex:
+    """Exact cosine-similarity search over a normalized float32 matrix."""
+
+    def __init__(self, ids: Sequence[str], topics: Sequence[str], topic_ids: Sequence[str], vectors: np.ndarray,
+                 categories: Optional[Sequence[str]] = None, sub_categories: Optional[Sequence[str]] = None):
+        categories = categories if categories is not None else [""] * len(ids)
+        sub_categories = sub_categories if sub_categories is not None else [""] * len(ids)
+        if not (len(ids) == len(topics) == len(topic_ids) == len(categories) == len(sub_categories) == len(vectors)):
+            raise ValueError("Segment ids, metadata and vectors must have the same length")
+        # Memory-mapped arenas are kept as-is so they stay shared between workers
+        self.ids = ids if isinstance(ids, StringArena) else list(ids)
+        self.topics = topics if isinstance(topics, StringArena) else list(topics)
+        self.topic_ids = topic_ids if isinstance(topic_ids, StringArena) else list(topic_ids)
+        self.categories = categories if isinstance(categories, StringArena) else list(categories)
+        self.sub_categories = sub_categories if isinstance(sub_categories, StringArena) else list(sub_categories)
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.dim = self.vectors.shape[1] if self.vectors.ndim == 2 else EMBEDDING_DIM
+        self._category_rows: Optional[Dict[str, Dict[str, np.ndarray]]] = None
+        self._category_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    @classmethod
+    def from_csv(cls, csv_path: str = SEGMENT_CSV_PATH, category_csv: str = SEGMENT_CATEGORY_CSV) -> "SegmentIndex":
+        """Build the index from the segments CSV with its JSON-encoded embedding column."""
+        import pandas as pd
+
+        start_time = time.time()
+        logger.info(f"📖 Building segment index from {csv_path}...")
+        # Topic IDs stay strings, as in load_category_map, so the category join matches
+        df = pd.read_csv(csv_path, dtype=str)
+        category_col = find_column(df, "category", "catgeory")
+        sub_category_col = find_column(df, "subcategory")
+        category_map = load_category_map(category_csv) if category_csv and os.path.exists(category_csv) else {}
+
+        ids, topics, topic_ids, categories, sub_categories, vectors = [], [], [], [], [], []
+        for idx, row in df.iterrows():
+            embedding_str = row.get('embedding', '')
+            if not isinstance(embedding_str, str) or not embedding_str:
+                continue
+            try:
+                embedding = json.loads(embedding_str.replace("'", '"'))
+            except ValueError:
+                logger.warning(f"⚠️  Skipping row {idx}: Could not parse embedding")
+                continue
+
+            # Same vector IDs as upload_embeddings.py and pg_bulk_load.py
+            topic_id = str(row['topic_ID']) if 'topic_ID' in row and pd.notna(row['topic_ID']) else 'N/A'
+            ids.append(segment_id(row.get('topic_ID'), idx))
+            topics.append(str(row['topic']) if 'topic' in row and pd.notna(row['topic']) else 'N/A')
+            topic_ids.append(topic_id)
+            category, sub_category = category_map.get(topic_id, ("", ""))
+            if category_col is not None and pd.notna(row[category_col]):
+                category = str(row[category_col])
+            if sub_category_col is not None and pd.notna(row[sub_category_col]):
+                sub_category = str(row[sub_category_col])
+            categories.append(category)
+            sub_categories.append(sub_category)
+            vectors.append(embedding)
+
+        matrix = cls._normalize(np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1))
+        logger.info(f"✅ Segment index built: {len(ids)} segments in {time.time() - start_time:.2f} seconds")
+        return cls(ids, topics, topic_ids, matrix, categories, sub_categories)
+
+    def save(self, directory: str = SEGMENT_INDEX_DIR):
+        """Write vectors, metadata arena and manifest for fast, shareable reloads."""
+        with index_lock(directory):
+            self._save_locked(directory)
+
+    def _save_locked(self, directory: str):
+        # Written into a private temp directory, then renamed over the old files. Workers that
+        # mmap'd the old files keep their inodes, so nothing they map is ever truncated.
+        tmp_dir = tempfile.mkdtemp(prefix=".save-", dir=directory)
+        try:
+            replace_file(os.path.join(tmp_dir, VECTORS_FILE), lambda f: np.save(f, self.vectors))
+            _write_arena(tmp_dir, [list(getattr(self, field)) for field in METADATA_FIELDS])
+            manifest = {
+                "version": INDEX_FORMAT_VERSION,
+                "dim": self.dim,
+                "count": len(self),
+                "fields": list(METADATA_FIELDS),
+            }
+            replace_file(os.path.join(tmp_dir, MANIFEST_FILE), lambda f: json.dump(manifest, f), mode="w")
+            # Manifest goes last, so a half-swapped index is never picked up
+            for name in (VECTORS_FILE, ARENA_FILE, ARENA_INDEX_FILE, MANIFEST_FILE):
+                os.replace(os.path.join(tmp_dir, name), os.path.join(directory, name))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def read_manifest(directory: str = SEGMENT_INDEX_DIR) -> Optional[Dict]:
+        try:
+            with open(os.path.join(directory, MANIFEST_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def load(cls, directory: str = SEGMENT_INDEX_DIR, mmap: bool = True,
+             expected_dim: Optional[int] = None) -> "SegmentIndex":
+        """Load an index written with save(); vectors and metadata stay on mmap unless mmap=False."""
+        if cls.read_manifest(directory) is None:
+            raise FileNotFoundError(f"No segment index manifest in {directory}")
+        # Shared lock: a concurrent save cannot pair new vectors with the old arena mid-open
+        with index_lock(directory, exclusive=False):
+            return cls._load_locked(directory, mmap, expected_dim)
+
+    @classmethod
+    def _load_locked(cls, directory: str, mmap: bool, expected_dim: Optional[int]) -> "SegmentIndex":
+        manifest = cls.read_manifest(directory)
+        if manifest is None:
+            raise FileNotFoundError(f"No segment index manifest in {directory}")
+        if manifest.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Segment index in {directory} has format {manifest.get('version')}, "
+                             f"expected {INDEX_FORMAT_VERSION}")
+        if expected_dim is not None and manifest.get("dim") != expected_dim:
+            raise ValueError(f"Segment index in {directory} has {manifest.get('dim')} dims, "
+                             f"the encoder produces {expected_dim}")
+
+        vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r" if mmap else None)
+        if vectors.shape != (manifest["count"], manifest["dim"]):
+            raise ValueError(f"Segment index in {directory} does not match its manifest")
+        fields = _open_arena(directory)
+        if not mmap:
+            fields = [list(field) for field in fields]
+        ids, topics, topic_ids, categories, sub_categories = fields
+        return cls(ids, topics, topic_ids, vectors, categories, sub_categories)
+
+    @classmethod
+    def load_or_build(cls, csv_path: str = SEGMENT_CSV_PATH, directory: str = SEGMENT_INDEX_DIR,
+                      mmap: bool = True) -> "SegmentIndex":
+        """Load the cached index, rebuilding it from the CSV when missing, stale or outdated."""
+        if not cls._cache_fresh(csv_path, directory):
+            # One worker rebuilds; the others wait on the lock and then find a fresh cache
+            with index_lock(directory):
+                if not cls._cache_fresh(csv_path, directory):
+                    cls.from_csv(csv_path)._save_locked(directory)
+
+        start_time = time.time()
+        index = cls.load(directory, mmap=mmap)
+        logger.info(f"✅ Segment index loaded from {directory}: {len(index)} segments "
+                    f"in {time.time() - start_time:.2f} seconds")
+        return index
+
+    @classmethod
+    def _cache_fresh(cls, csv_path: str, directory: str) -> bool:
+        manifest = cls.read_manifest(directory)
+        vectors_path = os.path.join(directory, VECTORS_FILE)
+        if manifest is None or manifest.get("version") != INDEX_FORMAT_VERSION or not os.path.exists(vectors_path):
+            return False
+        return not os.path.exists(csv_path) or os.path.getmtime(vectors_path) >= os.path.getmtime(csv_path)
+
+    def _build_category_rows(self) -> Dict[str, Dict[str, np.ndarray]]:
+        """Sorted row-id arrays per (lowercased) category and sub-category."""
+        start_time = time.time()
+        rows = {"category": {}, "sub_category": {}}
+        for field, values in (("category", self.categories), ("sub_category", self.sub_categories)):
+            buckets: Dict[str, List[int]] = {}
+            for row, value in enumerate(values):
+                buckets.setdefault(category_key(value), []).append(row)
+            rows[field] = {key: np.asarray(bucket, dtype=np.int64) for key, bucket in buckets.items() if key}
+        logger.info(f"✅ Category filters built: {len(rows['category'])} categories, "
+                    f"{len(rows['sub_category'])} sub-categories in {time.time() - start_time:.2f} seconds")
+        return rows
+
+    def _ensure_category_rows(self) -> Dict[str, Dict[str, np.ndarray]]:
+        if self._category_rows is None:
+            with self._category_lock:
+                if self._category_rows is None:
+                    self._category_rows = self._build_category_rows()
+        return self._category_rows
+
+    def filter_rows(self, category: Optional[str] = None, sub_category: Optional[str] = None) -> Optional[np.ndarray]:
+        """Sorted rows matching the filters, or None when no filter is given (all rows)."""
+        if not category and not sub_category:
+            return None
+        category_rows = self._ensure_category_rows()
+        empty = np.zeros(0, dtype=np.int64)
+        rows = None
+        if category:
+            rows = category_rows["category"].get(category_key(category), empty)
+        if sub_category:
+            sub_rows = category_rows["sub_category"].get(category_key(sub_category), empty)
+            rows = sub_rows if rows is None else np.intersect1d(rows, sub_rows, assume_unique=True)
+        return rows
+
+    def categories_summary(self) -> Dict[str, int]:
+        """Segment count per category, for discovering valid filter values."""
+        return {key: len(rows) for key, rows in self._ensure_category_rows()["category"].items()}
+
+    def top_k_rows(self, scores: np.ndarray, top_k: int) -> np.ndarray:
+        """Row ids of the top_k highest scores, best first."""
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        if top_k < len(scores):
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+    @staticmethod
+    def top_k_rows_many(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """Per-row top_k column ids of a (queries x segments) score matrix, best first."""
+        top_k = min(top_k, scores.shape[1])
+        if top_k <= 0:
+            return np.zeros((scores.shape[0], 0), dtype=np.int64)
+        if top_k < scores.shape[1]:
+            candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        else:
+            candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable")
+        return np.take_along_axis(candidates, order, axis=1)
+
+    def result(self, row: int, score: float) -> Dict:
+        """Format one row like the Pinecone-backed search results."""
+        return {
+            'topic': self.topics[row],
+            'topic_id': self.topic_ids[row],
+            'score': float(score),
+            'segment_id': self.ids[row]
+        }
+
+    def query(self, vector: np.ndarray, top_k: int = 5, category: Optional[str] = None,
+              sub_category: Optional[str] = None) -> List[Dict]:
+        """Exact top-k by cosine similarity for a normalized query vector, optionally within a category."""
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Expected a {self.dim}-dim query vector, got {vector.shape[0]}")
+        rows = self.filter_rows(category, sub_category)
+        if rows is None:
+            scores = self.vectors @ vector
+            return [self.result(row, scores[row]) for row in self.top_k_rows(scores, top_k)]
+        # Only the matching rows are scored, so narrower filters are cheaper
+        scores = self.vectors[rows] @ vector
+        return [self.result(rows[i], scores[i]) for i in self.top_k_rows(scores, top_k)]
+
+    def query_many(self, vectors: np.ndarray, top_k: int = 5, category: Optional[str] = None,
+                   sub_category: Optional[str] = None) -> List[List[Dict]]:
+        """Exact top-k for many normalized query vectors, one matmul per chunk of queries."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dim query vectors, got {vectors.shape[1]}")
+        rows = self.filter_rows(category, sub_category)
+        matrix = self.vectors if rows is None else self.vectors[rows]
+        results = []
+        # Chunking bounds the (queries x segments) score matrix for very large batches
+        for start in range(0, len(vectors), QUERY_CHUNK_ROWS):
+            scores = vectors[start:start + QUERY_CHUNK_ROWS] @ matrix.T
+            top = self.top_k_rows_many(scores, top_k)
+            row_ids = top if rows is None else rows[top]
+            results.extend([self.result(row, scores[i, col]) for row, col in zip(row_ids[i], top[i])]
+                           for i in range(len(top)))
+        return results
+
+    def stats(self) -> Dict:
+        return {
+            "engine": "exact",
+            "segments": len(self),
+            "dimension": self.dim,
+            "memory_mb": round(self.vectors.nbytes / (1024 * 1024), 2),
+        }
+
+
+def load_local_index(engine: str = "exact", directory: str = SEGMENT_INDEX_DIR, rebuild: bool = True,
+                     state_dir: Optional[str] = None):
+    """Load the local search engine for SEARCH_BACKEND: 'exact' (or 'local'), 'hnsw', 'int8' or 'binary'.
+
+    With rebuild=False the index in ``directory`` is loaded as-is and never
+    rebuilt from the CSV (used for immutable snapshots). Only the exact engine
+    supports incremental updates; the others are rebuilt from the base. Its
+    delta and compactions go to ``state_dir`` when one is given.
+    """
+    def load_segments() -> SegmentIndex:
+        if rebuild:
+            return SegmentIndex.load_or_build(directory=directory)
+        return SegmentIndex.load(directory)
+
+    if engine == "int8":
+        from quantized_index import Int8SegmentIndex
+        # Full-precision vectors stay on mmap; only rescoring candidates touch them
+        return Int8SegmentIndex.load_or_build(load_segments(), directory)
+    if engine == "binary":
+        from binary_index import BinarySegmentIndex
+        return BinarySegmentIndex.load_or_build(load_segments(), directory)
+    if engine == "hnsw":
+        from hnsw_index import HNSWSegmentIndex
+        return HNSWSegmentIndex.load_or_build(load_segments(), directory)
+    if engine not in ("exact", "local"):
+        raise ValueError(f"Unknown local search engine '{engine}'")
+    # Exact search takes incremental upserts/deletes (delta + tombstones over the mmap'd base)
+    from mutable_index import MutableSegmentIndex
+    load_segments()
+    return MutableSegmentIndex(directory, state_dir=state_dir)
+
+
+def sample_queries(segments: SegmentIndex, count: int = 200, noise: float = 0.05, seed: int = 42) -> np.ndarray:
+    """Perturbed catalog vectors, a stand-in for real query embeddings in benchmarks."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(segments), size=min(count, len(segments)), replace=False)
+    queries = np.asarray(segments.vectors[rows]) + noise * rng.standard_normal((len(rows), segments.dim)).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def measure_recall(engine, exact: SegmentIndex, queries: np.ndarray, k: int = 10) -> float:
+    """Fraction of the exact top-k that another engine also returns, averaged over queries."""
+    if not len(queries) or not len(exact):
+        return 0.0
+    hits = 0
+    for query in queries:
+        expected = {result['segment_id'] for result in exact.query(query, k)}
+        hits += len(expected.intersection(result['segment_id'] for result in engine.query(query, k)))
+    return hits / (len(queries) * min(k, len(exact)))
+
+
+def measure_qps(engine, queries: np.ndarray, k: int = 10) -> float:
+    """Single-threaded queries per second for an engine."""
+    start_time = time.perf_counter()
+    for query in queries:
+        engine.query(query, k)
+    elapsed = time.perf_counter() - start_time
+    return len(queries) / elapsed if elapsed > 0 else 0.0
@@ -0,0 +1,105 @@
+"""
+Background service loading and readiness tracking for SPARK AI.
+
+Loading BGE-large takes tens of seconds, so the API servers start loading in
+a background thread and accept traffic right away. Loading code reports its
+progress stage by stage; ``/ready`` exposes that progress, and ``/search``
+either serves the request from a tier that needs no encoder or answers with
+a fast 503 and ``Retry-After``.
+"""
+
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+RETRY_AFTER_SECONDS = int(os.getenv("READY_RETRY_AFTER_SECONDS", "5"))
+
+
+class ServiceReadiness:
+    """Tracks named loading stages and runs the loader in a background thread."""
+
+    def __init__(self, stages: List[str]):
+        self.stages = list(stages)
+        self._done = set()
+        self._current: Optional[str] = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Mark a loading stage as in progress, then done (or failed)."""
+        with self._lock:
+            self._current = name
+        stage_start = time.time()
+        try:
+            yield
+        except Exception as e:
+            with self._lock:
+                self.error = f"{name}: {e}"
+                self._current = None
+            raise
+        with self._lock:
+            self._done.add(name)
+            self._current = None
+        logger.info(f"✅ Stage '{name}' ready in {time.time() - stage_start:.2f} seconds")
+
+    def is_stage_done(self, name: str) -> bool:
+        with self._lock:
+            return name in self._done
+
+    def mark_ready(self):
+        with self._lock:
+            self.ready_at = time.time()
+            self._current = None
+        self._ready.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def start(self, loader: Callable[[], None]):
+        """Run the loader in a daemon thread; calling again while it runs is a no-op."""
+        if self._thread is not None and (self._thread.is_alive() or self.ready):
+            return
+
+        def run():
+            try:
+                loader()
+                self.mark_ready()
+            except Exception as e:
+                with self._lock:
+                    if self.error is None:
+                        self.error = str(e)
+                logger.error(f"❌ Background loading failed: {e}")
+
+        with self._lock:
+            self.error = None
+            self.started_at = time.time()
+        self._thread = threading.Thread(target=run, name="service-loader", daemon=True)
+        self._thread.start()
+
+    def status(self) -> Dict:
+        """Return readiness, progress and the stage currently loading."""
+        with self._lock:
+            done = [stage for stage in self.stages if stage in self._done]
+            now = self.ready_at or time.time()
+            return {
+                "ready": self.ready,
+                "progress": round(len(done) / len(self.stages), 2) if self.stages else 1.0,
+                "stages_done": done,
+                "current_stage": self._current,
+                "elapsed_seconds": round(now - self.started_at, 2) if self.started_at else 0.0,
+                "error": self.error,
+            }
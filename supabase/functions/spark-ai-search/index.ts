@@ -163,56 +163,75 @@ serve(async (req) => {
     const queryTime = totalTime - embeddingTime
 
     // Step 3: Process results
+    // One round trip fetches the descriptions of every exactly-named topic;
+    // only the misses fall back to per-topic fuzzy lookups below
+    const topics: string[] = pineconeData.matches.map((match: any) => match.metadata?.topic || 'Unknown')
+    const exactDescriptions = new Map<string, string>()
+    try {
+      const { data: exactRows } = await supabase
+        .from('audience_descriptions')
+        .select('topic, topic_description')
+        .in('topic', topics)
+      for (const row of exactRows || []) {
+        exactDescriptions.set(row.topic, row.topic_description)
+      }
+    } catch (e) {
+      console.log(`Batch description lookup failed: ${e.message}`)
+    }
+
     const results: SearchResult[] = await Promise.all(pineconeData.matches.map(async (match: any) => {
       const topic = match.metadata?.topic || 'Unknown';
       
       // Try to get description from Supabase database with improved matching
-      let description = 'No description available';
-      try {
-        // First try exact case-insensitive match
-        let { data: descData, error } = await supabase
-          .from('audience_descriptions')
-          .select('topic_description')
-          .ilike('topic', topic)
-          .limit(1)
-          .single();
-        
-        // If no exact match, try partial matching
-        if (error || !descData) {
-          const { data: partialData, error: partialError } = await supabase
+      let description = exactDescriptions.get(topic) || 'No description available';
+      // Only topics the batch lookup missed need the fuzzy fallbacks
+      if (!exactDescriptions.has(topic)) {
+        try {
+          // First try exact case-insensitive match
+          let { data: descData, error } = await supabase
             .from('audience_descriptions')
             .select('topic_description')
-            .ilike('topic', `%${topic}%`)
+            .ilike('topic', topic)
             .limit(1)
             .single();
           
-          if (!partialError && partialData) {
-            descData = partialData;
-          }
-        }
-        
-        // If still no match, try matching without special characters
-        if (!descData) {
-          const cleanTopic = topic.replace(/[^a-zA-Z0-9\s]/g, '').trim();
-          if (cleanTopic && cleanTopic !== topic) {
-            const { data: cleanData, error: cleanError } = await supabase
+          // If no exact match, try partial matching
+          if (error || !descData) {
+            const { data: partialData, error: partialError } = await supabase
               .from('audience_descriptions')
               .select('topic_description')
-              .ilike('topic', `%${cleanTopic}%`)
+              .ilike('topic', `%${topic}%`)
               .limit(1)
               .single();
             
-            if (!cleanError && cleanData) {
-              descData = cleanData;
+            if (!partialError && partialData) {
+              descData = partialData;
             }
           }
+          
+          // If still no match, try matching without special characters
+          if (!descData) {
+            const cleanTopic = topic.replace(/[^a-zA-Z0-9\s]/g, '').trim();
+            if (cleanTopic && cleanTopic !== topic) {
+              const { data: cleanData, error: cleanError } = await supabase
+                .from('audience_descriptions')
+                .select('topic_description')
+                .ilike('topic', `%${cleanTopic}%`)
+                .limit(1)
+                .single();
+              
+              if (!cleanError && cleanData) {
+                descData = cleanData;
+              }
+            }
+          }
+          
+          if (descData) {
+            description = descData.topic_description;
+          }
+        } catch (e) {
+          console.log(`No description found for topic: ${topic}`);
         }
-        
-        if (descData) {
-          description = descData.topic_description;
-        }
-      } catch (e) {
-        console.log(`No description found for topic: ${topic}`);
       }
       
       return {
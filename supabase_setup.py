@@ -4,30 +4,69 @@ Supabase setup for SPARK AI - replacing Pinecone with pgvector
 """
 
 import os
-import psycopg2
 from psycopg2.extras import RealDictCursor
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 import logging
+from typing import Optional
+from embedding_scheduler import EmbeddingScheduler
+from embedding_cache import get_embedding_cache
+from encoder_backends import load_encoder, encoder_key
+from pg_pool import PgConnectionPool, PoolTimeout
+from segment_index import category_key
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = "BAAI/bge-large-en-v1.5"
+ENCODER_KEY = encoder_key(MODEL_NAME)  # Model + backend (ENCODER_BACKEND), used for cache keys
+
 # Load environment variables
 load_dotenv()
 
+# Schema statements, shared with the async driver (pg_async.py)
+CREATE_EXTENSION_SQL = "CREATE EXTENSION IF NOT EXISTS vector;"
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS audience_segments (
+        id SERIAL PRIMARY KEY,
+        segment_id VARCHAR(255) UNIQUE NOT NULL,
+        topic VARCHAR(500) NOT NULL,
+        topic_id VARCHAR(255),
+        description TEXT,
+        embedding vector(1024),
+        metadata JSONB,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+CREATE_VECTOR_INDEX_SQL = """
+    CREATE INDEX IF NOT EXISTS audience_segments_embedding_idx 
+    ON audience_segments 
+    USING ivfflat (embedding vector_cosine_ops)
+    WITH (lists = 100);
+"""
+# Category filters on /search compare these trimmed, lowercased metadata keys (segment_index.category_key)
+CATEGORY_SQL = "lower(btrim(metadata->>'category'))"
+SUB_CATEGORY_SQL = "lower(btrim(metadata->>'sub_category'))"
+CREATE_CATEGORY_INDEX_SQL = f"""
+    DROP INDEX IF EXISTS audience_segments_category_idx;
+    CREATE INDEX IF NOT EXISTS audience_segments_category_key_idx
+    ON audience_segments (({CATEGORY_SQL}), ({SUB_CATEGORY_SQL}));
+"""
+
 class SupabaseVectorDB:
     def __init__(self):
         self.connection_string = os.getenv('SUPABASE_DB_URL')
+        self.pool = None
         self.model = None
+        self.scheduler = None
         self.embedding_dimension = 1024  # BAAI/bge-large-en-v1.5 dimension
         
     def connect(self):
-        """Connect to Supabase PostgreSQL database."""
+        """Open the connection pool to the Supabase PostgreSQL database."""
         try:
-            self.conn = psycopg2.connect(self.connection_string)
+            # Each concurrent search checks out its own connection (see pg_pool.py)
+            self.pool = PgConnectionPool(self.connection_string)
             logger.info("✅ Connected to Supabase PostgreSQL")
             return True
         except Exception as e:
@@ -37,9 +76,9 @@ class SupabaseVectorDB:
     def setup_vector_extension(self):
         """Enable pgvector extension if not already enabled."""
         try:
-            with self.conn.cursor() as cur:
-                cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-                self.conn.commit()
+            with self.pool.connection() as conn, conn.cursor() as cur:
+                cur.execute(CREATE_EXTENSION_SQL)
+                conn.commit()
                 logger.info("✅ pgvector extension enabled")
                 return True
         except Exception as e:
@@ -49,20 +88,9 @@ class SupabaseVectorDB:
     def create_audience_segments_table(self):
         """Create the audience segments table with vector support."""
         try:
-            with self.conn.cursor() as cur:
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS audience_segments (
-                        id SERIAL PRIMARY KEY,
-                        segment_id VARCHAR(255) UNIQUE NOT NULL,
-                        topic VARCHAR(500) NOT NULL,
-                        topic_id VARCHAR(255),
-                        description TEXT,
-                        embedding vector(1024),
-                        metadata JSONB,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    );
-                """)
-                self.conn.commit()
+            with self.pool.connection() as conn, conn.cursor() as cur:
+                cur.execute(CREATE_TABLE_SQL)
+                conn.commit()
                 logger.info("✅ Audience segments table created")
                 return True
         except Exception as e:
@@ -72,14 +100,10 @@ class SupabaseVectorDB:
     def create_vector_index(self):
         """Create a vector index for similarity search."""
         try:
-            with self.conn.cursor() as cur:
-                cur.execute("""
-                    CREATE INDEX IF NOT EXISTS audience_segments_embedding_idx 
-                    ON audience_segments 
-                    USING ivfflat (embedding vector_cosine_ops)
-                    WITH (lists = 100);
-                """)
-                self.conn.commit()
+            with self.pool.connection() as conn, conn.cursor() as cur:
+                cur.execute(CREATE_VECTOR_INDEX_SQL)
+                cur.execute(CREATE_CATEGORY_INDEX_SQL)
+                conn.commit()
                 logger.info("✅ Vector index created")
                 return True
         except Exception as e:
@@ -90,7 +114,8 @@ class SupabaseVectorDB:
         """Load the BAAI/bge-large-en-v1.5 embedding model."""
         try:
             logger.info("🔄 Loading embedding model...")
-            self.model = SentenceTransformer("BAAI/bge-large-en-v1.5")
+            self.model = load_encoder(MODEL_NAME)
+            self.scheduler = EmbeddingScheduler(self.model)
             logger.info("✅ Embedding model loaded")
             return True
         except Exception as e:
@@ -99,14 +124,14 @@ class SupabaseVectorDB:
     
     def insert_segment(self, segment_id: str, topic: str, topic_id: str, 
                       description: str = None, metadata: dict = None):
-        """Insert an audience segment with its embedding."""
+        """Insert an audience segment with its embedding (bulk loads: pg_bulk_load.py)."""
         try:
             # Generate embedding
             text_to_embed = f"{topic} {description or ''}"
             embedding = self.model.encode(text_to_embed)
             embedding = embedding / np.linalg.norm(embedding)  # Normalize
             
-            with self.conn.cursor() as cur:
+            with self.pool.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
                     INSERT INTO audience_segments 
                     (segment_id, topic, topic_id, description, embedding, metadata)
@@ -118,55 +143,88 @@ class SupabaseVectorDB:
                     embedding = EXCLUDED.embedding,
                     metadata = EXCLUDED.metadata;
                 """, (segment_id, topic, topic_id, description, embedding.tolist(), metadata))
-                self.conn.commit()
+                conn.commit()
                 logger.info(f"✅ Inserted segment: {topic}")
                 return True
         except Exception as e:
             logger.error(f"❌ Failed to insert segment: {e}")
             return False
     
-    def search_similar_segments(self, query: str, top_k: int = 5):
+    def search_similar_segments(self, query: str, top_k: int = 5, category: Optional[str] = None,
+                                sub_category: Optional[str] = None):
         """Search for similar audience segments using vector similarity."""
         try:
-            # Generate query embedding
-            query_embedding = self.model.encode(query)
-            query_embedding = query_embedding / np.linalg.norm(query_embedding)
-            
-            with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT 
-                        segment_id,
-                        topic,
-                        topic_id,
-                        description,
-                        metadata,
-                        1 - (embedding <=> %s) as similarity_score
-                    FROM audience_segments
-                    ORDER BY embedding <=> %s
-                    LIMIT %s;
-                """, (query_embedding.tolist(), query_embedding.tolist(), top_k))
-                
-                results = []
-                for row in cur.fetchall():
-                    results.append({
-                        'segment_id': row['segment_id'],
-                        'topic': row['topic'],
-                        'topic_id': row['topic_id'],
-                        'description': row['description'],
-                        'metadata': row['metadata'],
-                        'score': float(row['similarity_score'])
-                    })
-                
-                logger.info(f"✅ Found {len(results)} similar segments")
-                return results
+            # Generate query embedding (cached, batched with concurrent searches, already normalized)
+            query_embedding = get_embedding_cache().get_or_compute(query, ENCODER_KEY, self.scheduler.encode)
+            return self.search_by_embedding(query_embedding, top_k, category, sub_category)
+        except PoolTimeout:
+            # Pool exhausted: let the API answer 503 instead of an empty result
+            raise
         except Exception as e:
             logger.error(f"❌ Search failed: {e}")
             return []
     
+    def search_cached(self, query: str, top_k: int = 5, category: Optional[str] = None,
+                      sub_category: Optional[str] = None):
+        """Search using only a cached query embedding; returns None when it is not cached."""
+        query_embedding = get_embedding_cache().get(query, ENCODER_KEY)
+        if query_embedding is None:
+            return None
+        try:
+            return self.search_by_embedding(query_embedding, top_k, category, sub_category)
+        except PoolTimeout:
+            # Pool exhausted: let the API answer 503 instead of an empty result
+            raise
+        except Exception as e:
+            logger.error(f"❌ Search failed: {e}")
+            return []
+    
+    def search_by_embedding(self, query_embedding: np.ndarray, top_k: int = 5, category: Optional[str] = None,
+                            sub_category: Optional[str] = None):
+        """Search for similar audience segments given a normalized query embedding."""
+        conditions, filter_params = [], []
+        if category:
+            conditions.append(f"{CATEGORY_SQL} = %s")
+            filter_params.append(category_key(category))
+        if sub_category:
+            conditions.append(f"{SUB_CATEGORY_SQL} = %s")
+            filter_params.append(category_key(sub_category))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        # A connection of its own, so concurrent searches run in parallel
+        with self.pool.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"""
+                SELECT 
+                    segment_id,
+                    topic,
+                    topic_id,
+                    description,
+                    metadata,
+                    1 - (embedding <=> %s) as similarity_score
+                FROM audience_segments
+                {where}
+                ORDER BY embedding <=> %s
+                LIMIT %s;
+            """, (query_embedding.tolist(), *filter_params, query_embedding.tolist(), top_k))
+            
+            results = []
+            for row in cur.fetchall():
+                results.append({
+                    'segment_id': row['segment_id'],
+                    'topic': row['topic'],
+                    'topic_id': row['topic_id'],
+                    'description': row['description'],
+                    'metadata': row['metadata'],
+                    'score': float(row['similarity_score'])
+                })
+            
+            logger.info(f"✅ Found {len(results)} similar segments")
+            return results
+    
     def get_segment_count(self):
         """Get the total number of audience segments."""
         try:
-            with self.conn.cursor() as cur:
+            with self.pool.connection() as conn, conn.cursor() as cur:
                 cur.execute("SELECT COUNT(*) FROM audience_segments;")
                 count = cur.fetchone()[0]
                 return count
@@ -174,10 +232,16 @@ class SupabaseVectorDB:
             logger.error(f"❌ Failed to get count: {e}")
             return 0
     
+    def pool_stats(self):
+        """Connection pool size, utilization and checkout wait times."""
+        return self.pool.stats() if self.pool else None
+    
     def close(self):
-        """Close the database connection."""
-        if hasattr(self, 'conn'):
-            self.conn.close()
+        """Close the database connections."""
+        if self.scheduler:
+            self.scheduler.stop()
+        if self.pool:
+            self.pool.close()
             logger.info("✅ Database connection closed")
 
 def setup_supabase():
@@ -1,11 +1,29 @@
 import os
+import time
+import json
+import random
+import bisect
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import pandas as pd
 import numpy as np
 import pinecone
 from dotenv import load_dotenv
 from google.cloud import storage
-import json
 from tqdm import tqdm
+from segment_index import SEGMENT_CATEGORY_CSV, find_column, load_category_map, segment_id
+from vector_backends import category_metadata
+
+# Concurrent upsert pipeline settings
+UPSERT_MAX_IN_FLIGHT = int(os.getenv("UPSERT_MAX_IN_FLIGHT", "8"))  # Batches being sent at once
+UPSERT_MAX_BATCH_VECTORS = 1000  # Pinecone's per-request vector limit
+UPSERT_MAX_REQUEST_BYTES = int(os.getenv("UPSERT_MAX_REQUEST_BYTES", str(2 * 1024 * 1024)))  # Pinecone's 2MB limit
+UPSERT_MAX_RETRIES = int(os.getenv("UPSERT_MAX_RETRIES", "6"))
+UPSERT_BACKOFF_BASE = float(os.getenv("UPSERT_BACKOFF_BASE", "0.5"))  # Seconds; doubles per attempt
+UPSERT_BACKOFF_CAP = float(os.getenv("UPSERT_BACKOFF_CAP", "30"))
+UPSERT_CSV_CHUNK_ROWS = int(os.getenv("UPSERT_CSV_CHUNK_ROWS", "5000"))  # CSV rows parsed at a time
+VALUE_BYTES = 20  # Upper bound for one JSON-encoded float, used to size batches
 
 def download_from_gcs(bucket_name, source_blob_name, destination_file_name):
     """Download a file from Google Cloud Storage."""
@@ -22,25 +40,243 @@ def download_from_gcs(bucket_name, source_blob_name, destination_file_name):
         print("💡 Make sure you're authenticated with: gcloud auth application-default login")
         raise
 
-def upload_to_pinecone(index, vectors_batch, batch_size=100):
-    """Upload vectors to Pinecone in batches."""
-    total_vectors = len(vectors_batch)
-    print(f"📤 Uploading {total_vectors} vectors to Pinecone...")
-    
-    successful_uploads = 0
-    for i in tqdm(range(0, total_vectors, batch_size), desc="Uploading batches"):
-        batch = vectors_batch[i:i + batch_size]
+def source_fingerprint(path):
+    """Cheap identity for a (possibly huge) CSV: size plus a hash of its first and last MB."""
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(1 << 20))
+        f.seek(max(size - (1 << 20), 0))
+        digest.update(f.read(1 << 20))
+    return digest.hexdigest()
+
+class UpsertCheckpoint:
+    """
+    Append-only log of CSV row ranges that are already in Pinecone.
+    
+    The first line identifies the source file and index. Each later line is
+    one contiguous run of upserted rows, {"rows": [start, end]}; a batch
+    around a skipped row logs one run on each side of it, so the skipped row
+    is retried. Batches finish out of order,
+    so resuming skips every logged range rather than a single offset.
+    Upserts are idempotent, so a lost tail only means re-sending a few batches.
+    """
+    
+    def __init__(self, path, source, index_name):
+        self.path = path
+        self.header = {"source": source, "index": index_name}
+        ranges = []
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+            if lines and lines[0] == self.header:
+                ranges = [tuple(line["rows"]) for line in lines[1:]]
+            else:
+                print(f"⚠️  Checkpoint {path} is for another file or index, starting over")
+                os.remove(path)
+        self._starts, self._ends = self._merge(ranges)
+        self.resumed_rows = sum(end - start for start, end in zip(self._starts, self._ends))
+        new_file = not os.path.exists(path)
+        self._file = open(path, "a")
+        if new_file:
+            self._write(self.header)
+    
+    @staticmethod
+    def _merge(ranges):
+        starts, ends = [], []
+        for start, end in sorted(ranges):
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        return starts, ends
+    
+    def done(self, row):
+        i = bisect.bisect_right(self._starts, row) - 1
+        return i >= 0 and row < self._ends[i]
+    
+    def record(self, start, end):
+        self._write({"rows": [start, end]})
+    
+    def record_rows(self, rows):
+        """Log sorted row numbers as their contiguous [start, end) runs."""
+        start = previous = None
+        for row in rows:
+            if start is not None and row != previous + 1:
+                self.record(start, previous + 1)
+                start = None
+            if start is None:
+                start = row
+            previous = row
+        if start is not None:
+            self.record(start, previous + 1)
+    
+    def _write(self, entry):
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+    
+    def close(self):
+        self._file.close()
+
+def estimate_vector_bytes(vector_id, values, metadata):
+    """Upper bound for one vector's share of the upsert request body."""
+    return len(vector_id) + len(json.dumps(metadata)) + len(values) * VALUE_BYTES + 64
+
+def iter_batches(vectors, max_request_bytes=UPSERT_MAX_REQUEST_BYTES, max_vectors=UPSERT_MAX_BATCH_VECTORS):
+    """Group (row, id, values, metadata) tuples into batches that stay under the request size limit."""
+    batch, batch_bytes = [], 0
+    for vector in vectors:
+        size = estimate_vector_bytes(vector[1], vector[2], vector[3])
+        if batch and (batch_bytes + size > max_request_bytes or len(batch) >= max_vectors):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(vector)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+def _error_status(error):
+    return getattr(error, "status", None) or getattr(error, "status_code", None)
+
+def _is_payload_too_large(error):
+    message = str(error).lower()
+    return _error_status(error) == 413 or "too large" in message or "exceeds" in message
+
+def _is_retryable(error):
+    """Throttling, server errors and network failures are retried; other client errors are not."""
+    status = _error_status(error)
+    return status is None or status == 429 or status >= 500
+
+def upsert_batch_with_retries(index, batch, max_retries=UPSERT_MAX_RETRIES,
+                              backoff_base=UPSERT_BACKOFF_BASE, backoff_cap=UPSERT_BACKOFF_CAP):
+    """
+    Upsert one batch, retrying with exponential backoff and full jitter.
+    
+    A batch the server rejects as too large is split in half and each half
+    retried. Returns (succeeded sub-batches, failed vector IDs).
+    """
+    attempt = 0
+    while True:
         try:
-            result = index.upsert(vectors=batch)
-            successful_uploads += len(batch)
-            print(f"   Batch {i//batch_size + 1}: Uploaded {len(batch)} vectors successfully")
+            index.upsert(vectors=[(vector_id, values, metadata) for _, vector_id, values, metadata in batch])
+            return [batch], []
         except Exception as e:
-            print(f"❌ Error uploading batch {i//batch_size + 1}: {str(e)}")
-            continue
+            if _is_payload_too_large(e) and len(batch) > 1:
+                middle = len(batch) // 2
+                left = upsert_batch_with_retries(index, batch[:middle], max_retries, backoff_base, backoff_cap)
+                right = upsert_batch_with_retries(index, batch[middle:], max_retries, backoff_base, backoff_cap)
+                return left[0] + right[0], left[1] + right[1]
+            if not _is_retryable(e) or attempt >= max_retries:
+                print(f"\n❌ Batch of {len(batch)} vectors (rows {batch[0][0]}-{batch[-1][0]}) failed "
+                      f"after {attempt + 1} attempts: {str(e)}")
+                return [], [vector_id for _, vector_id, _, _ in batch]
+            time.sleep(random.uniform(0, min(backoff_cap, backoff_base * 2 ** attempt)))
+            attempt += 1
+
+def upload_to_pinecone(index, vectors, checkpoint=None, max_in_flight=UPSERT_MAX_IN_FLIGHT,
+                       max_request_bytes=UPSERT_MAX_REQUEST_BYTES):
+    """
+    Upsert (row, id, values, metadata) tuples with a bounded number of batches in flight.
+    
+    Finished batches are logged to the checkpoint as they complete. Returns
+    {"upserted", "failed_ids", "seconds", "vectors_per_second"}.
+    """
+    start_time = time.time()
+    upserted = 0
+    failed_ids = []
+    progress = tqdm(desc="Upserting", unit="vec")
     
-    print(f"✅ Upload completed! Successfully uploaded {successful_uploads} out of {total_vectors} vectors")
+    def collect(future):
+        nonlocal upserted
+        succeeded, failed = future.result()
+        for batch in succeeded:
+            if checkpoint is not None:
+                checkpoint.record_rows([vector[0] for vector in batch])
+            upserted += len(batch)
+            progress.update(len(batch))
+        failed_ids.extend(failed)
+        progress.update(len(failed))
+    
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        pending = set()
+        for batch in iter_batches(vectors, max_request_bytes):
+            if len(pending) >= max_in_flight:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    collect(future)
+            pending.add(executor.submit(upsert_batch_with_retries, index, batch))
+        for future in wait(pending).done:
+            collect(future)
+    progress.close()
+    
+    seconds = time.time() - start_time
+    return {
+        "upserted": upserted,
+        "failed_ids": failed_ids,
+        "seconds": seconds,
+        "vectors_per_second": upserted / seconds if seconds > 0 else 0.0,
+    }
+
+def iter_vectors(csv_path, category_map=None, checkpoint=None, chunk_rows=UPSERT_CSV_CHUNK_ROWS, skipped_ids=None):
+    """
+    Stream (row, id, values, metadata) from the embeddings CSV, skipping rows the checkpoint has.
+    
+    IDs of rows with a missing or unparsable embedding are appended to skipped_ids.
+    """
+    category_map = category_map or {}
+    # dtype=str: a chunk with blank topic IDs would otherwise read them as floats ("123.0")
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_rows, dtype=str):
+        # Same header matching as SegmentIndex.from_csv (e.g. the "Catgeory" typo)
+        category_col = find_column(chunk, "category", "catgeory")
+        sub_category_col = find_column(chunk, "subcategory")
+        for idx, row in chunk.iterrows():
+            if checkpoint is not None and checkpoint.done(idx):
+                continue
+            
+            # topic_ID if available, otherwise the row number; the same IDs as pgvector and the local index
+            vector_id = segment_id(row.get('topic_ID'), idx)
+            
+            # Extract embedding vector
+            embedding_str = row.get('embedding', '')
+            if not isinstance(embedding_str, str) or not embedding_str:
+                print(f"⚠️  Skipping row {idx}: No embedding found")
+                if skipped_ids is not None:
+                    skipped_ids.append(vector_id)
+                continue
+                
+            try:
+                # Parse embedding string to list of floats
+                embedding = json.loads(embedding_str.replace("'", '"'))
+            except Exception as e:
+                print(f"⚠️  Skipping row {idx}: Could not parse embedding - {str(e)}")
+                if skipped_ids is not None:
+                    skipped_ids.append(vector_id)
+                continue
+            
+            # Prepare metadata with topic and topic_ID
+            metadata = {}
+            if 'topic' in row and pd.notna(row['topic']):
+                metadata['topic'] = str(row['topic'])
+            if 'topic_ID' in row and pd.notna(row['topic_ID']):
+                metadata['topic_ID'] = str(row['topic_ID'])
+            category, sub_category = category_map.get(str(row.get('topic_ID', '')), ('', ''))
+            if category_col is not None and pd.notna(row[category_col]):
+                category = str(row[category_col])
+            if sub_category_col is not None and pd.notna(row[sub_category_col]):
+                sub_category = str(row[sub_category_col])
+            metadata.update(category_metadata(category, sub_category))
+            
+            yield idx, vector_id, embedding, metadata
 
 def main():
+    parser = argparse.ArgumentParser(description="Upsert segment embeddings to Pinecone (resumable)")
+    parser.add_argument("--skip-download", action="store_true", help="Use the local CSV if it already exists")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <csv>.upsert-checkpoint.jsonl)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and upsert everything")
+    parser.add_argument("--concurrency", type=int, default=UPSERT_MAX_IN_FLIGHT, help="Batches in flight")
+    args = parser.parse_args()
+    
     # Load environment variables
     load_dotenv()
     api_key = os.getenv('PINECONE_API_KEY')
@@ -54,69 +290,62 @@ def main():
     bucket_name = "segments_embedding"
     source_blob_name = "embedding_output/Spark_Matching_Segments_with_embeddings.csv"
     local_file = "Spark_Matching_Segments_with_embeddings.csv"
+    checkpoint_path = args.checkpoint or f"{local_file}.upsert-checkpoint.jsonl"
     
     # Pinecone index details
     index_name = "audiencelab-embeddings-1024"
     
     try:
         # Download file from GCS
-        download_from_gcs(bucket_name, source_blob_name, local_file)
-        
-        # Read the CSV file
-        print("📖 Reading CSV file...")
-        df = pd.read_csv(local_file)
-        print(f"📊 Loaded {len(df)} records")
-        print(f"📋 Columns: {list(df.columns)}")
+        if not (args.skip_download and os.path.exists(local_file)):
+            download_from_gcs(bucket_name, source_blob_name, local_file)
         
         # Initialize Pinecone
         print("🔗 Connecting to Pinecone...")
         pc = pinecone.Pinecone(api_key=api_key)
-        index = pc.Index(index_name)
+        index = pc.Index(index_name, pool_threads=args.concurrency)
         
-        # Prepare vectors for upload
-        print("🔄 Preparing vectors for upload...")
-        vectors = []
-        
-        for idx, row in df.iterrows():
-            # Extract embedding vector
-            embedding_str = row.get('embedding', '')
-            if not embedding_str:
-                print(f"⚠️  Skipping row {idx}: No embedding found")
-                continue
-                
-            try:
-                # Parse embedding string to list of floats
-                embedding = json.loads(embedding_str.replace("'", '"'))
-                
-                # Create vector ID using topic_ID if available, otherwise use index
-                vector_id = str(row.get('topic_ID', f"segment_{idx}"))
-                
-                # Prepare metadata with topic and topic_ID
-                metadata = {}
-                if 'topic' in row and pd.notna(row['topic']):
-                    metadata['topic'] = str(row['topic'])
-                if 'topic_ID' in row and pd.notna(row['topic_ID']):
-                    metadata['topic_ID'] = str(row['topic_ID'])
-                
-                # Add to vectors list with metadata
-                vectors.append((vector_id, embedding, metadata))
-                
-            except Exception as e:
-                print(f"⚠️  Skipping row {idx}: Could not parse embedding - {str(e)}")
-                continue
+        # Categories for metadata filtering, joined by topic ID when the CSV lacks them
+        category_map = {}
+        if SEGMENT_CATEGORY_CSV and os.path.exists(SEGMENT_CATEGORY_CSV):
+            category_map = load_category_map(SEGMENT_CATEGORY_CSV)
+            print(f"📂 Loaded categories for {len(category_map)} topics")
         
-        print(f"✅ Prepared {len(vectors)} vectors for upload")
+        # Rows already upserted by an earlier (crashed) run are skipped
+        if args.restart and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        checkpoint = UpsertCheckpoint(checkpoint_path, source_fingerprint(local_file), index_name)
+        if checkpoint.resumed_rows:
+            print(f"⏩ Resuming: {checkpoint.resumed_rows} rows already upserted according to {checkpoint_path}")
         
-        # Upload to Pinecone
-        upload_to_pinecone(index, vectors)
+        # Stream the CSV straight into the upsert pipeline
+        print(f"📤 Upserting vectors from {local_file} ({args.concurrency} batches in flight)...")
+        skipped_ids = []
+        try:
+            vectors = iter_vectors(local_file, category_map, checkpoint, skipped_ids=skipped_ids)
+            report = upload_to_pinecone(index, vectors, checkpoint, max_in_flight=args.concurrency)
+        finally:
+            checkpoint.close()
         
-        # Don't clean up the file since it already exists
-        print(f"✅ Upload completed! File {local_file} remains for future use")
+        # Rows without a usable embedding are reported with the failed upserts
+        failed_ids = report["failed_ids"] + skipped_ids
+        print(f"✅ Upserted {report['upserted']} vectors in {report['seconds']:.1f}s "
+              f"({report['vectors_per_second']:.0f} vectors/s)")
+        if failed_ids:
+            failed_path = f"{checkpoint_path}.failed.json"
+            with open(failed_path, "w") as f:
+                json.dump(failed_ids, f)
+            print(f"❌ {len(failed_ids)} vectors failed; IDs written to {failed_path}: {failed_ids[:20]}"
+                  f"{' ...' if len(failed_ids) > 20 else ''}")
+            if skipped_ids:
+                print(f"💡 {len(skipped_ids)} of them had no usable embedding; fix those rows in {local_file}")
+            print("💡 Run again to retry them; finished batches are skipped")
+        else:
+            print(f"✅ No failed vectors. File {local_file} remains for future use")
         
     except Exception as e:
+        # The CSV and checkpoint are kept so the next run resumes where this one stopped
         print(f"❌ Error: {str(e)}")
-        if os.path.exists(local_file):
-            os.remove(local_file)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
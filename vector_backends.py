@@ -0,0 +1,591 @@
+#!/usr/bin/env python3
+"""
+One interface over every vector store the search servers can query.
+
+The servers used to be wired to exactly one store each: Pinecone, pgvector
+(``SupabaseVectorDB``) or a local engine from ``segment_index``.
+``VectorBackend`` gives every store the same small surface:
+
+- ``query`` / ``query_many`` / ``aquery`` return the usual result dicts
+  (topic, topic_id, score, segment_id and, with a metadata store,
+  description)
+- ``upsert`` takes segment records: dicts with segment_id, topic,
+  topic_id, vector and optional category/sub_category/description
+- ``delete`` takes segment IDs and returns how many existed
+- ``stats`` describes the backend for /stats
+
+``load_vector_backend`` picks the implementation from ``SEARCH_BACKEND``:
+
+    pinecone                          PineconeBackend (SDK + optional async client)
+    pgvector / supabase               PgVectorBackend over SupabaseVectorDB
+    local / exact / hnsw / int8 / binary  LocalBackend over a segment_index engine
+    fake                              FakeBackend, in-memory NumPy (tests, benchmarks)
+
+Running this module benchmarks the configured backends on the same query
+workload:
+
+    python vector_backends.py --backends local,hnsw,fake --queries 200
+"""
+
+import os
+import copy
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from segment_index import category_key
+
+logger = logging.getLogger(__name__)
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "pinecone").lower()
+LOCAL_ENGINES = ("local", "exact", "hnsw", "int8", "binary")
+PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "audiencelab-embeddings-1024")
+PINECONE_QUERY_CONCURRENCY = int(os.getenv("PINECONE_QUERY_CONCURRENCY", "8"))  # In-flight queries per query_many
+PINECONE_UPSERT_BATCH = int(os.getenv("PINECONE_UPSERT_BATCH", "100"))
+FAKE_BACKEND_SEGMENTS = int(os.getenv("FAKE_BACKEND_SEGMENTS", "10000"))
+FAKE_BACKEND_DIM = int(os.getenv("FAKE_BACKEND_DIM", "1024"))
+
+
+def category_metadata(category: Optional[str], sub_category: Optional[str]) -> Dict:
+    """Pinecone category fields: display values plus the normalized keys that filters match on."""
+    metadata = {}
+    for field, value in (('category', category), ('sub_category', sub_category)):
+        if value:
+            metadata[field] = value
+            metadata[f"{field}_key"] = category_key(value)
+    return metadata
+
+
+def category_filter(category: Optional[str] = None, sub_category: Optional[str] = None) -> Optional[Dict]:
+    """Pinecone metadata filter, case-insensitive like the local index (see category_metadata)."""
+    conditions = {}
+    if category:
+        conditions['category_key'] = {'$eq': category_key(category)}
+    if sub_category:
+        conditions['sub_category_key'] = {'$eq': category_key(sub_category)}
+    return conditions or None
+
+
+def _unit(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class VectorBackend:
+    """Query, batch query, upsert, delete and stats over one vector store."""
+
+    name = "base"
+
+    def __init__(self, metadata_store=None):
+        # Segment ID -> topic/description (metadata_store.py); optional for every backend
+        self.metadata_store = metadata_store
+
+    def query(self, vector: np.ndarray, top_k: int = 5, category: Optional[str] = None,
+              sub_category: Optional[str] = None) -> List[Dict]:
+        raise NotImplementedError
+
+    def query_many(self, vectors: np.ndarray, top_k: int = 5, category: Optional[str] = None,
+                   sub_category: Optional[str] = None) -> List[List[Dict]]:
+        """Results per query vector, in input order."""
+        return [self.query(vector, top_k, category, sub_category) for vector in vectors]
+
+    async def aquery(self, vector: np.ndarray, top_k: int = 5, category: Optional[str] = None,
+                     sub_category: Optional[str] = None) -> List[Dict]:
+        """Awaitable query; runs the blocking query in the default executor unless overridden."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.query, vector, top_k, category, sub_category)
+
+    def upsert(self, records: Iterable[Dict]) -> int:
+        """Insert or replace segments; returns how many were written."""
+        raise NotImplementedError(f"The {self.name} backend does not accept updates")
+
+    def delete(self, segment_ids: Iterable[str]) -> int:
+        """Remove segments; returns how many existed."""
+        raise NotImplementedError(f"The {self.name} backend does not accept updates")
+
+    @property
+    def mutable(self) -> bool:
+        return type(self).upsert is not VectorBackend.upsert
+
+    def dimension(self) -> Optional[int]:
+        """Vector dimension, when the backend knows it without a network call."""
+        return None
+
+    def stats(self) -> Dict:
+        return {"backend": self.name}
+
+    def reloaded(self, version: str) -> "VectorBackend":
+        """A backend for another catalog snapshot; remote stores keep their connections."""
+        return copy.copy(self)
+
+    def close(self):
+        pass
+
+    def _annotate(self, results: List[Dict]) -> List[Dict]:
+        store = self.metadata_store
+        return store.annotate(results) if store is not None else results
+
+
+class LocalBackend(VectorBackend):
+    """In-process engine from segment_index (exact/mutable, HNSW, int8 or binary)."""
+
+    def __init__(self, engine, metadata_store=None, name: str = "local"):
+        super().__init__(metadata_store)
+        self.engine = engine
+        self.name = name
+
+    def query(self, vector, top_k=5, category=None, sub_category=None):
+        return self._annotate(self.engine.query(vector, top_k, category, sub_category))
+
+    def query_many(self, vectors, top_k=5, category=None, sub_category=None):
+        # One matrix multiply per chunk of queries instead of a loop
+        return [self._annotate(results) for results in self.engine.query_many(vectors, top_k, category, sub_category)]
+
+    @property
+    def mutable(self) -> bool:
+        return hasattr(self.engine, "upsert")
+
+    def upsert(self, records):
+        if not self.mutable:
+            return super().upsert(records)
+        count = 0
+        for record in records:
+            self.engine.upsert(record['topic_id'], record['topic'], record['vector'],
+                               record.get('category', ''), record.get('sub_category', ''),
+                               segment_id=record.get('segment_id'))
+            count += 1
+        return count
+
+    def delete(self, segment_ids):
+        if not self.mutable:
+            return super().delete(segment_ids)
+        return sum(1 for segment_id in segment_ids if self.engine.delete(segment_id))
+
+    def dimension(self):
+        return self.engine.stats()["dimension"]
+
+    def stats(self):
+        return {"backend": self.name, **self.engine.stats()}
+
+    def reloaded(self, version):
+        return load_vector_backend(self.name, version=version)
+
+
+class PineconeBackend(VectorBackend):
+    """Pinecone through the SDK index; queries go through the async client when one is given."""
+
+    name = "pinecone"
+
+    def __init__(self, index, async_index=None, metadata_store=None,
+                 concurrency: int = PINECONE_QUERY_CONCURRENCY):
+        super().__init__(metadata_store)
+        self.index = index
+        self.async_index = async_index
+        self.concurrency = concurrency
+
+    @classmethod
+    def connect(cls, index_name: str = PINECONE_INDEX_NAME, async_client: bool = False,
+                metadata_store=None) -> "PineconeBackend":
+        """Connect with PINECONE_API_KEY/PINECONE_ENV from the environment (.env)."""
+        import pinecone
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        api_key = os.getenv("PINECONE_API_KEY")
+        environment = os.getenv("PINECONE_ENV")
+        if not api_key or not environment:
+            raise ValueError("❌ Missing Pinecone credentials in .env file.")
+
+        logger.info("🔗 Connecting to Pinecone...")
+        client = pinecone.Pinecone(api_key=api_key)
+        async_index = None
+        if async_client:
+            from pinecone_async import AsyncPineconeIndex
+            async_index = AsyncPineconeIndex.from_client(client, api_key, index_name)
+        logger.info("✅ Pinecone connected and cached!")
+        return cls(client.Index(index_name), async_index, metadata_store)
+
+    def _fetch_metadata(self, segment_ids: List[str]) -> Dict[str, Dict]:
+        """Pinecone's own metadata for IDs the local catalog is missing."""
+        if not segment_ids:
+            return {}
+        try:
+            vectors = self.index.fetch(ids=segment_ids).vectors
+        except Exception as e:
+            logger.warning(f"⚠️  Metadata fetch for {len(segment_ids)} uncataloged segments failed: {e}")
+            return {}
+        return {segment_id: dict(vector.metadata or {}) for segment_id, vector in vectors.items()}
+
+    async def _afetch_metadata(self, segment_ids: List[str]) -> Dict[str, Dict]:
+        if not segment_ids:
+            return {}
+        try:
+            return await self.async_index.fetch(segment_ids)
+        except Exception as e:
+            logger.warning(f"⚠️  Metadata fetch for {len(segment_ids)} uncataloged segments failed: {e}")
+            return {}
+
+    def _format(self, matches, remote_metadata: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+        store = self.metadata_store
+        if store is not None:
+            return store.join(((match['id'], match['score']) for match in matches), remote_metadata)
+        results = []
+        for match in matches:
+            metadata = match.get('metadata') or {}
+            results.append({
+                'topic': metadata.get('topic', 'N/A'),
+                'topic_id': metadata.get('topic_ID', 'N/A'),
+                'score': match['score'],
+                'segment_id': match['id']
+            })
+        return results
+
+    def query(self, vector, top_k=5, category=None, sub_category=None):
+        response = self.index.query(
+            vector=np.asarray(vector).tolist(),
+            top_k=top_k,
+            # IDs and scores only when the local store can supply the metadata
+            include_metadata=self.metadata_store is None,
+            filter=category_filter(category, sub_category)
+        )
+        matches = [{'id': match.id, 'score': match.score, 'metadata': match.metadata} for match in response.matches]
+        store = self.metadata_store
+        # Catalog drift: segments the local catalog lacks keep Pinecone's topic instead of 'N/A'
+        missing = store.missing(match['id'] for match in matches) if store is not None else []
+        return self._format(matches, self._fetch_metadata(missing))
+
+    def query_many(self, vectors, top_k=5, category=None, sub_category=None):
+        if len(vectors) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(vectors))) as executor:
+            # map() yields in submission order regardless of completion order
+            return list(executor.map(lambda vector: self.query(vector, top_k, category, sub_category), vectors))
+
+    async def aquery(self, vector, top_k=5, category=None, sub_category=None):
+        if self.async_index is None:
+            return await super().aquery(vector, top_k, category, sub_category)
+        # Awaited on the event loop: concurrent searches overlap their network waits
+        matches = await self.async_index.query(
+            vector,
+            top_k=top_k,
+            include_metadata=self.metadata_store is None,
+            filter=category_filter(category, sub_category)
+        )
+        store = self.metadata_store
+        missing = store.missing(match['id'] for match in matches) if store is not None else []
+        return self._format(matches, await self._afetch_metadata(missing))
+
+    def upsert(self, records):
+        count = 0
+        batch = []
+        for record in records:
+            metadata = {'topic': record['topic'], 'topic_ID': record['topic_id'],
+                        **category_metadata(record.get('category'), record.get('sub_category'))}
+            vector_id = str(record.get('segment_id') or record['topic_id'])
+            batch.append((vector_id, _unit(record['vector']).tolist(), metadata))
+            if len(batch) >= PINECONE_UPSERT_BATCH:
+                self.index.upsert(vectors=batch)
+                count, batch = count + len(batch), []
+        if batch:
+            self.index.upsert(vectors=batch)
+            count += len(batch)
+        return count
+
+    def delete(self, segment_ids):
+        segment_ids = [str(segment_id) for segment_id in segment_ids]
+        if not segment_ids:
+            return 0
+        # Pinecone's delete does not report which IDs existed, so look them up first
+        existing = list(self.index.fetch(ids=segment_ids).vectors)
+        if existing:
+            self.index.delete(ids=existing)
+        return len(existing)
+
+    def stats(self):
+        stats = {"backend": self.name, "query_concurrency": self.concurrency}
+        if self.async_index is not None:
+            stats["client"] = self.async_index.stats()
+        return stats
+
+    async def aclose(self):
+        if self.async_index is not None:
+            await self.async_index.aclose()
+
+
+class PgVectorBackend(VectorBackend):
+    """pgvector in Supabase through a connected SupabaseVectorDB."""
+
+    name = "pgvector"
+
+    def __init__(self, db, metadata_store=None):
+        super().__init__(metadata_store)
+        self.db = db
+
+    @classmethod
+    def connect(cls, metadata_store=None) -> "PgVectorBackend":
+        from supabase_setup import SupabaseVectorDB
+
+        db = SupabaseVectorDB()
+        if not db.connect():
+            raise ConnectionError("❌ Could not connect to Supabase (check SUPABASE_DB_URL)")
+        return cls(db, metadata_store)
+
+    def query(self, vector, top_k=5, category=None, sub_category=None):
+        # Rows carry their own description; the store only fills gaps
+        results = self.db.search_by_embedding(_unit(vector), top_k, category, sub_category)
+        if self.metadata_store is not None:
+            for result in results:
+                if not result.get('description'):
+                    result['description'] = (self.metadata_store.get(result['segment_id']) or {}).get('description', '')
+        return results
+
+    def query_many(self, vectors, top_k=5, category=None, sub_category=None):
+        if len(vectors) == 0:
+            return []
+        # Each query checks out its own pooled connection
+        workers = min(self.db.pool.max_size, len(vectors))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda vector: self.query(vector, top_k, category, sub_category), vectors))
+
+    def upsert(self, records):
+        from psycopg2.extras import Json, execute_values
+
+        rows = []
+        for record in records:
+            metadata = {key: record[key] for key in ('category', 'sub_category') if record.get(key)}
+            rows.append((str(record.get('segment_id') or record['topic_id']), record['topic'], str(record['topic_id']),
+                         record.get('description'), _unit(record['vector']).tolist(), Json(metadata)))
+        if not rows:
+            return 0
+        with self.db.pool.connection() as conn, conn.cursor() as cur:
+            execute_values(cur, """
+                INSERT INTO audience_segments
+                (segment_id, topic, topic_id, description, embedding, metadata)
+                VALUES %s
+                ON CONFLICT (segment_id) DO UPDATE SET
+                topic = EXCLUDED.topic,
+                topic_id = EXCLUDED.topic_id,
+                description = EXCLUDED.description,
+                embedding = EXCLUDED.embedding,
+                metadata = EXCLUDED.metadata;
+            """, rows)
+            conn.commit()
+        return len(rows)
+
+    def delete(self, segment_ids):
+        segment_ids = [str(segment_id) for segment_id in segment_ids]
+        if not segment_ids:
+            return 0
+        with self.db.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM audience_segments WHERE segment_id = ANY(%s);", (segment_ids,))
+            deleted = cur.rowcount
+            conn.commit()
+        return deleted
+
+    def dimension(self):
+        return self.db.embedding_dimension
+
+    def stats(self):
+        return {"backend": self.name, "segments": self.db.get_segment_count(), "dimension": self.dimension(),
+                "connection_pool": self.db.pool_stats()}
+
+    def close(self):
+        self.db.close()
+
+
+class FakeBackend(VectorBackend):
+    """Brute-force in-memory store with the full interface; for tests and benchmark baselines."""
+
+    name = "fake"
+
+    def __init__(self, dim: int = FAKE_BACKEND_DIM, metadata_store=None):
+        super().__init__(metadata_store)
+        self.dim = dim
+        self._records: Dict[str, Dict] = {}
+        self._matrix = None  # Rebuilt lazily after writes
+        self._ids: List[str] = []
+
+    @classmethod
+    def random(cls, count: int = FAKE_BACKEND_SEGMENTS, dim: int = FAKE_BACKEND_DIM,
+               seed: int = 42) -> "FakeBackend":
+        """A store of random unit vectors with synthetic topics and categories."""
+        rng = np.random.default_rng(seed)
+        backend = cls(dim)
+        backend.upsert({
+            'segment_id': f"fake-{i}",
+            'topic': f"Fake segment {i}",
+            'topic_id': f"FAKE_{i}",
+            'category': f"category-{i % 10}",
+            'sub_category': f"sub-category-{i % 50}",
+            'vector': rng.standard_normal(dim),
+        } for i in range(count))
+        return backend
+
+    @classmethod
+    def from_segments(cls, segments, metadata_store=None) -> "FakeBackend":
+        """Copy a SegmentIndex catalog into memory (same workload as the local engines)."""
+        backend = cls(segments.dim, metadata_store)
+        backend.upsert({
+            'segment_id': segments.ids[row],
+            'topic': segments.topics[row],
+            'topic_id': segments.topic_ids[row],
+            'category': segments.categories[row],
+            'sub_category': segments.sub_categories[row],
+            'vector': segments.vectors[row],
+        } for row in range(len(segments)))
+        return backend
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _rows(self, category: Optional[str], sub_category: Optional[str]) -> np.ndarray:
+        if self._matrix is None:
+            self._ids = list(self._records)
+            self._matrix = (np.vstack([self._records[key]['vector'] for key in self._ids])
+                            if self._ids else np.zeros((0, self.dim), dtype=np.float32))
+        if not category and not sub_category:
+            return np.arange(len(self._ids))
+        return np.array([row for row, key in enumerate(self._ids)
+                         if (not category or category_key(self._records[key]['category']) == category_key(category))
+                         and (not sub_category or category_key(self._records[key]['sub_category']) == category_key(sub_category))],
+                        dtype=np.int64)
+
+    def query(self, vector, top_k=5, category=None, sub_category=None):
+        vector = _unit(vector)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Expected a {self.dim}-dim query vector, got {vector.shape[0]}")
+        rows = self._rows(category, sub_category)
+        scores = self._matrix[rows] @ vector
+        results = []
+        for i in np.argsort(-scores, kind="stable")[:top_k]:
+            record = self._records[self._ids[rows[i]]]
+            results.append({
+                'topic': record['topic'],
+                'topic_id': record['topic_id'],
+                'score': float(scores[i]),
+                'segment_id': record['segment_id']
+            })
+        return self._annotate(results)
+
+    def upsert(self, records):
+        count = 0
+        for record in records:
+            vector = _unit(record['vector'])
+            if vector.shape[0] != self.dim:
+                raise ValueError(f"Expected a {self.dim}-dim segment vector, got {vector.shape[0]}")
+            segment_id = str(record.get('segment_id') or record['topic_id'])
+            self._records[segment_id] = {
+                'segment_id': segment_id,
+                'topic': record['topic'],
+                'topic_id': str(record['topic_id']),
+                'category': record.get('category') or '',
+                'sub_category': record.get('sub_category') or '',
+                'vector': vector,
+            }
+            count += 1
+        self._matrix = None
+        return count
+
+    def delete(self, segment_ids):
+        deleted = sum(1 for segment_id in segment_ids if self._records.pop(str(segment_id), None) is not None)
+        if deleted:
+            self._matrix = None
+        return deleted
+
+    def dimension(self):
+        return self.dim
+
+    def stats(self):
+        return {"backend": self.name, "segments": len(self), "dimension": self.dim}
+
+
+def load_vector_backend(name: str = SEARCH_BACKEND, metadata_store=None, version: Optional[str] = None,
+                        async_client: bool = False) -> VectorBackend:
+    """
+    Build the backend named by SEARCH_BACKEND.
+
+    Local engines load the given catalog snapshot (or the build cache when
+    no version is given); async_client adds the pooled async Pinecone client.
+    """
+    name = name.lower()
+    if name in LOCAL_ENGINES:
+        if version is not None:
+            from index_snapshots import load_snapshot
+            engine = load_snapshot(version, name)
+        else:
+            from segment_index import load_local_index
+            engine = load_local_index(name)
+        return LocalBackend(engine, metadata_store, name)
+    if name == "pinecone":
+        return PineconeBackend.connect(async_client=async_client, metadata_store=metadata_store)
+    if name in ("pgvector", "supabase"):
+        return PgVectorBackend.connect(metadata_store)
+    if name == "fake":
+        return FakeBackend.random()
+    raise ValueError(f"Unknown SEARCH_BACKEND '{name}'")
+
+
+def benchmark_backends(backends: Dict[str, VectorBackend], queries: np.ndarray, k: int = 10) -> List[Dict]:
+    """Single-query latency, batch throughput and recall against the first backend, same queries for all."""
+    reference = None
+    report = []
+    for name, backend in backends.items():
+        latencies = []
+        results = []
+        for query in queries:
+            start_time = time.perf_counter()
+            results.append(backend.query(query, k))
+            latencies.append(time.perf_counter() - start_time)
+        start_time = time.perf_counter()
+        backend.query_many(queries, k)
+        batch_seconds = time.perf_counter() - start_time
+
+        ids = [{result['segment_id'] for result in found} for found in results]
+        if reference is None:
+            reference = ids
+        recall = (sum(len(expected & found) for expected, found in zip(reference, ids))
+                  / max(sum(len(expected) for expected in reference), 1))
+        latencies_ms = 1000 * np.array(latencies)
+        report.append({
+            "backend": name,
+            "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+            "qps": round(float(len(queries) / latencies_ms.sum() * 1000), 1) if latencies_ms.sum() > 0 else 0.0,
+            "batch_qps": round(len(queries) / batch_seconds, 1) if batch_seconds > 0 else 0.0,
+            "recall": round(recall, 4),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Benchmark vector backends on one query workload")
+    parser.add_argument("--backends", default="local,fake",
+                        help="Comma-separated SEARCH_BACKEND names; the first one is the recall reference")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    from segment_index import SegmentIndex, sample_queries
+
+    print("🧪 Vector backend benchmark")
+    segments = SegmentIndex.load_or_build()
+    queries = sample_queries(segments, args.queries)
+    backends = {}
+    for name in args.backends.split(","):
+        name = name.strip().lower()
+        # The fake store holds the same catalog so its recall is comparable
+        backends[name] = FakeBackend.from_segments(segments) if name == "fake" else load_vector_backend(name)
+    print(f"📊 {len(queries)} queries, top {args.top_k}, {len(segments)} segments")
+    for row in benchmark_backends(backends, queries, args.top_k):
+        print(f"   {row['backend']:>10}: p50 {row['p50_ms']:.2f}ms  p95 {row['p95_ms']:.2f}ms  "
+              f"{row['qps']:.0f} qps  batch {row['batch_qps']:.0f} qps  recall@{args.top_k} {row['recall']:.3f}")
+    for backend in backends.values():
+        backend.close()